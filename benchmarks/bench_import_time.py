@@ -0,0 +1,140 @@
+"""
+Benchmark of the time it takes to import the plugin.
+
+QGIS imports the plugin package at every start, also for users who never
+open the plugin, so importing it must stay cheap. This imports the
+plugin package in a new interpreter with '-X importtime', after the
+modules QGIS has already imported when it loads plugins (qgis.core,
+qgis.gui and the Qt modules), and reads the time of the plugin's own
+imports from the report. The best of a few runs is compared with a
+budget, and the modules that must only be imported when the plugin is
+used are checked to not have been imported.
+
+Run it with the Python of a QGIS installation, e.g. from the OSGeo4W
+shell or with PYTHONPATH set to the QGIS Python packages.
+
+Usage:
+    python benchmarks/bench_import_time.py [--budget-ms 50] [--repeat 5]
+        [--top 10]
+"""
+import argparse
+import subprocess
+import sys
+from os.path import abspath, basename, dirname
+
+ROOT = dirname(dirname(abspath(__file__)))
+
+# Imported by QGIS before it loads the plugins
+PRELOADED_MODULES = ['qgis.core', 'qgis.gui', 'qgis.PyQt.QtCore',
+                     'qgis.PyQt.QtGui', 'qgis.PyQt.QtWidgets', 'logging',
+                     'json']
+
+# Only imported when the plugin is used, see the plugin's run()
+DEFERRED_MODULES = ['pandas', 'numpy', 'requests', 'PyQt5.uic',
+                    '.ui.dialog_helpers', '.util.gml_processor',
+                    '.util.style_search_task', '.util.warm_up_task',
+                    '.util.offline_bundle', '.util.offline_bundle_task']
+
+MARKER = 'bench_import_time: importing the plugin'
+
+
+def import_plugin():
+    """
+    Import the plugin in a new interpreter.
+    output:
+        list: (module, self us, cumulative us) of the modules the plugin
+        imported, in the order of the importtime report
+    """
+    code = (
+        "import sys\n"
+        "sys.path.insert(0, {0!r})\n"
+        "{1}\n"
+        "print({2!r}, file=sys.stderr, flush=True)\n"
+        "import {3}\n".format(
+            dirname(ROOT),
+            '\n'.join('import ' + module for module in PRELOADED_MODULES),
+            MARKER, basename(ROOT)))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit("Importing the plugin failed:\n" + result.stderr)
+    return parse_importtime(result.stderr)
+
+
+def parse_importtime(report):
+    """
+    Parse the '-X importtime' lines written after MARKER.
+    input:
+        report: str, stderr of the interpreter
+    output:
+        list: (module, self us, cumulative us)
+    """
+    lines = report.splitlines()
+    if MARKER in lines:
+        lines = lines[lines.index(MARKER) + 1:]
+    imports = []
+    for line in lines:
+        if not line.startswith('import time:'):
+            continue
+        fields = [field.strip()
+                  for field in line[len('import time:'):].split('|')]
+        if not fields[0].isdigit():
+            # The header line
+            continue
+        imports.append((fields[2], int(fields[0]), int(fields[1])))
+    return imports
+
+
+def get_deferred_imports(imports):
+    """Return the deferred modules the plugin imported."""
+    package = basename(ROOT)
+    modules = {module for module, _, _ in imports}
+    deferred = []
+    for module in DEFERRED_MODULES:
+        if module.startswith('.'):
+            module = package + module
+        if module in modules:
+            deferred.append(module)
+    return deferred
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--budget-ms', type=float, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    # Every import in the report is nested in the plugin's import, whose
+    # cumulative time is the total
+    runs = [import_plugin() for _ in range(args.repeat)]
+    totals = [sum(self_us for _, self_us, _ in imports)
+              for imports in runs]
+    best = min(range(len(runs)), key=totals.__getitem__)
+    imports = runs[best]
+
+    print("{0} modules imported by the plugin".format(len(imports)))
+    print("{0:>10} {1:>10}  module".format('self ms', 'total ms'))
+    for module, self_us, cumulative_us in sorted(
+            imports, key=lambda item: item[2], reverse=True)[:args.top]:
+        print("{0:>10.1f} {1:>10.1f}  {2}".format(
+            self_us / 1000, cumulative_us / 1000, module))
+
+    total_ms = totals[best] / 1000
+    print("import time: {0:.1f} ms (best of {1}), budget {2:.1f} ms"
+          .format(total_ms, len(runs), args.budget_ms))
+
+    failures = []
+    deferred = get_deferred_imports(imports)
+    if deferred:
+        failures.append("Imported when the plugin is loaded: {}"
+                        .format(', '.join(deferred)))
+    if total_ms > args.budget_ms:
+        failures.append("Import time {0:.1f} ms is over the budget of "
+                        "{1:.1f} ms".format(total_ms, args.budget_ms))
+    if failures:
+        sys.exit('\n'.join(failures))
+
+
+if __name__ == '__main__':
+    main()
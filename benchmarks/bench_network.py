@@ -0,0 +1,119 @@
+"""
+Benchmark of the network path against the local Geonorge stub.
+
+Starts geonorge_stub_server.py in-process on a fixture directory written
+by record_fixtures.py, points 'endpoint_url' at it, disables the
+caches and keeps the style file URLs of the stub on http, then measures:
+
+    register   GeonorgeAPI.get_schemas()
+    themes     GeonorgeAPI.get_styles_for_theme() for every recorded theme
+    styles     StyleFileCache.fetch() of every recorded style file
+
+The results only depend on the fixtures and the injected latency,
+bandwidth and errors, so runs can be compared between changes.
+
+Usage:
+    python benchmarks/bench_network.py FIXTURE_DIR [--latency-ms 50]
+        [--jitter-ms 0] [--bandwidth-kbps 0] [--error-rate 0.0]
+        [--repeat 3]
+"""
+import argparse
+import sys
+from os.path import abspath, dirname
+from time import perf_counter
+from urllib.parse import parse_qsl, urlsplit
+
+sys.path.insert(0, dirname(abspath(__file__)))
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from PyQt5.QtCore import QCoreApplication  # noqa: E402
+from geonorge_stub_server import (  # noqa: E402
+    StubOptions, get_endpoint_urls, start_server)
+from util.config_loader import ConfigLoader  # noqa: E402
+
+
+def use_stub_config(endpoint_url):
+    """
+    Load the plugin config with the stub endpoints and no caches. The stub
+    only speaks http, so style file URLs are not upgraded to https.
+    """
+    load_qgis_config = ConfigLoader.load_qgis_config
+
+    def load_stub_config(config_loader):
+        config = dict(load_qgis_config(config_loader))
+        config['endpoint_url'] = endpoint_url
+        config['cache'] = dict(config.get('cache', {}), enabled=False)
+        config['network'] = dict(config.get('network', {}),
+                                 upgrade_to_https=False)
+        return config
+
+    ConfigLoader.load_qgis_config = load_stub_config
+
+
+def get_recorded_requests(server):
+    """Return the recorded themes and the style file URLs on the stub."""
+    themes = []
+    style_urls = []
+    for key, response in server.responses.items():
+        if response.get('rewrite_hosts'):
+            themes.append(dict(parse_qsl(urlsplit(key).query))['text'])
+        elif not key.endswith('.json'):
+            style_urls.append(server.base_url + key)
+    return themes, style_urls
+
+
+def measure(name, server, function, repeat):
+    timings = []
+    for _ in range(repeat):
+        requests_before = server.get_request_total()
+        started = perf_counter()
+        function()
+        timings.append(perf_counter() - started)
+        requests = server.get_request_total() - requests_before
+    print("{0:<10} {1:>9.3f}s {2:>9.3f}s {3:>9}".format(
+        name, min(timings), sum(timings) / len(timings), requests))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('fixture_dir')
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--bandwidth-kbps', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    application = QCoreApplication([])  # noqa: F841
+    server = start_server(args.fixture_dir, options=StubOptions(
+        args.latency_ms, args.jitter_ms, args.bandwidth_kbps,
+        args.error_rate, seed=args.seed))
+    use_stub_config(get_endpoint_urls(server, args.fixture_dir))
+
+    # Imported after the config is redirected to the stub
+    from util.geonorge_apis import GeonorgeAPI
+    from util.style_file_cache import StyleFileCache
+
+    themes, style_urls = get_recorded_requests(server)
+    print("Stub on {0}: {1} themes, {2} style files, latency {3} ms".format(
+        server.base_url, len(themes), len(style_urls), args.latency_ms))
+    print("{0:<10} {1:>10} {2:>10} {3:>9}".format(
+        'stage', 'best', 'mean', 'requests'))
+
+    geonorge_api = GeonorgeAPI()
+
+    def fetch_themes():
+        GeonorgeAPI.theme_responses.clear()
+        for theme in themes:
+            geonorge_api.get_styles_for_theme(theme)
+
+    measure('register', server, geonorge_api.get_schemas, args.repeat)
+    measure('themes', server, fetch_themes, args.repeat)
+    measure('styles', server, lambda: StyleFileCache().fetch(style_urls),
+            args.repeat)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
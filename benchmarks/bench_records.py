@@ -0,0 +1,266 @@
+"""
+Benchmark of the data passed through a style search, DataFrames against
+records.
+
+Builds synthetic GML layers (10 000 by default) spread over GML files
+and the styles of a theme, and runs the steps of a style search that do
+not touch the network: collecting the GML layers, grouping them by GML
+file, merging the chosen styles with the layers, adding the style file
+strings, collecting the layers with styles, merging them with the GML
+layers for the dialog and selecting the checked layers. This is done
+with DataFrames (how it used to work) and with the records of
+util/records.py, and both must select the same layers with styles.
+
+The style of every (GML node, geometry) pair is chosen once up front
+with LayerStylesUpdater.get_style_name, as both ways share it, and the
+style files are put in the run's style file strings, so nothing is
+fetched. Logging is turned down to warnings so only the data handling
+is measured.
+
+For each way the time of a run and the peak memory allocated during a
+run (tracemalloc, in a separate run) are printed. Finally it checks
+that importing util.gml_processor does not import pandas.
+
+Usage:
+    python benchmarks/bench_records.py [--layers 10000]
+        [--layers-per-file 20] [--styles 400]
+"""
+import argparse
+import logging
+import subprocess
+import sys
+import tracemalloc
+from os.path import abspath, dirname
+from threading import Event
+from time import perf_counter
+
+import pandas as pd
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from util.layers_utils import LayersUtils as lu  # noqa: E402
+from util.logging_setup import logger as log  # noqa: E402
+from util.records import LayerRecord, LayerStyle, StyleRecord  # noqa: E402
+from util.style_utils import LayerStylesUpdater as lsu  # noqa: E402
+
+GEOMETRIES = ['Point', 'LineString', 'Polygon']
+SUFFIXES = ['', ' punkt', ' linje', ' flate']
+SELECTED_COLUMNS = list(LayerStyle.REPORT_COLUMNS) + ['style_file_string']
+
+
+def build_layer_details(layers, layers_per_file):
+    """(gml node, geometry, file type, layer name, file path, root)"""
+    layer_details = []
+    for i in range(layers):
+        root_filename = 'file{}'.format(i // layers_per_file)
+        layer_details.append((
+            'Objekt{}'.format(i % 60),
+            GEOMETRIES[i % 3] if i % 97 else 'null',
+            '.gml',
+            'Objekt{0}_{1}'.format(i % 60, i),
+            '/data/{}.gml'.format(root_filename),
+            root_filename,
+        ))
+    return layer_details
+
+
+def build_json_styles(styles):
+    """Files of a theme as returned by the cartography API."""
+    json_styles = []
+    for i in range(styles):
+        json_styles.append({
+            'Uuid': str(i),
+            'Name': 'Objekt{0}{1}'.format(i // 8, SUFFIXES[i % 4]),
+            'OwnerDataset': 'Dataset',
+            'Format': ['qml', 'sld', 'lyr'][i % 3],
+            'DatasetName': 'Dataset',
+            'Status': 'Gyldig',
+            'Theme': 'Tema',
+            'FileUrl': 'https://example.com/symbol/{}'.format(i),
+            'DetailsUrl': 'https://example.com/details/{}'.format(i),
+        })
+    return json_styles
+
+
+def choose_styles(layer_details, json_styles):
+    styles = lsu.add_geometry_keywords([
+        StyleRecord.from_cartography(item) for item in json_styles
+        if item['Format'] in ['sld', 'qml']])
+    return {
+        (gml_node, geometry): lsu.get_style_name(
+            gml_node, geometry, styles, 'qml')
+        for gml_node, geometry, *_ in layer_details}
+
+
+def preload_style_files(json_styles):
+    lsu.clear_style_file_strings()
+    for item in json_styles:
+        style_url = lsu.get_https_url(item['FileUrl'])
+        lsu.style_file_strings[style_url] = '<qgis/>'
+        lsu.style_file_fetches[style_url] = Event()
+        lsu.style_file_fetches[style_url].set()
+
+
+def run_dataframes(layer_details, json_styles, style_decisions, checked):
+    layers_df = pd.DataFrame(layer_details, columns=[
+        'Gml_Node', 'Geometry', 'FileType', 'Layer_Name', 'File_Path',
+        'Root_Filename']).iloc[::-1]
+    layers_df = layers_df[(layers_df['FileType'] == '.gml') &
+                          (layers_df['Geometry'].str.lower() != 'null')]
+
+    styles_df = pd.DataFrame(json_styles)
+    styles_df = styles_df.rename(columns={'Name': 'StyleName'})
+    styles_df = styles_df[styles_df['Format'].isin(['sld', 'qml'])]
+
+    layer_styles_dfs = []
+    for _, group in layers_df.groupby('Root_Filename'):
+        group = pd.DataFrame(group)
+        group['style_name'] = [
+            style_decisions[node_geometry] for node_geometry in
+            zip(group['Gml_Node'], group['Geometry'])]
+        merged = pd.merge(group, styles_df, how='outer',
+                          right_on='StyleName', left_on='style_name')
+        merged = merged[['Gml_Node', 'Geometry', 'Layer_Name', 'StyleName',
+                         'Format', 'DatasetName', 'Status', 'FileUrl']]
+        merged.columns = ['GmlNode', 'Geometry', 'LayerName', 'StyleName',
+                          'Format', 'DatasetName', 'Status', 'FileUrl']
+        layers_with_styles = merged.loc[
+            merged['GmlNode'].notnull() & merged['StyleName'].notnull()]
+        layers_with_styles = layers_with_styles.copy()
+
+        file_urls = layers_with_styles['FileUrl'].where(
+            layers_with_styles['Format'].isin(['sld', 'qml']))
+        layers_with_styles['Style_file_string'] = [
+            lsu.style_file_strings.get(lsu.get_https_url(file_url))
+            if isinstance(file_url, str) else None
+            for file_url in file_urls]
+        layer_styles_dfs.append(layers_with_styles[
+            layers_with_styles['Style_file_string'].notnull()])
+    layer_styles_df = pd.concat(layer_styles_dfs)
+
+    # The dialog lists the GML layers with their styles per GML file
+    dialog_df = pd.merge(
+        layer_styles_df, layers_df, how='outer',
+        left_on=['LayerName', 'Geometry'],
+        right_on=['Layer_Name', 'Geometry'])
+    dialog_df = dialog_df[['Geometry', 'Format', 'Style_file_string',
+                           'Layer_Name', 'StyleName', 'Root_Filename',
+                           'GmlNode']]
+    for _, group in dialog_df.groupby('Root_Filename'):
+        for _, row in group.iterrows():
+            row['StyleName']
+
+    layers_index = pd.MultiIndex.from_frame(
+        layer_styles_df[['LayerName', 'Geometry']])
+    selected_df = layer_styles_df[layers_index.isin(checked)]
+    return [tuple(row) for row in selected_df.itertuples(index=False)]
+
+
+def run_records(layer_details, json_styles, style_decisions, checked):
+    layers = [
+        LayerRecord(gml_node=gml_node, geometry=geometry, file_type=file_type,
+                    layer_name=layer_name, file_path=file_path,
+                    root_filename=root_filename)
+        for gml_node, geometry, file_type, layer_name, file_path,
+        root_filename in reversed(layer_details)]
+    layers = [layer for layer in layers if layer.file_type == '.gml' and
+              layer.geometry.lower() != 'null']
+
+    styles = lsu.filter_styles_by_formats(
+        [StyleRecord.from_cartography(item) for item in json_styles])
+
+    layer_styles = []
+    for _, group in lu.group_layers_by_root_filename(layers):
+        style_names = [style_decisions[layer.gml_node, layer.geometry]
+                       for layer in group]
+        merged = lu.merge_and_rename_styles_with_layers(
+            group, style_names, styles)
+        layers_with_styles = lu.filter_layers_with_styles(merged)
+
+        file_strings = lsu.add_file_strings(layers_with_styles)
+        for layer_style, file_string in zip(layers_with_styles,
+                                            file_strings):
+            layer_style.style_file_string = file_string
+        layer_styles.extend(
+            layer_style for layer_style in layers_with_styles
+            if layer_style.style_file_string is not None)
+
+    # The dialog lists the GML layers with their styles per GML file
+    dialog_layers = lu.merge_layers_with_styles_and_gml_layers(
+        layers, layer_styles)
+    for _, group in lu.group_layers_by_root_filename(dialog_layers):
+        for layer_style in group:
+            layer_style.style_name
+
+    selected = lu.select_layers(layer_styles, checked)
+    return [tuple(getattr(layer_style, name) for name in SELECTED_COLUMNS)
+            for layer_style in selected]
+
+
+def measure(run, *args):
+    started = perf_counter()
+    result = run(*args)
+    elapsed = perf_counter() - started
+
+    tracemalloc.start()
+    run(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def imports_pandas(module):
+    """Check in a new interpreter if importing module imports pandas."""
+    code = ("import sys\n"
+            "sys.path.insert(0, {0!r})\n"
+            "import {1}\n"
+            "print('pandas' in sys.modules)\n".format(ROOT, module))
+    output = subprocess.run([sys.executable, '-c', code],
+                            capture_output=True, text=True, check=True)
+    return output.stdout.strip().splitlines()[-1] == 'True'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--layers', type=int, default=10000)
+    parser.add_argument('--layers-per-file', type=int, default=20)
+    parser.add_argument('--styles', type=int, default=400)
+    args = parser.parse_args()
+
+    log.setLevel(logging.WARNING)
+    layer_details = build_layer_details(args.layers, args.layers_per_file)
+    json_styles = build_json_styles(args.styles)
+    style_decisions = choose_styles(layer_details, json_styles)
+    preload_style_files(json_styles)
+    # Every other layer is checked
+    checked = [(layer_name, geometry)
+               for _, geometry, _, layer_name, *_ in layer_details[::2]]
+
+    print("{0} layers in {1} GML files, {2} styles".format(
+        len(layer_details), -(-args.layers // args.layers_per_file),
+        len(json_styles)))
+    print("{0:<12} {1:>10} {2:>12}".format('data', 'time', 'peak memory'))
+    results = []
+    for name, run in [('DataFrames', run_dataframes),
+                      ('records', run_records)]:
+        result, elapsed, peak = measure(
+            run, layer_details, json_styles, style_decisions, checked)
+        results.append(result)
+        print("{0:<12} {1:>9.3f}s {2:>9.1f} MiB".format(
+            name, elapsed, peak / 2 ** 20))
+
+    # NaN in the DataFrame rows is None in the records
+    expected = [tuple(None if value != value else value for value in row)
+                for row in results[0]]
+    if expected != results[1]:
+        sys.exit("DataFrames and records select different layers")
+    print("{} layers with styles selected".format(len(results[1])))
+
+    if imports_pandas('util.gml_processor'):
+        sys.exit("util.gml_processor imports pandas")
+    print("util.gml_processor does not import pandas")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark of schema register matching.
+
+Builds a synthetic register with a few thousand 'documentreference'
+entries and matches many schema locations against it: exact matches,
+matches where only the scheme differs, and misses. Compares a scan of
+the register DataFrame per location (how matching used to work) with
+SchemaRegisterIndex, and checks that both find the same rows.
+
+Usage:
+    python benchmarks/bench_register_matching.py [--entries 5000]
+                                                 [--locations 2000]
+"""
+import argparse
+import random
+import sys
+from os.path import abspath, dirname
+from time import perf_counter
+
+import pandas as pd
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from util.schema_utils import SchemaRegisterIndex  # noqa: E402
+
+
+def build_register(entries):
+    document_references = []
+    for i in range(entries):
+        scheme = 'https' if i % 3 else 'http'
+        document_references.append(
+            '{0}://skjema.geonorge.no/SOSI/produktspesifikasjon/'
+            'Produkt{1}/{2}/produkt{1}.xsd'.format(scheme, i, 2000 + i % 25))
+    return pd.DataFrame({'documentreference': document_references,
+                         'label': ['Produkt{}'.format(i)
+                                   for i in range(entries)]})
+
+
+def build_locations(register, count, seed=0):
+    generator = random.Random(seed)
+    document_references = list(register['documentreference'])
+    locations = []
+    for i in range(count):
+        document_reference = generator.choice(document_references)
+        kind = i % 3
+        if kind == 0:
+            locations.append(document_reference.upper())
+        elif kind == 1:
+            scheme, rest = document_reference.split('://', 1)
+            other_scheme = 'http' if scheme == 'https' else 'https'
+            locations.append('{0}://{1}'.format(other_scheme, rest))
+        else:
+            locations.append(document_reference.replace('.xsd', '_x.xsd'))
+    return locations
+
+
+def scan_register(geonorge_schemas, schema_location):
+    """Match one location by scanning the register."""
+    matching_schema = geonorge_schemas[
+        geonorge_schemas['documentreference'].str.lower() ==
+        schema_location.lower()]
+    if matching_schema.empty:
+        trimmed = schema_location.split('://', 1)[-1]
+        matching_schema = geonorge_schemas[
+            geonorge_schemas['documentreference'].str.lower().str.endswith(
+                trimmed.lower())]
+    if matching_schema.empty:
+        return None
+    return geonorge_schemas.index.get_loc(matching_schema.index[0])
+
+
+def find_in_index(index, schema_location):
+    position = index.find_exact(schema_location)
+    if position is None:
+        position = index.find_suffix(schema_location.split('://', 1)[-1])
+    return position
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--entries', type=int, default=5000)
+    parser.add_argument('--locations', type=int, default=2000)
+    args = parser.parse_args()
+
+    register = build_register(args.entries)
+    locations = build_locations(register, args.locations)
+
+    started = perf_counter()
+    scanned = [scan_register(register, location) for location in locations]
+    scan_time = perf_counter() - started
+
+    started = perf_counter()
+    index = SchemaRegisterIndex(register['documentreference'])
+    build_time = perf_counter() - started
+    started = perf_counter()
+    indexed = [find_in_index(index, location) for location in locations]
+    lookup_time = perf_counter() - started
+
+    if scanned != indexed:
+        sys.exit("Index and scan disagree")
+    print("{0} register entries, {1} locations ({2} matched)".format(
+        args.entries, args.locations,
+        sum(position is not None for position in indexed)))
+    print("scan:  {0:8.3f}s  ({1:8.1f} us per location)".format(
+        scan_time, scan_time / args.locations * 1e6))
+    print("index: {0:8.3f}s  ({1:8.1f} us per location, built in "
+          "{2:.3f}s)".format(lookup_time,
+                             lookup_time / args.locations * 1e6,
+                             build_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark of the schemaLocation header reader.
+
+Generates synthetic GML files of growing size and measures the time and
+peak memory used to read the schema locations. The streaming reader only
+reads the root start tag, so both numbers should stay flat as the file
+grows. Use --full-parse to compare against parsing the whole document.
+Before measuring, it checks that a file with a malformed header is
+reported as having no schema location instead of raising.
+
+Usage:
+    python benchmarks/bench_schemalocation.py [--sizes-mb 1 10 100]
+                                              [--full-parse]
+"""
+import argparse
+import sys
+import tracemalloc
+from os import remove
+from os.path import abspath, dirname, getsize
+from tempfile import mkstemp
+from time import perf_counter
+from xml.etree.ElementTree import parse
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from util.xml_utils import read_schema_location  # noqa: E402
+
+HEADER = (
+    '<?xml version="1.0" encoding="utf-8"?>\n'
+    '<gml:FeatureCollection xmlns:gml="http://www.opengis.net/gml/3.2" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xmlns:app="https://skjema.geonorge.no/SOSI/produktspesifikasjon/'
+    'Reguleringsplanforslag/20230701" '
+    'xsi:schemaLocation="https://skjema.geonorge.no/SOSI/'
+    'produktspesifikasjon/Reguleringsplanforslag/20230701 '
+    'https://skjema.geonorge.no/SOSI/produktspesifikasjon/'
+    'Reguleringsplanforslag/20230701/reguleringsplanforslag.xsd '
+    'http://www.opengis.net/gml/3.2 '
+    'http://schemas.opengis.net/gml/3.2.1/gml.xsd">\n')
+
+MEMBER = (
+    '<gml:featureMember><app:RpOmråde gml:id="{0}">'
+    '<app:område><gml:Polygon><gml:exterior><gml:LinearRing>'
+    '<gml:posList>10.0 60.0 10.1 60.0 10.1 60.1 10.0 60.0</gml:posList>'
+    '</gml:LinearRing></gml:exterior></gml:Polygon></app:område>'
+    '</app:RpOmråde></gml:featureMember>\n')
+
+FOOTER = '</gml:FeatureCollection>\n'
+
+
+def write_gml_file(size_mb):
+    """Write a synthetic GML file of roughly size_mb megabytes."""
+    fd, path = mkstemp(suffix='.gml')
+    target_size = size_mb * 1024 * 1024
+    block = ''.join(MEMBER.format('id{}'.format(i)) for i in range(1000))
+    block = block.encode('utf-8')
+    with open(fd, 'wb') as gml_file:
+        gml_file.write(HEADER.encode('utf-8'))
+        written = 0
+        while written < target_size:
+            gml_file.write(block)
+            written += len(block)
+        gml_file.write(FOOTER.encode('utf-8'))
+    return path
+
+
+def check_malformed_header():
+    """A malformed root start tag gives no schema location."""
+    fd, path = mkstemp(suffix='.gml')
+    with open(fd, 'wb') as gml_file:
+        gml_file.write(HEADER.replace('xsi:schemaLocation=',
+                                      '<xsi:schemaLocation=').encode('utf-8'))
+    try:
+        assert read_schema_location(path) is None
+    finally:
+        remove(path)
+
+
+def full_parse_schema_location(path):
+    """Reference implementation that parses the whole document."""
+    root = parse(path).getroot()
+    return next((value for key, value in root.attrib.items()
+                 if key.endswith('schemaLocation')), None)
+
+
+def measure(function, path):
+    """Return (seconds, peak bytes, result) for one call."""
+    tracemalloc.start()
+    start = perf_counter()
+    result = function(path)
+    elapsed = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes-mb', type=int, nargs='+',
+                        default=[1, 10, 100])
+    parser.add_argument('--full-parse', action='store_true',
+                        help='Also time a full ElementTree.parse().')
+    args = parser.parse_args()
+
+    check_malformed_header()
+    print('{:>10} {:>12} {:>14} {:>12} {:>14}'.format(
+        'size (MB)', 'stream (ms)', 'stream peak', 'full (ms)',
+        'full peak'))
+    for size_mb in args.sizes_mb:
+        path = write_gml_file(size_mb)
+        try:
+            stream_time, stream_peak, stream_result = measure(
+                read_schema_location, path)
+            full_time = full_peak = None
+            if args.full_parse:
+                full_time, full_peak, full_result = measure(
+                    full_parse_schema_location, path)
+                assert full_result == stream_result
+            print('{:>10.0f} {:>12.2f} {:>14,} {:>12} {:>14}'.format(
+                getsize(path) / (1024 * 1024), stream_time * 1000,
+                stream_peak,
+                '-' if full_time is None else '{:.2f}'.format(
+                    full_time * 1000),
+                '-' if full_peak is None else '{:,}'.format(full_peak)))
+        finally:
+            remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark of matching GML nodes to the style names of a theme.
+
+Builds a synthetic theme with a few hundred styles in both supported
+formats and a set of layers (GML node and geometry), and chooses the
+style of every layer with LayerStylesUpdater.get_style_name. Compares a
+regex scan of the styles per layer (how matching used to work) with the
+StyleNameIndex and geometry keywords of the theme, and checks
+that both choose the same styles.
+
+Usage:
+    python benchmarks/bench_style_matching.py [--styles 400] [--layers 80]
+"""
+import argparse
+import random
+import re
+import sys
+from os.path import abspath, dirname
+from time import perf_counter
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from util.records import StyleRecord  # noqa: E402
+from util.style_utils import (  # noqa: E402
+    LayerStylesUpdater as lsu, StyleNameIndex)
+
+GEOMETRIES = ['Point', 'Line', 'Polygon', 'Unknown']
+SUFFIXES = ['', ' punkt', ' linje', ' område', ' sone', ' omriss']
+
+
+class ScanIndex:
+    """Find the style names with a regex per style, as before the index."""
+
+    def __init__(self, styles):
+        self.style_names = [style.style_name for style in styles]
+
+    def find_positions(self, name):
+        return [
+            position
+            for position, style_name in enumerate(self.style_names)
+            if re.search(rf'(?i)(\b{name}\b)', style_name)]
+
+
+def build_styles(styles, seed=0):
+    generator = random.Random(seed)
+    records = []
+    for i in range(styles // 2):
+        style_name = 'Objekt{0}{1}'.format(i // 3, generator.choice(SUFFIXES))
+        for style_format in ('sld', 'qml'):
+            records.append(
+                StyleRecord(style_name=style_name, format=style_format))
+    return records
+
+
+def build_layers(styles, layers, seed=0):
+    generator = random.Random(seed)
+    node_count = len(styles) // 6 + 1
+    node_geometries = []
+    for i in range(layers):
+        # Most nodes have styles, some only match with another case
+        node = 'Objekt{}'.format(generator.randrange(node_count + 5))
+        if i % 7 == 0:
+            node = node.upper()
+        node_geometries.append((node, generator.choice(GEOMETRIES)))
+    return node_geometries
+
+
+def choose_styles(node_geometries, styles, style_name_index):
+    return [lsu.get_style_name(node, geometry, styles, 'qml',
+                               style_name_index)
+            for node, geometry in node_geometries]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--styles', type=int, default=400)
+    parser.add_argument('--layers', type=int, default=80)
+    args = parser.parse_args()
+
+    styles = build_styles(args.styles)
+    node_geometries = build_layers(styles, args.layers)
+
+    started = perf_counter()
+    scanned = choose_styles(node_geometries, styles, ScanIndex(styles))
+    scan_time = perf_counter() - started
+
+    started = perf_counter()
+    lsu.add_geometry_keywords(styles)
+    style_name_index = StyleNameIndex(style.style_name for style in styles)
+    indexed = choose_styles(node_geometries, styles, style_name_index)
+    index_time = perf_counter() - started
+
+    if scanned != indexed:
+        sys.exit("Index and scan disagree")
+    print("{0} styles, {1} layers ({2} styled)".format(
+        len(styles), len(node_geometries),
+        sum(style_name is not None for style_name in indexed)))
+    print("scan:  {0:8.3f}s".format(scan_time))
+    print("index: {0:8.3f}s".format(index_time))
+
+
+if __name__ == '__main__':
+    main()
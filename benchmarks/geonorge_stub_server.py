@@ -0,0 +1,269 @@
+"""
+Local stand-in for the Geonorge APIs, serving recorded responses.
+
+Serves the schema register, cartography responses and style files
+recorded with record_fixtures.py, so the network path can be measured
+and regression-tested without register.geonorge.no. Latency, bandwidth,
+random errors and fixed HTTP status codes can be injected. Absolute
+URLs to the recorded hosts in the responses are rewritten to point at
+the stub, so style files are downloaded from it as well.
+
+Point 'endpoint_url' in config/qgis_config.json at the stub (the URLs
+are printed at start-up) and set 'network.upgrade_to_https' to false,
+as the stub only speaks http, or start it in-process with
+start_server().
+
+Usage:
+    python benchmarks/geonorge_stub_server.py FIXTURE_DIR [--port 8080]
+        [--latency-ms 0] [--jitter-ms 0] [--bandwidth-kbps 0]
+        [--error-rate 0.0] [--status PATTERN=CODE ...] [--seed 0]
+"""
+import argparse
+import random
+from email.utils import parsedate_to_datetime
+from fnmatch import fnmatch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import load
+from os.path import join
+from threading import Lock, Thread
+from time import sleep
+from urllib.parse import parse_qsl, unquote, urlencode, urlsplit
+
+FIXTURE_VERSION = 1
+CHUNK_SIZE = 16 * 1024
+
+
+def fixture_key(url):
+    """
+    Return the key a response is stored under: the decoded path and the
+    sorted, decoded query, so equal requests match regardless of host,
+    parameter order and percent-encoding.
+    """
+    parts = urlsplit(url)
+    path = unquote(parts.path)
+    query = sorted(parse_qsl(parts.query, keep_blank_values=True))
+    if not query:
+        return path
+    return '{0}?{1}'.format(path, urlencode(query))
+
+
+class StubOptions:
+    """Faults and limits injected by the stub server."""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, bandwidth_kbps=0,
+                 error_rate=0.0, statuses=None, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.bandwidth_kbps = bandwidth_kbps
+        self.error_rate = error_rate
+        # [(key pattern, status code)], the first matching pattern wins
+        self.statuses = statuses or []
+        self.random = random.Random(seed)
+        self.lock = Lock()
+
+    def get_delay(self):
+        with self.lock:
+            jitter = self.random.uniform(0, self.jitter_ms)
+        return (self.latency_ms + jitter) / 1000
+
+    def is_error(self):
+        if not self.error_rate:
+            return False
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def get_status(self, key):
+        for pattern, status_code in self.statuses:
+            if fnmatch(key, pattern):
+                return status_code
+        return None
+
+
+class GeonorgeStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fixture_dir, address, options=None):
+        super(GeonorgeStubServer, self).__init__(address,
+                                                 StubRequestHandler)
+        self.fixture_dir = fixture_dir
+        self.options = options or StubOptions()
+        with open(join(fixture_dir, 'index.json'), encoding='utf-8') as f:
+            index = load(f)
+        if index.get('version') != FIXTURE_VERSION:
+            raise ValueError("Unsupported fixture version: {}"
+                             .format(index.get('version')))
+        self.hosts = index.get('hosts', [])
+        self.responses = index['responses']
+        self.bodies = {}
+        self.request_counts = {}
+        self.counts_lock = Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return 'http://{0}:{1}'.format(host, port)
+
+    def get_body(self, key):
+        """Read a recorded body, with the recorded hosts rewritten."""
+        if key not in self.bodies:
+            response = self.responses[key]
+            with open(join(self.fixture_dir, response['body']), 'rb') as f:
+                body = f.read()
+            if response.get('rewrite_hosts'):
+                for host in self.hosts:
+                    for scheme in ('https://', 'http://'):
+                        body = body.replace((scheme + host).encode('utf-8'),
+                                            self.base_url.encode('utf-8'))
+            self.bodies[key] = body
+        return self.bodies[key]
+
+    def count_request(self, key):
+        with self.counts_lock:
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+
+    def get_request_total(self):
+        with self.counts_lock:
+            return sum(self.request_counts.values())
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        options = server.options
+        key = fixture_key(self.path)
+        server.count_request(key)
+
+        delay = options.get_delay()
+        if delay:
+            sleep(delay)
+
+        status_code = options.get_status(key)
+        if status_code is None and options.is_error():
+            status_code = 503
+        if status_code in (None, 200) and key not in server.responses:
+            status_code = 404
+        if status_code is not None and status_code != 200:
+            self.send_empty(status_code)
+            return
+
+        response = server.responses[key]
+        headers = response.get('headers', {})
+        if self.is_not_modified(headers):
+            self.send_empty(304, headers)
+            return
+
+        body = server.get_body(key)
+        self.send_response(response.get('status', 200))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.write_body(body)
+
+    def is_not_modified(self, headers):
+        etag = headers.get('ETag')
+        if_none_match = self.headers.get('If-None-Match')
+        if etag and if_none_match:
+            return etag in [tag.strip() for tag in if_none_match.split(',')]
+
+        last_modified = headers.get('Last-Modified')
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if last_modified and if_modified_since:
+            try:
+                return (parsedate_to_datetime(last_modified) <=
+                        parsedate_to_datetime(if_modified_since))
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def send_empty(self, status_code, headers=None):
+        self.send_response(status_code)
+        for name, value in (headers or {}).items():
+            if name.lower() in ('etag', 'last-modified'):
+                self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def write_body(self, body):
+        bandwidth = self.server.options.bandwidth_kbps * 1024
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        for start in range(0, len(body), CHUNK_SIZE):
+            chunk = body[start:start + CHUNK_SIZE]
+            self.wfile.write(chunk)
+            sleep(len(chunk) / bandwidth)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(fixture_dir, port=0, options=None, host='127.0.0.1'):
+    """
+    Start the stub server on a background thread.
+    output:
+        GeonorgeStubServer, stop it with shutdown()
+    """
+    server = GeonorgeStubServer(fixture_dir, (host, port), options)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_endpoint_urls(server, fixture_dir):
+    """Return the 'endpoint_url' config section for the stub server."""
+    with open(join(fixture_dir, 'index.json'), encoding='utf-8') as f:
+        endpoints = load(f)['endpoint_url']
+    return {name: server.base_url + urlsplit(url).path +
+            ('?' if url.endswith('?') else '')
+            for name, url in endpoints.items()}
+
+
+def parse_status(value):
+    pattern, _, status_code = value.rpartition('=')
+    if not pattern:
+        raise argparse.ArgumentTypeError(
+            "Expected PATTERN=CODE, got '{}'".format(value))
+    return pattern, int(status_code)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('fixture_dir')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--bandwidth-kbps', type=float, default=0,
+                        help="0 for unlimited")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="fraction of requests answered with 503")
+    parser.add_argument('--status', type=parse_status, action='append',
+                        default=[], metavar='PATTERN=CODE',
+                        help="answer requests matching the glob PATTERN "
+                             "with CODE, e.g. '/kartografi/*=500'")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    options = StubOptions(args.latency_ms, args.jitter_ms,
+                          args.bandwidth_kbps, args.error_rate, args.status,
+                          args.seed)
+    server = GeonorgeStubServer(args.fixture_dir, (args.host, args.port),
+                                options)
+    print("Serving {0} recorded responses on {1}".format(
+        len(server.responses), server.base_url))
+    print("endpoint_url for qgis_config.json:")
+    for name, url in get_endpoint_urls(server, args.fixture_dir).items():
+        print('    "{0}": "{1}"'.format(name, url))
+    print('and in "network": "upgrade_to_https": false')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Record Geonorge responses as fixtures for geonorge_stub_server.py.
+
+Fetches the schema register and the cartography responses for a set of
+themes from the endpoints in config/qgis_config.json, and the QML/SLD
+files they reference, and writes them to FIXTURE_DIR with an
+'index.json' that maps each request to its recorded status, headers and
+body file.
+
+Usage:
+    python benchmarks/record_fixtures.py FIXTURE_DIR
+        [--themes THEME ...] [--max-themes N] [--no-style-files]
+        [--workers 8]
+"""
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from json import dump, loads
+from os import makedirs
+from os.path import abspath, dirname, join
+from urllib.error import HTTPError
+from urllib.parse import urlencode, urlsplit
+from urllib.request import Request, urlopen
+
+sys.path.insert(0, dirname(abspath(__file__)))
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from geonorge_stub_server import FIXTURE_VERSION, fixture_key  # noqa: E402
+from util.config_loader import ConfigLoader  # noqa: E402
+from util.geonorge_apis import GeonorgeAPI  # noqa: E402
+from util.schema_utils import SchemaUtils  # noqa: E402
+from util.style_utils import LayerStylesUpdater as lsu  # noqa: E402
+
+RECORDED_HEADERS = ['Content-Type', 'ETag', 'Last-Modified',
+                    'Cache-Control']
+EXTENSIONS = {'sld': 'sld', 'qml': 'qml'}
+
+
+def fetch(url, timeout=60):
+    """
+    output:
+        tuple: (status code, headers, body), body is None on errors
+    """
+    try:
+        with urlopen(Request(url), timeout=timeout) as response:
+            headers = {name: response.headers[name]
+                       for name in RECORDED_HEADERS if name in response.headers}
+            return response.status, headers, response.read()
+    except HTTPError as e:
+        return e.code, {}, None
+    except OSError as e:
+        print("Failed: {0} ({1})".format(url, e), file=sys.stderr)
+        return None, {}, None
+
+
+def get_theme_url(geonorge_api, theme):
+    """Build the cartography URL the plugin requests for a theme."""
+    endpoint_url, request_params = geonorge_api.get_theme_request(theme)
+    return endpoint_url.rstrip('?') + '?' + urlencode(
+        [(key, str(value)) for key, value in request_params.items()])
+
+
+def get_schema_identifiers(register):
+    """Theme identifiers for the schemas in a recorded register."""
+    schema_utils = SchemaUtils()
+    schema_identifiers = [
+        schema_utils.get_schema_identifier(item.get('DatasetUuid'),
+                                           item.get('label'))
+        for item in register.get('containeditems', [])]
+    return list(dict.fromkeys(schema_identifier
+                              for schema_identifier in schema_identifiers
+                              if schema_identifier))
+
+
+class FixtureWriter:
+
+    def __init__(self, fixture_dir, endpoint_url):
+        self.fixture_dir = fixture_dir
+        makedirs(join(fixture_dir, 'bodies'), exist_ok=True)
+        self.index = {
+            'version': FIXTURE_VERSION,
+            'recorded': datetime.now().isoformat(timespec='seconds'),
+            'endpoint_url': endpoint_url,
+            'hosts': [],
+            'responses': {},
+        }
+
+    def add(self, url, status_code, headers, body, extension,
+            rewrite_hosts=False):
+        if body is None:
+            return False
+        host = urlsplit(url).netloc
+        if host not in self.index['hosts']:
+            self.index['hosts'].append(host)
+
+        body_name = 'bodies/{0:05d}.{1}'.format(
+            len(self.index['responses']), extension)
+        with open(join(self.fixture_dir, body_name), 'wb') as f:
+            f.write(body)
+        self.index['responses'][fixture_key(url)] = {
+            'url': url,
+            'status': status_code,
+            'headers': headers,
+            'body': body_name,
+            'rewrite_hosts': rewrite_hosts,
+        }
+        return True
+
+    def save(self):
+        with open(join(self.fixture_dir, 'index.json'), 'w',
+                  encoding='utf-8') as f:
+            dump(self.index, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('fixture_dir')
+    parser.add_argument('--themes', nargs='*',
+                        help="themes to record, default all in the register")
+    parser.add_argument('--max-themes', type=int, default=None)
+    parser.add_argument('--no-style-files', action='store_true')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    endpoint_url = ConfigLoader().load_qgis_config()['endpoint_url']
+    writer = FixtureWriter(args.fixture_dir, endpoint_url)
+    geonorge_api = GeonorgeAPI()
+
+    # Schema register
+    status_code, headers, body = fetch(endpoint_url['schema'])
+    if not writer.add(endpoint_url['schema'], status_code, headers, body,
+                      'json'):
+        sys.exit("Cannot fetch the schema register")
+    themes = args.themes or get_schema_identifiers(loads(body))
+    themes = themes[:args.max_themes]
+    print("Recording {} themes".format(len(themes)))
+
+    # Cartography responses
+    theme_urls = [get_theme_url(geonorge_api, theme) for theme in themes]
+    style_urls = {}
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for theme_url, (status_code, headers, body) in zip(
+                theme_urls, executor.map(fetch, theme_urls)):
+            if not writer.add(theme_url, status_code, headers, body, 'json',
+                              rewrite_hosts=True):
+                continue
+            for style in loads(body).get('Files') or []:
+                if style.get('Format') in EXTENSIONS and style.get('FileUrl'):
+                    style_urls[lsu.get_style_file_url(style)] = (
+                        EXTENSIONS[style['Format']])
+
+        # Style files
+        if not args.no_style_files:
+            print("Recording {} style files".format(len(style_urls)))
+            for style_url, (status_code, headers, body) in zip(
+                    style_urls, executor.map(fetch, style_urls)):
+                writer.add(style_url, status_code, headers, body,
+                           style_urls[style_url])
+
+    writer.save()
+    print("Recorded {0} responses to '{1}'".format(
+        len(writer.index['responses']), args.fixture_dir))
+
+
+if __name__ == '__main__':
+    main()
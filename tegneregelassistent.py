@@ -1,15 +1,13 @@
-from .util.logging_setup import logger as log
+from .util.logging_setup import logger as log, init_logging
 from os.path import dirname
+from qgis.PyQt.QtCore import QTimer
 from qgis.PyQt.QtGui import QIcon
-from PyQt5.QtWidgets import QAction
-from .ui.ui_helpers import UIHelpers
-from .ui.dialog_helpers import DialogHelpers
-from .util.layers_utils import LayersUtils as lu
-from .util.layers_utils import LayerStylesUpdater
-from .util.layer_extractor import LayerExtractor
-from .util.report_saver import ReportSaver
-from .util.gml_processor import GMLProcessor
-from pandas import DataFrame
+from PyQt5.QtWidgets import QAction, QFileDialog
+from .util.config_loader import ConfigLoader
+from qgis.core import QgsApplication, QgsProject
+
+# The rest of the plugin is imported when it is first used, so loading the
+# plugin at QGIS startup stays cheap
 
 
 class GeonorgeTegneregelassistent:
@@ -29,7 +27,15 @@ class GeonorgeTegneregelassistent:
         self.ui_helpers = None
         self.report = None
         self.layer_extractor = None
-        self.gml_layers_df_and_styles = None
+        self.gml_layers_and_styles = None
+        self.style_search_task = None
+        self.progress_message_bar = None
+        self.progress_bar = None
+        self.warm_up_timer = None
+        self.warm_up_task = None
+        self.warmed_up_paths = set()
+        self.offline_bundle_task = None
+        self.offline_bundle_message_bar = None
 
     def add_actions(self):
         """
@@ -44,6 +50,16 @@ class GeonorgeTegneregelassistent:
         self.iface.addToolBarIcon(action)
         self.iface.addPluginToMenu('&Geonorge', action)
         self.actions.append(action)
+
+        # Menu actions for offline bundles
+        for text, callback in [
+                ('Lag offline-pakke...', self.export_offline_bundle),
+                ('Importer offline-pakke...', self.import_offline_bundle),
+                ('Fjern offline-pakke', self.remove_offline_bundle)]:
+            bundle_action = QAction(text, self.iface.mainWindow())
+            bundle_action.triggered.connect(callback)
+            self.iface.addPluginToMenu('&Geonorge', bundle_action)
+            self.actions.append(bundle_action)
         return action
 
     def initGui(self):
@@ -52,11 +68,26 @@ class GeonorgeTegneregelassistent:
         """
         self.add_actions()
         self.first_start = True
+        self.init_warm_up()
 
     def unload(self):
         """
         Unloads the plugin from QGIS.
         """
+        if self.style_search_task is not None:
+            self.style_search_task.cancel()
+        if self.warm_up_timer is not None:
+            self.warm_up_timer.stop()
+            project = QgsProject.instance()
+            project.readProject.disconnect(self.schedule_warm_up)
+            project.layersAdded.disconnect(self.schedule_warm_up)
+        if self.warm_up_task is not None:
+            self.warm_up_task.cancel()
+        if self.offline_bundle_task is not None:
+            self.offline_bundle_task.cancel()
+        # Aborts the requests of the canceled tasks
+        from .util.api_call_manager import stop_network_thread
+        stop_network_thread()
         for action in self.actions:
             self.iface.removeToolBarIcon(action)
             self.iface.removePluginMenu('&Geonorge', action)
@@ -65,10 +96,24 @@ class GeonorgeTegneregelassistent:
         """
         Executes the main functionality of the plugin.
         """
+        init_logging()
+        from .ui.ui_helpers import UIHelpers
+        from .ui.dialog_helpers import DialogHelpers
+        from .util.layers_utils import LayersUtils as lu
+        from .util.layers_utils import LayerStylesUpdater
+        from .util.layer_extractor import LayerExtractor
+        from .util.report_saver import ReportSaver
+
+        if self.style_search_task is not None:
+            self.ui_helpers.message_bar_info(
+                "Søket etter tegneregler pågår. Vent til det er ferdig "
+                "eller avbryt det.")
+            return
+
         if self.first_start:
             self.first_start = False
             self.selected_layers_and_styles = None
-            self.gml_layers_df = None
+            self.gml_layers = None
             self.dlg = DialogHelpers()
             self.ui_helpers = UIHelpers(self.iface)
             self.report = ReportSaver()
@@ -86,16 +131,14 @@ class GeonorgeTegneregelassistent:
                 return
             self.dlg.bring_dialog_to_front()
 
-        layer_styles_df = DataFrame()
-
-        if self.gml_layers_df is None:
+        if self.gml_layers is None:
             # Get the GML layers from the project
             log.info('=== GML Layers ===')
             # self.layer_extractor = LayerExtractor(self.iface)
-            self.layer_extractor.get_gml_layer_dataFrame()
+            self.layer_extractor.get_gml_layers()
 
             # Check if there are GML layers in the project
-            if (self.layer_extractor.gml_layer_dataFrame is None):
+            if (self.layer_extractor.gml_layers is None):
                 self.ui_helpers.message_bar_warning(
                     "Ingen GML-lag med geometry funnet i prosjektet."
                     "Vennligst legg til et GML-lag og prøv igjen.")
@@ -104,8 +147,8 @@ class GeonorgeTegneregelassistent:
                 return
 
             # Group the layers by base filenames
-            grouped_layers = lu.group_layers_by_column_name(
-                self.layer_extractor.gml_layer_dataFrame)
+            grouped_layers = lu.group_layers_by_root_filename(
+                self.layer_extractor.gml_layers)
 
             # Populate the tree widget with the grouped layers
             self.dlg.populate_treeWidget(grouped_layers)
@@ -121,36 +164,34 @@ class GeonorgeTegneregelassistent:
                 self.reset_plugin()
                 return
 
-            self.gml_layers_df = self.layer_extractor.gml_layer_dataFrame
+            self.gml_layers = self.layer_extractor.gml_layers
 
             # Get the checked layers
             checked_layers = self.dlg.retrive_widget_checked_layers()
-            gml_layers_dataFrame_group = (self.layer_extractor
+            gml_layer_groups = (self.layer_extractor
                                           .get_group_of_selected_layers(
                                             checked_layers))
 
-            gml_processor = GMLProcessor(self.ui_helpers)
-
-            layer_styles_df = (
-                gml_processor.process_gml_files(gml_layers_dataFrame_group))
-
-            self.selected_layers_and_styles = layer_styles_df
+            # Find the styles in the background; run() continues when the
+            # search has completed
+            self.start_style_search(gml_layer_groups)
+            return
 
-        if self.selected_layers_and_styles.empty:
+        if not self.selected_layers_and_styles:
             self.ui_helpers.message_bar_info(
                 "Ingen tegneregler funnet for de valgte lagene.")
             log.info("No styles found for the selected layers.")
             self.reset_plugin()
             return
 
-        if self.gml_layers_df_and_styles is None or self.gml_layers_df.empty:
-            gml_layers_df_and_styles = (
+        if self.gml_layers_and_styles is None or not self.gml_layers:
+            gml_layers_and_styles = (
                 lu.merge_layers_with_styles_and_gml_layers(
-                    self.gml_layers_df, self.selected_layers_and_styles))
-            self.gml_layers_df_and_styles = gml_layers_df_and_styles
+                    self.gml_layers, self.selected_layers_and_styles))
+            self.gml_layers_and_styles = gml_layers_and_styles
 
-            group_layers = lu.group_layers_by_column_name(
-                self.gml_layers_df_and_styles)
+            group_layers = lu.group_layers_by_root_filename(
+                self.gml_layers_and_styles)
             self.dlg.populate_treeWidget_and_Styles(group_layers)
 
         result = self.dlg.is_dialog_accepted()
@@ -175,15 +216,15 @@ class GeonorgeTegneregelassistent:
         # Get the user selection of layers to implement styles for
         selected_layers = self.dlg.retrive_widget_checked_layers()
 
-        selected_layers_dataFrame = (
+        selected_layer_styles = (
             self.layer_extractor.filter_selected_layers(
-                selected_layers, self.selected_layers_and_styles, 'LayerName'))
+                selected_layers, self.selected_layers_and_styles))
 
         # Implement styles for the user selected layers
         layer_style_updater = LayerStylesUpdater(self.ui_helpers,
                                                  self.layer_extractor)
         update_ok = layer_style_updater.update_styles(
-            selected_layers_dataFrame)
+            selected_layer_styles)
 
         if update_ok:
             # Show the final message
@@ -198,13 +239,290 @@ class GeonorgeTegneregelassistent:
         self.reset_plugin()
         log.info("=== Geonorge tegneregelassistent plugin finished ===")
 
+    def start_style_search(self, gml_layer_groups):
+        """
+        Starts the style search for the selected GML files as a task in
+        the QGIS task manager, so QGIS stays responsive while it runs.
+        """
+        from .util.style_search_task import StyleSearchTask
+
+        total_gml_files = len(gml_layer_groups)
+        task = StyleSearchTask(gml_layer_groups)
+
+        self.progress_message_bar, self.progress_bar = (
+            self.ui_helpers.show_progress_bar(
+                total_gml_files,
+                "Søker etter tegneregler for {} GML-filer"
+                .format(total_gml_files),
+                cancel_callback=task.cancel))
+
+        task.gml_file_started.connect(self.on_gml_file_started)
+        task.gml_file_finished.connect(self.on_gml_file_finished)
+        task.message.connect(self.on_style_search_message)
+        task.taskCompleted.connect(self.on_style_search_completed)
+        task.taskTerminated.connect(self.on_style_search_terminated)
+
+        self.style_search_task = task
+        self.dlg.show_styles_in_progress()
+        QgsApplication.taskManager().addTask(task)
+        log.info("Style search started for {} GML files"
+                 .format(total_gml_files))
+
+    def on_gml_file_started(self, current_step, total_gml_files,
+                            root_filename):
+        """
+        Shows the progress of the style search.
+        """
+        self.progress_bar.setValue(current_step - 1)
+        self.progress_message_bar.setText(
+            "Søker etter tegneregler: {0}/{1} - {2}".format(
+                current_step, total_gml_files, root_filename))
+
+    def on_gml_file_finished(self, root_filename, layers_with_styles):
+        """
+        Adds the layers of a GML file with their styles to the dialog
+        when the file is finished, while the search goes on.
+        """
+        from .util.layers_utils import LayersUtils as lu
+
+        log.info("Styles found for {0} layers in '{1}'"
+                 .format(len(layers_with_styles), root_filename))
+        gml_layers = [gml_layer for gml_layer in self.gml_layers
+                      if gml_layer.root_filename == root_filename]
+        layers = [
+            layer_style for layer_style in
+            lu.merge_layers_with_styles_and_gml_layers(
+                gml_layers, layers_with_styles)
+            if layer_style.root_filename == root_filename]
+        self.dlg.add_gml_file_and_styles(root_filename, layers)
+
+    def on_style_search_message(self, level, message):
+        """
+        Shows a message from the style search in the message bar.
+        """
+        {
+            'critical': self.ui_helpers.message_bar_critial,
+            'info': self.ui_helpers.message_bar_info,
+            'warning': self.ui_helpers.message_bar_warning,
+            'success': self.ui_helpers.message_bar_success,
+        }[level](message)
+
+    def on_style_search_completed(self):
+        """
+        Continues with the style selection when the search has completed.
+        """
+        task = self.style_search_task
+        self.style_search_task = None
+        self.ui_helpers.close_progress_bar(self.progress_message_bar)
+        self.selected_layers_and_styles = task.layer_styles
+        self.run()
+
+    def on_style_search_terminated(self):
+        """
+        Resets the plugin when the search was canceled or failed.
+        """
+        task = self.style_search_task
+        self.style_search_task = None
+        self.ui_helpers.close_progress_bar(self.progress_message_bar)
+        if task is not None and task.isCanceled():
+            self.ui_helpers.message_bar_info(
+                "Søket etter tegneregler ble avbrutt.")
+            log.info("User canceled the style search.")
+        else:
+            self.ui_helpers.message_bar_critial(
+                "Søket etter tegneregler feilet.")
+            log.error("The style search failed.")
+        self.reset_plugin()
+
+    def init_warm_up(self):
+        """
+        Warms up the caches in the background when a project is loaded or
+        layers are added, if enabled in the config. It is off by default,
+        so QGIS does not load the plugin or use the network for users who
+        do not use it.
+        """
+        warm_up_config = ConfigLoader().load_qgis_config().get('warm_up', {})
+        if not warm_up_config.get('enabled', False):
+            return
+
+        # Layers are often added one by one; wait until it has been quiet
+        # for 'delay_ms' and warm up all new files at once
+        self.warm_up_timer = QTimer()
+        self.warm_up_timer.setSingleShot(True)
+        self.warm_up_timer.setInterval(warm_up_config.get('delay_ms', 2000))
+        self.warm_up_timer.timeout.connect(self.start_warm_up)
+
+        project = QgsProject.instance()
+        project.readProject.connect(self.schedule_warm_up)
+        project.layersAdded.connect(self.schedule_warm_up)
+        if project.mapLayers():
+            self.schedule_warm_up()
+
+    def schedule_warm_up(self, *args):
+        """
+        Starts, or restarts, the warm-up delay.
+        """
+        self.warm_up_timer.start()
+
+    def start_warm_up(self):
+        """
+        Starts a warm-up task for the GML files in the project that are
+        not warmed up yet.
+        """
+        init_logging()
+        from .util.layer_extractor import LayerExtractor
+        from .util.warm_up_task import WarmUpTask
+
+        if (self.warm_up_task is not None or
+                self.style_search_task is not None):
+            # Try again when the running task has finished
+            self.schedule_warm_up()
+            return
+
+        gml_file_paths = [
+            gml_file_path for gml_file_path in
+            LayerExtractor.get_gml_file_paths(
+                QgsProject.instance().mapLayers().values())
+            if gml_file_path not in self.warmed_up_paths]
+        if not gml_file_paths:
+            return
+
+        task = WarmUpTask(gml_file_paths)
+        task.taskCompleted.connect(self.on_warm_up_completed)
+        task.taskTerminated.connect(self.on_warm_up_terminated)
+        self.warm_up_task = task
+        QgsApplication.taskManager().addTask(task)
+        log.info("Warm-up started for {} GML files"
+                 .format(len(gml_file_paths)))
+
+    def on_warm_up_completed(self):
+        """
+        Remembers the GML files that are warmed up.
+        """
+        self.warmed_up_paths.update(self.warm_up_task.gml_file_paths)
+        self.warm_up_task = None
+
+    def on_warm_up_terminated(self):
+        """
+        Forgets the warm-up; the search fetches what is missing.
+        """
+        self.warm_up_task = None
+
+    def export_offline_bundle(self):
+        """
+        Builds an offline bundle with the schema register, the styles of
+        all themes in the register and their style files, as a task in
+        the QGIS task manager with a progress bar in the message bar.
+        """
+        init_logging()
+        from .ui.ui_helpers import UIHelpers
+        from .util.offline_bundle_task import OfflineBundleTask
+
+        ui_helpers = UIHelpers(self.iface)
+        if self.offline_bundle_task is not None:
+            ui_helpers.message_bar_info(
+                "Offline-pakken lages allerede. Vent til den er ferdig "
+                "eller avbryt den.")
+            return
+
+        bundle_path, _ = QFileDialog.getSaveFileName(
+            self.iface.mainWindow(), "Lag offline-pakke",
+            "tegneregler_offline.zip", "Offline-pakke (*.zip)")
+        if not bundle_path:
+            return
+
+        task = OfflineBundleTask(bundle_path)
+        self.offline_bundle_message_bar, progress_bar = (
+            ui_helpers.show_progress_bar(
+                100, "Lager offline-pakke", cancel_callback=task.cancel))
+        task.progressChanged.connect(
+            lambda progress: progress_bar.setValue(int(progress)))
+        task.taskCompleted.connect(self.on_offline_bundle_completed)
+        task.taskTerminated.connect(self.on_offline_bundle_terminated)
+
+        self.offline_bundle_task = task
+        QgsApplication.taskManager().addTask(task)
+        log.info("Offline bundle export started: '{}'".format(bundle_path))
+
+    def on_offline_bundle_completed(self):
+        """
+        Reports the contents of the offline bundle that was built.
+        """
+        from .ui.ui_helpers import UIHelpers
+
+        task = self.offline_bundle_task
+        self.offline_bundle_task = None
+        ui_helpers = UIHelpers(self.iface)
+        ui_helpers.close_progress_bar(self.offline_bundle_message_bar)
+        summary = task.summary
+        if summary is None:
+            ui_helpers.message_bar_critial(
+                "Kunne ikke lage offline-pakke. Skjemaregisteret kunne "
+                "ikke hentes fra Geonorge.")
+            return
+        ui_helpers.message_bar_success(
+            "Offline-pakke lagret med {0} temaer og {1} tegneregelfiler."
+            .format(summary['themes'], summary['styles']))
+
+    def on_offline_bundle_terminated(self):
+        """
+        Reports that the offline bundle export was canceled or failed.
+        """
+        from .ui.ui_helpers import UIHelpers
+
+        task = self.offline_bundle_task
+        self.offline_bundle_task = None
+        ui_helpers = UIHelpers(self.iface)
+        ui_helpers.close_progress_bar(self.offline_bundle_message_bar)
+        if task is not None and task.isCanceled():
+            ui_helpers.message_bar_info("Offline-pakken ble ikke laget.")
+            log.info("User canceled the offline bundle export.")
+        else:
+            ui_helpers.message_bar_critial("Kunne ikke lage offline-pakke.")
+            log.error("The offline bundle export failed.")
+
+    def import_offline_bundle(self):
+        """
+        Installs an offline bundle, used instead of Geonorge from now on.
+        """
+        init_logging()
+        from .ui.ui_helpers import UIHelpers
+        from .util.offline_bundle import OfflineBundle
+
+        ui_helpers = UIHelpers(self.iface)
+        bundle_path, _ = QFileDialog.getOpenFileName(
+            self.iface.mainWindow(), "Importer offline-pakke", "",
+            "Offline-pakke (*.zip)")
+        if not bundle_path:
+            return
+
+        try:
+            OfflineBundle.install(bundle_path)
+        except Exception as e:
+            log.error("Could not import offline bundle: {}".format(e))
+            ui_helpers.message_bar_critial(
+                "Kunne ikke importere offline-pakken.")
+            return
+        ui_helpers.message_bar_success("Offline-pakken er importert.")
+
+    def remove_offline_bundle(self):
+        """
+        Removes the installed offline bundle.
+        """
+        init_logging()
+        from .ui.ui_helpers import UIHelpers
+        from .util.offline_bundle import OfflineBundle
+
+        OfflineBundle.uninstall()
+        UIHelpers(self.iface).message_bar_info("Offline-pakken er fjernet.")
+
     def clear_layers(self):
         """
         Resets the plugin.
         """
         self.selected_layers_and_styles = None
-        self.gml_layers_df = None
-        self.gml_layers_df_and_styles = None
+        self.gml_layers = None
+        self.gml_layers_and_styles = None
         return
 
     def reset_plugin(self):
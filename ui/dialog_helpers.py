@@ -3,7 +3,6 @@ from PyQt5.QtWidgets import QTreeWidgetItem
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QColor
 from .tegneregelassistent_dialog_base import tegneregelassistent_dialog_base
-from pandas import notna
 
 
 class DialogHelpers:
@@ -27,14 +26,14 @@ class DialogHelpers:
             root_filename_item.setText(0, root_filename)
             log.info(f'Base filename: {root_filename}')
             # Add the layers of the GML file as child items
-            for _, layer in group.iterrows():
-                layer_geometry = layer['Geometry']
+            for layer in group:
+                layer_geometry = layer.geometry
                 gml_node_geometry = (
-                    f"{layer['Gml_Node']} - {layer['Geometry']}")
+                    f"{layer.gml_node} - {layer.geometry}")
                 log.info(f' * Layer name: {gml_node_geometry}')
                 # Original layer name
                 original_layer_name = (
-                    f"{layer['Layer_Name']}")
+                    f"{layer.layer_name}")
 
                 layer_item = QTreeWidgetItem(root_filename_item)
                 layer_item.setText(0, original_layer_name)
@@ -69,32 +68,7 @@ class DialogHelpers:
 
         # Iterate through each group and add to the tree widget
         for root_filename, group in grouped_layers:
-            # Add the base filename as a top-level item
-            root_filename_item = QTreeWidgetItem(self.dialog.gmlTreeWidget)
-            root_filename_item.setText(0, root_filename)
-            # Add the layers of the GML file as child items
-            for _, layer in group.iterrows():
-                layer_geometry = layer['Geometry']
-                # Original layer name
-                original_layer_name = (
-                    f"{layer['LayerName']}")
-                style_name = str(layer['StyleName'])
-                layer_item = QTreeWidgetItem(root_filename_item)
-                layer_item.setText(0, original_layer_name)
-                layer_item.setText(1, layer_geometry)
-                if notna(style_name) and style_name != "nan":
-                    layer_item.setCheckState(0, Qt.Checked)
-                    layer_item.setText(2, str(style_name))
-                    layer_item.setFlags(layer_item.flags() |
-                                        Qt.ItemIsUserCheckable)
-                else:
-                    layer_item.setCheckState(0, Qt.Unchecked)
-                    darker_gray = QColor(169, 169, 169)
-                    layer_item.setForeground(0, darker_gray)
-                    layer_item.setForeground(1, darker_gray)
-                    layer_item.setText(2, "❌")
-                    layer_item.setFlags(layer_item.flags()
-                                        & ~Qt.ItemIsUserCheckable)
+            self.add_gml_file_and_styles(root_filename, group)
 
         self.dialog.gmlTreeWidget.setColumnHidden(2, False)
         self.dialog.gmlTreeWidget.expandAll()
@@ -107,10 +81,67 @@ class DialogHelpers:
                 self.dialog.button_box.Ok)
             if ok_button:
                 ok_button.setText("Bruk")
+                ok_button.setEnabled(True)
+
+        self.dialog.show()
+        return
+
+    def show_styles_in_progress(self):
+        """
+        Show the dialog with an empty QTreeWidget while the styles are
+        searched for; the GML files are added with
+        add_gml_file_and_styles() as they are finished.
+        """
+        self.dialog.gmlTreeWidget.clear()
+        self.dialog.gmlTreeWidget.setHeaderLabels(self.widget_columns_names)
+        self.dialog.gmlTreeWidget.setColumnHidden(2, False)
+
+        if self.dialog.button_box:
+            ok_button = self.dialog.button_box.button(
+                self.dialog.button_box.Ok)
+            if ok_button:
+                # Enabled again when the search has completed
+                ok_button.setText("Bruk")
+                ok_button.setEnabled(False)
 
         self.dialog.show()
         return
 
+    def add_gml_file_and_styles(self, root_filename, group):
+        """
+        Add a GML file and its layers with their styles to the
+        QTreeWidget.
+        """
+        # Add the base filename as a top-level item
+        root_filename_item = QTreeWidgetItem(self.dialog.gmlTreeWidget)
+        root_filename_item.setText(0, root_filename)
+        # Add the layers of the GML file as child items
+        for layer in group:
+            layer_geometry = layer.geometry
+            # Original layer name
+            original_layer_name = (
+                f"{layer.layer_name}")
+            style_name = layer.style_name
+            layer_item = QTreeWidgetItem(root_filename_item)
+            layer_item.setText(0, original_layer_name)
+            layer_item.setText(1, layer_geometry)
+            if style_name is not None:
+                layer_item.setCheckState(0, Qt.Checked)
+                layer_item.setText(2, str(style_name))
+                layer_item.setFlags(layer_item.flags() |
+                                    Qt.ItemIsUserCheckable)
+            else:
+                layer_item.setCheckState(0, Qt.Unchecked)
+                darker_gray = QColor(169, 169, 169)
+                layer_item.setForeground(0, darker_gray)
+                layer_item.setForeground(1, darker_gray)
+                layer_item.setText(2, "❌")
+                layer_item.setFlags(layer_item.flags()
+                                    & ~Qt.ItemIsUserCheckable)
+        root_filename_item.setExpanded(True)
+        self.dialog.gmlTreeWidget.resizeColumnToContents(0)
+        return
+
     def bring_dialog_to_front(self):
         self.dialog.raise_()
         self.dialog.activateWindow()
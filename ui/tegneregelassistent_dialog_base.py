@@ -1,9 +1,10 @@
-from qgis.PyQt import uic
 from qgis.PyQt.QtWidgets import QDialog
-from os.path import join, dirname
 
-FORM_CLASS, _ = uic.loadUiType(join(
-    dirname(__file__), 'tegneregelassistent_dialog_base.ui'))
+# Generated from tegneregelassistent_dialog_base.ui by generate_class.bat;
+# run it again after changing the .ui file
+from .tegneregelassistent_dialog_base_ui import Ui_LayerStyleDialogBase
+
+FORM_CLASS = Ui_LayerStyleDialogBase
 
 
 class tegneregelassistent_dialog_base(QDialog, FORM_CLASS):
@@ -1,5 +1,5 @@
 from qgis.core import Qgis, QgsMessageLog
-from PyQt5.QtWidgets import QProgressBar
+from PyQt5.QtWidgets import QProgressBar, QPushButton
 from PyQt5.QtCore import QTimer
 
 
@@ -40,13 +40,17 @@ class UIHelpers:
         QgsMessageLog.logMessage(message, level=Qgis.Critical)
         return
 
-    def show_progress_bar(self, total_steps, message):
+    def show_progress_bar(self, total_steps, message, cancel_callback=None):
         self.iface.messageBar().clearWidgets()
         progress_message_bar = self.iface.messageBar().createMessage(
             message)
         progress_bar = QProgressBar()
         progress_bar.setMaximum(total_steps)
         progress_message_bar.layout().addWidget(progress_bar)
+        if cancel_callback:
+            cancel_button = QPushButton("Avbryt")
+            cancel_button.clicked.connect(cancel_callback)
+            progress_message_bar.layout().addWidget(cancel_button)
         self.iface.messageBar().pushWidget(progress_message_bar)
         return progress_message_bar, progress_bar
 
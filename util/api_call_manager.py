@@ -1,17 +1,337 @@
-from PyQt5 import QtCore, QtNetwork
+from collections import deque
+from functools import partial
+from threading import Event, Lock
+from time import perf_counter
+from PyQt5 import QtCore, QtNetwork, sip
+from .config_loader import ConfigLoader
 from .logging_setup import logger as log
 
+# How often get_many() checks if the requests are canceled
+CANCEL_CHECK_INTERVAL_MS = 100
+
+# How often a blocking request checks that the network thread is still
+# running, and on the main thread lets the user interface handle its
+# events, while it waits
+WAIT_INTERVAL = 0.01
+
+# Error of the requests that were not made because the network thread
+# was stopped
+STOPPED_ERROR = 'Network thread stopped'
+
+# The network thread, started on first use
+network_thread = None
+network_worker = None
+network_thread_lock = Lock()
+# The application whose shutdown stops the network thread
+stopping_application = None
+
+
+class NetworkWorker(QtCore.QObject):
+    """
+    Runs the requests of all ApiCallManager instances on the network
+    thread, with one QNetworkAccessManager.
+
+    A QNetworkAccessManager can only be used from the thread it was
+    created in. Keeping a single one on a long-lived thread keeps
+    keep-alive connections, TLS sessions and the DNS cache between the
+    requests of all tasks and pipeline stages, which submit their
+    requests to it instead of creating a manager of their own.
+    """
+
+    # callable, called with the worker on the network thread
+    job_submitted = QtCore.pyqtSignal(object)
+
+    def __init__(self):
+        super(NetworkWorker, self).__init__()
+        self.manager = None
+        self.requests = 0
+        self.handshakes = 0
+        # ApiCallManager instances whose calling thread waits for them
+        self.waiting = set()
+        self.stopping = False
+        # Set on the network thread once nobody waits for it any more
+        self.stopped = Event()
+        # request id -> callable, called with the reply when it has finished
+        self.handlers = {}
+        self.job_submitted.connect(self.run_job)
+
+    @QtCore.pyqtSlot(object)
+    def run_job(self, job):
+        if self.stopping:
+            return
+        if self.manager is None:
+            self.manager = QtNetwork.QNetworkAccessManager(self)
+        try:
+            job(self)
+        except Exception as e:
+            log.error("Network job failed: {}".format(e))
+
+    def send(self, request, handler):
+        """
+        Start a GET request on the shared manager.
+
+        The signals of the reply are connected to slots of the worker, not
+        to lambdas or methods of the caller: a lambda that refers to the
+        reply can be collected by another thread while it runs, and a
+        method of a QObject of the calling thread is queued to that
+        thread, which is waiting. The handler is looked up by an id kept
+        in a property of the reply, not by the reply itself: the Python
+        wrapper of a deleted reply can be handed out again for a new reply
+        at the same address.
+        input:
+            request: QNetworkRequest
+            handler: callable, called with the reply when it has finished
+        output:
+            QNetworkReply, with the id of the request in its 'request_id'
+            property
+        """
+        reply = self.manager.get(request)
+        self.requests += 1
+        reply.setProperty('request_id', self.requests)
+        self.handlers[self.requests] = handler
+
+        # 'encrypted' is only emitted when the reply needed a new TLS
+        # handshake, i.e. when no open connection could be reused
+        reply.setProperty('tls_handshake', False)
+        reply.encrypted.connect(self.reply_encrypted)
+        reply.finished.connect(self.reply_finished)
+        return reply
+
+    @QtCore.pyqtSlot()
+    def reply_encrypted(self):
+        self.sender().setProperty('tls_handshake', True)
+
+    @QtCore.pyqtSlot()
+    def reply_finished(self):
+        reply = self.sender()
+        handler = self.handlers.pop(reply.property('request_id'), None)
+        if handler is None:
+            return
+        try:
+            handler(reply)
+        except Exception as e:
+            log.error("Handling the response of '{0}' failed: {1}"
+                      .format(reply.url().toString(), e))
+
+    def stop(self):
+        """
+        Release everyone waiting for a request, delete the manager and end
+        the thread's event loop. Requests not started yet fail, and the
+        replies in flight are aborted, so their handlers run before the
+        manager goes. No new requests are started from then on.
+        """
+        self.stopping = True
+        for api_call_manager in list(self.waiting):
+            api_call_manager.release(STOPPED_ERROR)
+        if self.manager is not None:
+            for reply in self.manager.findChildren(
+                    QtNetwork.QNetworkReply):
+                reply.abort()
+            self.manager.deleteLater()
+            self.manager = None
+        for api_call_manager in list(self.waiting):
+            api_call_manager.finish()
+        self.stopped.set()
+        QtCore.QThread.currentThread().quit()
+
+
+def get_network_worker():
+    """
+    Return the NetworkWorker, starting the network thread if it is not
+    running.
+    """
+    global network_thread, network_worker
+    with network_thread_lock:
+        if network_worker is None:
+            thread = QtCore.QThread()
+            thread.setObjectName('Geonorge network')
+            worker = NetworkWorker()
+            worker.moveToThread(thread)
+            # Owned by C++, so PyQt does not delete them from another
+            # thread when the application goes; stop_network_thread()
+            # deletes them once the thread has ended
+            sip.transferto(thread, None)
+            sip.transferto(worker, None)
+            # The thread may be started from a thread that ends first
+            application = QtCore.QCoreApplication.instance()
+            if application is not None:
+                thread.moveToThread(application.thread())
+                connect_application_shutdown(application)
+            thread.start()
+            network_thread, network_worker = thread, worker
+        return network_worker
+
+
+def connect_application_shutdown(application):
+    """
+    Stop the network thread when the application quits, so the thread is
+    never destroyed while it runs. Scripts without an event loop do not
+    get aboutToQuit, so the thread is also stopped when the application
+    is destroyed.
+    """
+    global stopping_application
+    if application is stopping_application:
+        return
+    application.aboutToQuit.connect(stop_network_thread)
+    application.destroyed.connect(stop_network_thread)
+    stopping_application = application
+
+
+def stop_network_thread():
+    """
+    Stop the network thread and wait for it, e.g. when the plugin is
+    unloaded or the application quits. It is started again by the next
+    request.
+    """
+    global network_thread, network_worker
+    with network_thread_lock:
+        thread, worker = network_thread, network_worker
+        network_thread = network_worker = None
+    if thread is None or sip.isdeleted(thread):
+        return
+    if (sip.isdeleted(worker) or
+            QtCore.QCoreApplication.instance() is None):
+        # The application is being destroyed and no longer delivers the
+        # stop job; nobody waits for a request then
+        thread.quit()
+    else:
+        # NetworkWorker.stop() ends the event loop once it has run
+        worker.job_submitted.emit(NetworkWorker.stop)
+    thread.wait()
+    if not sip.isdeleted(worker):
+        sip.delete(worker)
+    sip.delete(thread)
+
+
+def is_main_thread():
+    """Return True when called from the thread running the Qt main loop."""
+    application = QtCore.QCoreApplication.instance()
+    return (application is not None and
+            QtCore.QThread.currentThread() == application.thread())
+
+
+class ApiResponse:
+    """Result of a single request made by ApiCallManager."""
+
+    def __init__(self, url, data=None, status_code=None, headers=None,
+                 error=None, elapsed=0.0, http2=False,
+                 connection_reused=None):
+        self.url = url
+        self.data = data
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.error = error
+        self.elapsed = elapsed
+        self.http2 = http2
+        # None when it cannot be told, i.e. for unencrypted connections
+        self.connection_reused = connection_reused
+
+    @property
+    def ok(self):
+        return self.error is None
+
 
 class ApiCallManager(QtCore.QObject):
+    """
+    Makes requests on the network thread for the calling thread.
+
+    get() and get_many() block the calling thread until the responses are
+    there; on the main thread the user interface keeps handling events
+    while it waits. get_async() returns at once and calls its callback on
+    the calling thread, which must run a Qt event loop.
+    """
 
     response_data = QtCore.pyqtSignal(str)
 
+    # callback, ApiResponse of get_async()
+    async_response = QtCore.pyqtSignal(object, object)
+
     def __init__(self):
         super(ApiCallManager, self).__init__()
-        self.manager = QtNetwork.QNetworkAccessManager()
-        self.loop = QtCore.QEventLoop()
+        self.worker = None
+        self.done = Event()
+        self.async_response.connect(self.deliver_async_response)
+
+        network_config = ConfigLoader().load_qgis_config().get('network', {})
+        self.min_concurrency = network_config.get(
+            'min_concurrent_requests', 2)
+        self.max_concurrency = network_config.get(
+            'max_concurrent_requests', 8)
+        self.latency_target = network_config.get(
+            'latency_target_ms', 1500) / 1000
+        self.concurrency_limit = min(
+            max(network_config.get('initial_concurrent_requests', 4),
+                self.min_concurrency),
+            self.max_concurrency)
+        self.request_timeout = network_config.get('request_timeout_ms',
+                                                  60000)
+
+        self.pending = deque()
+        self.in_flight = {}
+        self.results = []
+        self.successes_in_window = 0
+
+    def run_on_network_thread(self, job):
+        """
+        Run job on the network thread and wait until it calls finish(), or
+        until the network thread is stopped.
+        input:
+            job: callable without arguments, that starts requests whose
+            handlers call finish() when they have all finished
+        """
+        self.done.clear()
 
-    def get(self, url, params=None):
+        def run_job(worker):
+            worker.waiting.add(self)
+            try:
+                job()
+            except Exception as e:
+                log.error("Network request failed: {}".format(e))
+                self.finish()
+
+        worker = self.submit(run_job)
+        main_thread = is_main_thread()
+        while not self.done.wait(WAIT_INTERVAL):
+            # A job queued after the worker was stopped is never run
+            if sip.isdeleted(worker) or worker.stopped.is_set():
+                log.warning("The network thread was stopped before the "
+                            "requests were made.")
+                break
+            if main_thread:
+                QtCore.QCoreApplication.processEvents()
+
+    def finish(self):
+        """Release the thread waiting in run_on_network_thread()."""
+        self.worker.waiting.discard(self)
+        self.done.set()
+
+    def release(self, error):
+        """
+        Fail the requests not started yet with error and abort the ones in
+        flight; their handlers then release the waiting thread. An aborted
+        reply finishes at once, see handle_many_response().
+        """
+        self.fail_pending_requests(error)
+        for reply, _, _, _ in list(self.in_flight.values()):
+            reply.abort()
+
+    def submit(self, job):
+        """
+        Queue job to the network thread, starting it again if it was
+        stopped.
+        """
+        self.worker = get_network_worker()
+        self.worker.job_submitted.emit(job)
+        return self.worker
+
+    @staticmethod
+    def create_request(url, params=None, headers=None, timeout=None):
+        """
+        input:
+            timeout: int, optional milliseconds without any data received
+            after which Qt aborts the request; the reply then finishes
+            with an error
+        """
         qurl = QtCore.QUrl(url)
 
         if params:
@@ -21,20 +341,255 @@ class ApiCallManager(QtCore.QObject):
             qurl.setQuery(query)
 
         request = QtNetwork.QNetworkRequest(qurl)
+        # Several requests to the same host can share one HTTP/2
+        # connection (negotiated with ALPN, so only over https).
+        # Accept-Encoding is left to Qt, which then asks for gzip/deflate
+        # and decompresses the response itself.
+        request.setAttribute(
+            QtNetwork.QNetworkRequest.Http2AllowedAttribute,
+            qurl.scheme() == 'https')
+        for key, value in (headers or {}).items():
+            request.setRawHeader(key.encode('utf-8'), value.encode('utf-8'))
+        # Not a QTimer owned by the reply: a Python object owned by the
+        # reply can have the reply's wrapper deleted while it is in use
+        if timeout:
+            request.setTransferTimeout(timeout)
+        return request
 
-        self.reply = self.manager.get(request)
-        self.reply.finished.connect(self.handle_response)
-        self.loop.exec_()
+    def get(self, url, params=None, timeout=None, is_canceled=None):
+        """
+        Fetch one URL; the response data is then in get_response_data(),
+        None if the request failed, timed out or was canceled.
+        input:
+            timeout: int, optional milliseconds without any data received
+            after which the request is aborted
+            is_canceled: callable, e.g. QgsTask.isCanceled of the task
+            the request is made for
+        """
+        request = self.create_request(url, params, timeout=timeout)
+        self.response_data = None
+        self.pending = deque()
+        self.in_flight = {}
+        self.run_on_network_thread(
+            partial(self.start_get, request, is_canceled))
 
-    def handle_response(self):
+    def start_get(self, request, is_canceled):
+        self.start_cancel_timer(is_canceled)
+        started = perf_counter()
+        reply = self.worker.send(request, partial(
+            self.handle_response, started=started))
+        self.in_flight[reply.property('request_id')] = (
+            reply, [], reply.url().toString(), started)
 
-        if self.reply.error() == QtNetwork.QNetworkReply.NoError:
-            self.response_data = self.reply.readAll()
-        else:
-            log.error(
-                "API error response occurred: ", self.reply.errorString())
-            self.response_data = None
-        self.loop.quit()
+    def handle_response(self, reply, started):
+        self.in_flight.pop(reply.property('request_id'), None)
+        response = self.read_reply(
+            self.worker, reply, reply.url().toString(),
+            perf_counter() - started)
+        self.response_data = response.data
+        reply.deleteLater()
+        self.stop_cancel_timer()
+        self.finish()
 
     def get_response_data(self):
         return self.response_data
+
+    def get_async(self, url, callback, params=None):
+        """
+        Start a request without waiting for it.
+        input:
+            url: str
+            callback: callable, called with an ApiResponse when the
+            request has finished
+            params: dict, optional query parameters
+        """
+        request = self.create_request(url, params)
+
+        def start_get_async(worker):
+            worker.send(request, partial(
+                self.handle_async_response, url=url, callback=callback,
+                started=perf_counter()))
+
+        self.submit(start_get_async)
+
+    def handle_async_response(self, reply, url, callback, started):
+        response = self.read_reply(self.worker, reply, url,
+                                   perf_counter() - started)
+        reply.deleteLater()
+        # Queued to the thread this QObject belongs to
+        self.async_response.emit(callback, response)
+
+    @QtCore.pyqtSlot(object, object)
+    def deliver_async_response(self, callback, response):
+        callback(response)
+
+    def get_many(self, urls, headers=None, is_canceled=None):
+        """
+        Fetch many URLs with a bounded number of requests in flight.
+
+        The requests are made on the network thread. The number of
+        concurrent requests starts at 'initial_concurrent_requests' and
+        is adjusted between 'min_concurrent_requests' and
+        'max_concurrent_requests': it grows by one for every full window
+        of fast successful responses and is halved when a request fails
+        or is slower than 'latency_target_ms'.
+
+        Equal requests (same URL and headers) are coalesced into one
+        request whose response is shared by all of them. A request is
+        aborted when no data has been received for 'request_timeout_ms'.
+        When is_canceled returns True, or the network thread is stopped,
+        the requests in flight are aborted and the rest are not started;
+        their responses have an error.
+        input:
+            urls: list of str
+            headers: list of dict, optional request headers per URL
+            is_canceled: callable, e.g. QgsTask.isCanceled of the task
+            the requests are made for
+        output:
+            list of ApiResponse, in the same order as urls
+        """
+        if not urls:
+            return []
+
+        unique_requests = {}
+        for index, url in enumerate(urls):
+            request_headers = headers[index] if headers else None
+            key = (url, tuple(sorted((request_headers or {}).items())))
+            unique_requests.setdefault(key, ([], url, request_headers))
+            unique_requests[key][0].append(index)
+
+        self.results = [None] * len(urls)
+        self.pending = deque(unique_requests.values())
+        self.in_flight = {}
+
+        started = perf_counter()
+        self.run_on_network_thread(partial(self.start_many, is_canceled))
+        self.results = [
+            response if response is not None
+            else ApiResponse(url, error=STOPPED_ERROR)
+            for url, response in zip(urls, self.results)]
+
+        log.info("Fetched {0} URLs with {1} requests in {2:.2f}s "
+                 "(concurrency limit {3}, {4} of {5} requests so far "
+                 "needed a TLS handshake)"
+                 .format(len(urls), len(unique_requests),
+                         perf_counter() - started, self.concurrency_limit,
+                         self.worker.handshakes, self.worker.requests))
+        return self.results
+
+    def start_many(self, is_canceled):
+        """Start the requests of get_many() on the network thread."""
+        self.start_cancel_timer(is_canceled)
+        self.start_pending_requests()
+
+    def start_cancel_timer(self, is_canceled):
+        """
+        Check is_canceled every CANCEL_CHECK_INTERVAL_MS while the
+        requests run.
+        """
+        self.cancel_timer = None
+        if is_canceled is not None:
+            # Owned by the worker, so it is deleted on the network thread
+            self.cancel_timer = QtCore.QTimer(self.worker)
+            self.cancel_timer.timeout.connect(
+                lambda: self.cancel_if_canceled(is_canceled))
+            self.cancel_timer.start(CANCEL_CHECK_INTERVAL_MS)
+
+    def stop_cancel_timer(self):
+        if self.cancel_timer is not None:
+            self.cancel_timer.stop()
+            self.cancel_timer.deleteLater()
+            self.cancel_timer = None
+
+    def start_pending_requests(self):
+        if self.worker.stopping:
+            return
+        while self.pending and len(self.in_flight) < self.concurrency_limit:
+            indexes, url, request_headers = self.pending.popleft()
+            request = self.create_request(url, headers=request_headers,
+                                          timeout=self.request_timeout)
+            reply = self.worker.send(request, self.handle_many_response)
+            self.in_flight[reply.property('request_id')] = (
+                reply, indexes, url, perf_counter())
+
+    def cancel_if_canceled(self, is_canceled):
+        """Abort the requests once is_canceled is True."""
+        if not is_canceled():
+            return
+        log.info("Canceled {0} requests in flight and {1} not started"
+                 .format(len(self.in_flight), len(self.pending)))
+        self.release('Canceled')
+
+    def fail_pending_requests(self, error):
+        """Give the requests of get_many() not started yet an error."""
+        while self.pending:
+            indexes, url, _ = self.pending.popleft()
+            for index in indexes:
+                self.results[index] = ApiResponse(url, error=error)
+
+    def handle_many_response(self, reply):
+        _, indexes, url, started = self.in_flight.pop(
+            reply.property('request_id'))
+        response = self.read_reply(self.worker, reply, url,
+                                   perf_counter() - started)
+        reply.deleteLater()
+
+        for index in indexes:
+            self.results[index] = response
+        self.adjust_concurrency(response)
+        self.start_pending_requests()
+
+        if not self.in_flight:
+            self.stop_cancel_timer()
+            self.finish()
+
+    @staticmethod
+    def read_reply(worker, reply, url, elapsed):
+        status_code = reply.attribute(
+            QtNetwork.QNetworkRequest.HttpStatusCodeAttribute)
+        headers = {
+            bytes(key).decode('latin-1').lower():
+                bytes(value).decode('latin-1')
+            for key, value in reply.rawHeaderPairs()}
+
+        http2 = bool(reply.attribute(
+            QtNetwork.QNetworkRequest.Http2WasUsedAttribute))
+        connection_reused = None
+        if reply.attribute(
+                QtNetwork.QNetworkRequest.ConnectionEncryptedAttribute):
+            connection_reused = not reply.property('tls_handshake')
+            if not connection_reused:
+                worker.handshakes += 1
+        log.debug("GET '{0}': status {1}, {2:.0f} ms, {3}, connection "
+                  "reused: {4}".format(
+                      url, status_code, elapsed * 1000,
+                      'HTTP/2' if http2 else 'HTTP/1.1',
+                      {True: 'yes', False: 'no', None: 'unknown'}[
+                          connection_reused]))
+
+        if reply.error() == QtNetwork.QNetworkReply.NoError:
+            return ApiResponse(url, reply.readAll(), status_code, headers,
+                               elapsed=elapsed, http2=http2,
+                               connection_reused=connection_reused)
+
+        error = reply.errorString()
+        log.error("API error response occurred for '{0}': {1}"
+                  .format(url, error))
+        return ApiResponse(url, None, status_code, headers, error, elapsed,
+                           http2, connection_reused)
+
+    def adjust_concurrency(self, response):
+        """Additive increase, multiplicative decrease of the limit."""
+        limit = self.concurrency_limit
+        if not response.ok or response.elapsed > self.latency_target:
+            self.concurrency_limit = max(self.min_concurrency, limit // 2)
+            self.successes_in_window = 0
+        else:
+            self.successes_in_window += 1
+            if self.successes_in_window >= limit:
+                self.concurrency_limit = min(self.max_concurrency, limit + 1)
+                self.successes_in_window = 0
+
+        if self.concurrency_limit != limit:
+            log.debug("Concurrency limit changed from {0} to {1}"
+                      .format(limit, self.concurrency_limit))
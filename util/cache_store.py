@@ -0,0 +1,236 @@
+import sqlite3
+from os import makedirs
+from os.path import dirname, exists, join
+from threading import Lock, local
+from time import time
+from .config_loader import ConfigLoader
+from .logging_setup import logger as log
+
+
+def get_cache_directory(config=None):
+    """Return the directory the caches are stored in."""
+    if config is None:
+        config = ConfigLoader().load_qgis_config()
+    return config.get('cache', {}).get('directory') or join(
+        dirname(dirname(__file__)), 'cache')
+
+
+class CacheStore:
+    """
+    Small persistent key/value store backed by a SQLite file.
+
+    Every cache lives in its own file in the cache directory. Entries keep
+    the time they were stored and last used, so callers can apply a
+    max-age and the store can evict the least recently used entries when
+    it grows beyond max_entries or max_bytes.
+
+    Each thread keeps one connection per cache file. Reads only write
+    when the last use of the entry is older than TOUCH_INTERVAL, and the
+    limits are enforced every EVICT_INTERVAL puts, so a cache can briefly
+    hold up to EVICT_INTERVAL entries more than its limits.
+    """
+
+    # Seconds between updates of the last use of an entry on reads
+    TOUCH_INTERVAL = 3600
+    # Puts to a cache file between evictions
+    EVICT_INTERVAL = 100
+
+    # Cache files with their table created in this process, and the
+    # number of puts to each cache file since its last eviction
+    created_paths = set()
+    puts_since_eviction = {}
+    state_lock = Lock()
+
+    # {path: sqlite3.Connection} of every thread
+    connections = local()
+
+    def __init__(self, name, max_entries=None, max_bytes=None):
+        config = ConfigLoader().load_qgis_config()
+        cache_config = config.get('cache', {})
+
+        self.name = name
+        self.enabled = cache_config.get('enabled', True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        directory = get_cache_directory(config)
+        self.path = join(directory, '{}.sqlite'.format(name))
+
+        if self.enabled and self.path not in CacheStore.created_paths:
+            try:
+                self.create_table(directory)
+            except (OSError, sqlite3.Error) as e:
+                log.error("Cache '{0}' is disabled: {1}".format(name, e))
+                self.enabled = False
+            else:
+                with CacheStore.state_lock:
+                    CacheStore.created_paths.add(self.path)
+
+    def connect(self):
+        """Return the connection of the current thread to the cache file."""
+        connections = getattr(CacheStore.connections, 'by_path', None)
+        if connections is None:
+            connections = CacheStore.connections.by_path = {}
+        connection = connections.get(self.path)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connections[self.path] = connection
+        return connection
+
+    def create_table(self, directory):
+        if not exists(directory):
+            makedirs(directory)
+        connection = self.connect()
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB, etag TEXT, "
+                "last_modified TEXT, size INTEGER, stored_at REAL, "
+                "last_used REAL)")
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_last_used "
+                "ON entries (last_used)")
+
+    def get(self, key):
+        """
+        Get an entry from the cache.
+        input:
+            key: str
+        output:
+            dict: {'value', 'etag', 'last_modified', 'stored_at'} or None
+        """
+        if not self.enabled:
+            return None
+        try:
+            connection = self.connect()
+            with connection:
+                row = connection.execute(
+                    "SELECT value, etag, last_modified, stored_at, "
+                    "last_used FROM entries WHERE key = ?",
+                    (key,)).fetchone()
+                if row is None:
+                    return None
+                now = time()
+                if (row[4] or 0) < now - self.TOUCH_INTERVAL:
+                    connection.execute(
+                        "UPDATE entries SET last_used = ? WHERE key = ?",
+                        (now, key))
+        except sqlite3.Error as e:
+            log.error("Cache '{0}' read failed: {1}".format(self.name, e))
+            return None
+
+        value, etag, last_modified, stored_at, _ = row
+        return {
+            'value': value,
+            'etag': etag,
+            'last_modified': last_modified,
+            'stored_at': stored_at,
+        }
+
+    def put(self, key, value, etag=None, last_modified=None):
+        """
+        Store an entry in the cache and evict old entries if needed.
+        input:
+            key: str
+            value: str or bytes
+            etag: str, ETag of the HTTP response the value came from
+            last_modified: str, Last-Modified of the HTTP response
+        """
+        self.put_many([(key, value)], etag, last_modified)
+
+    def put_many(self, items, etag=None, last_modified=None):
+        """
+        Store entries in the cache in one transaction and evict old
+        entries if needed.
+        input:
+            items: list of (key, value)
+            etag: str, ETag of the HTTP response the values came from
+            last_modified: str, Last-Modified of the HTTP response
+        """
+        if not self.enabled or not items:
+            return
+        now = time()
+        with CacheStore.state_lock:
+            puts = CacheStore.puts_since_eviction.get(self.path, 0)
+            evict = puts == 0 or puts + len(items) >= self.EVICT_INTERVAL
+            CacheStore.puts_since_eviction[self.path] = (
+                0 if evict else puts) + len(items)
+        try:
+            connection = self.connect()
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO entries (key, value, etag, "
+                    "last_modified, size, stored_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(key, value, etag, last_modified, len(value or ''),
+                      now, now) for key, value in items])
+                if evict:
+                    self.evict(connection)
+        except sqlite3.Error as e:
+            log.error("Cache '{0}' write failed: {1}".format(self.name, e))
+
+    def touch(self, key):
+        """Mark an entry as freshly stored, e.g. after a 304 response."""
+        if not self.enabled:
+            return
+        now = time()
+        try:
+            connection = self.connect()
+            with connection:
+                connection.execute(
+                    "UPDATE entries SET stored_at = ?, last_used = ? "
+                    "WHERE key = ?", (now, now, key))
+        except sqlite3.Error as e:
+            log.error("Cache '{0}' write failed: {1}".format(self.name, e))
+
+    def delete(self, key):
+        if not self.enabled:
+            return
+        try:
+            connection = self.connect()
+            with connection:
+                connection.execute(
+                    "DELETE FROM entries WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            log.error("Cache '{0}' write failed: {1}".format(self.name, e))
+
+    def clear(self):
+        if not self.enabled:
+            return
+        try:
+            connection = self.connect()
+            with connection:
+                connection.execute("DELETE FROM entries")
+        except sqlite3.Error as e:
+            log.error("Cache '{0}' write failed: {1}".format(self.name, e))
+            return
+        log.info("Cache '{}' cleared.".format(self.name))
+
+    def evict(self, connection):
+        """Remove the least recently used entries beyond the limits."""
+        evicted = 0
+        if self.max_entries:
+            evicted += connection.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries "
+                "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)).rowcount
+
+        if self.max_bytes:
+            total_size = connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total_size > self.max_bytes:
+                rows = connection.execute(
+                    "SELECT key, size FROM entries ORDER BY last_used ASC")
+                keys_to_delete = []
+                for key, size in rows:
+                    if total_size <= self.max_bytes:
+                        break
+                    keys_to_delete.append((key,))
+                    total_size -= size or 0
+                connection.executemany(
+                    "DELETE FROM entries WHERE key = ?", keys_to_delete)
+                evicted += len(keys_to_delete)
+
+        if evicted:
+            log.debug("Cache '{0}': evicted {1} entries."
+                      .format(self.name, evicted))
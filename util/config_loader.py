@@ -1,8 +1,41 @@
+from os import stat
 from os.path import join, dirname
 from json import load
+from threading import Lock
+
+
+class FrozenDict(dict):
+    """
+    Read-only dict. The configuration is shared by all callers, so the
+    views handed out by ConfigLoader cannot be changed.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("The configuration is read-only")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+def freeze(value):
+    """Return an immutable copy of a parsed JSON value."""
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
 
 
 class ConfigLoader:
+
+    # Parsed configuration files shared by all loaders in the process:
+    # file path -> ((mtime, size), configuration)
+    loaded_configs = {}
+    lock = Lock()
+
     def __init__(self):
         self.config_directory = join(dirname(dirname(__file__)), 'config')
 
@@ -30,10 +63,23 @@ class ConfigLoader:
         """
         Load the configuration from the JSON file at config_path
 
+        The file is parsed once and the result is shared until the file
+        changes, so edits apply without restarting QGIS. The returned
+        configuration is read-only: dicts are FrozenDicts and lists are
+        tuples.
+
         :return: Configuration dictionary.
         :rtype: dict
         """
         file_path = join(self.config_directory, filename)
-        with open(file_path, 'r') as file:
-            config = load(file)
-        return config
+        file_stat = stat(file_path)
+        version = (file_stat.st_mtime_ns, file_stat.st_size)
+
+        with ConfigLoader.lock:
+            loaded_config = ConfigLoader.loaded_configs.get(file_path)
+            if loaded_config is None or loaded_config[0] != version:
+                with open(file_path, 'r') as file:
+                    config = freeze(load(file))
+                loaded_config = (version, config)
+                ConfigLoader.loaded_configs[file_path] = loaded_config
+        return loaded_config[1]
@@ -1,56 +1,247 @@
 from .config_loader import ConfigLoader
-from json import loads
+from json import dumps, loads
+from threading import Lock
+from time import time
+from PyQt5 import QtCore
 from .logging_setup import logger as log
-from .api_call_manager import ApiCallManager as acm
+from .api_call_manager import ApiCallManager as acm, is_main_thread
+from .cache_store import CacheStore
+from .offline_bundle import OfflineBundle
 
 
 class GeonorgeAPI:
 
+    # Background refreshes in progress, kept alive until they have finished
+    background_refreshes = {}
+
+    # Theme responses fetched in this QGIS session: key -> (time, json)
+    theme_responses = {}
+
+    # Starts background refreshes on the main thread, see get_schemas()
+    schema_refresher = None
+    schema_refresher_lock = Lock()
+
     def __init__(self):
         config_loader = ConfigLoader()
         self.config = config_loader.load_qgis_config()
         print(f"Geonorge API initialized with config: {self.config}")
 
-    def get_styles_for_theme(self, tema):
-        # Load the configuration
+    def get_styles_for_theme(self, tema, is_canceled=None):
+        """
+        Fetch the style search response of a theme. A request that gets no
+        data for 'network.request_timeout_ms', or is canceled, gives None.
+        input:
+            tema: str, schema identifier of the theme
+            is_canceled: callable, e.g. QgsTask.isCanceled of the task
+            the search is made for
+        """
 
         # Define the endpoint URL and request parameters
-        endpoint_url = self.config['endpoint_url']['cartography']
-        request_params = {
-            "text": str(tema),
-            "limitofficial": True
-        }
+        endpoint_url, request_params = self.get_theme_request(tema)
+
+        cache_config = self.config.get('cache', {}).get('theme_responses', {})
+        ttl = cache_config.get('ttl_hours', 24) * 3600
+        cache_key = self.get_request_cache_key(endpoint_url, request_params)
+
+        # Responses already fetched in this session
+        stored_at, json_data = GeonorgeAPI.theme_responses.get(
+            cache_key, (0, None))
+        if json_data is not None and time() - stored_at < ttl:
+            log.info("OK Styles for theme '{}' from memory".format(tema))
+            return json_data
+
+        # Responses from the installed offline bundle
+        offline_bundle = OfflineBundle.get_installed()
+        if offline_bundle is not None:
+            json_data = offline_bundle.get_theme_response(cache_key)
+            if json_data is not None:
+                GeonorgeAPI.theme_responses[cache_key] = (time(), json_data)
+                log.info("OK Styles for theme '{}' from offline bundle"
+                         .format(tema))
+                return json_data
+
+        # Responses fetched in earlier sessions
+        theme_cache = CacheStore(
+            'theme_responses',
+            max_entries=cache_config.get('max_entries', 1000))
+        cached_response = theme_cache.get(cache_key)
+        if (cached_response is not None and
+                time() - cached_response['stored_at'] < ttl):
+            json_data = loads(cached_response['value'])
+            GeonorgeAPI.theme_responses[cache_key] = (
+                cached_response['stored_at'], json_data)
+            log.info("OK Styles for theme '{}' from cache".format(tema))
+            return json_data
 
         # Make the API call
         api_call_new = acm()
-        api_call_new.get(endpoint_url, request_params)
+        api_call_new.get(
+            endpoint_url, request_params,
+            timeout=self.config.get('network', {}).get('request_timeout_ms'),
+            is_canceled=is_canceled)
         response_data = api_call_new.get_response_data()
         if response_data:
-            json_data = loads(str(response_data, 'utf-8'))
+            json_string = str(response_data, 'utf-8')
+            json_data = loads(json_string)
+            theme_cache.put(cache_key, json_string)
+            GeonorgeAPI.theme_responses[cache_key] = (time(), json_data)
             log.info(
                 "OK Fetching styles for theme '{}' from Geonorge".format(tema))
             return json_data
 
         return None
 
+    def get_theme_request(self, tema):
+        """Return the endpoint URL and parameters of a theme search."""
+        endpoint_url = self.config['endpoint_url']['cartography']
+        request_params = {
+            "text": str(tema),
+            "limitofficial": True
+        }
+        return endpoint_url, request_params
+
+    @staticmethod
+    def get_request_cache_key(endpoint_url, request_params):
+        """
+        Build a cache key from the endpoint and the normalized request
+        parameters, so equal requests share one entry.
+        """
+        normalized_params = sorted(
+            (key, str(value).strip().lower() if isinstance(value, bool)
+             else str(value).strip())
+            for key, value in request_params.items())
+        return dumps([endpoint_url, normalized_params], ensure_ascii=False)
+
     def get_schemas(self):
         """
         Fetches schema data from the Geonorge API.
+
+        The register is kept in a local cache. A copy younger than
+        'ttl_hours' is used as is. An older copy is still returned
+        immediately while a fresh one is fetched in the background, until
+        it is older than 'max_stale_hours'. Then the register is fetched
+        before returning, and the stale copy is used if Geonorge is down
+        or does not answer within 'timeout_ms'.
         :return: DataFrame containing schema data.
         :rtype: pd.DataFrame
         """
         # Get the endpoint URL from the config
         schema_url = self.config['endpoint_url']['schema']
 
+        offline_bundle = OfflineBundle.get_installed()
+        if offline_bundle is not None:
+            json_data = offline_bundle.get_schemas(schema_url)
+            if json_data is not None:
+                log.info("OK Schemas from offline bundle")
+                return json_data
+
+        cache_config = self.config.get('cache', {}).get('schema_register', {})
+        ttl = cache_config.get('ttl_hours', 24) * 3600
+        max_stale = cache_config.get('max_stale_hours', 720) * 3600
+        register_cache = CacheStore('schema_register')
+
+        cached_register = register_cache.get(schema_url)
+        if cached_register is not None:
+            age = time() - cached_register['stored_at']
+            if age < ttl:
+                log.info("OK Schemas from cache ({:.1f} hours old)"
+                         .format(age / 3600))
+                return loads(cached_register['value'])
+            # Background refreshes need the main event loop; outside the
+            # main thread, e.g. in a task, it is asked to start one
+            refresher = self.get_schema_refresher()
+            if age < max_stale and refresher is not None:
+                log.info("Stale schemas from cache ({:.1f} hours old), "
+                         "refreshing in the background".format(age / 3600))
+                if is_main_thread():
+                    self.refresh_schemas_in_background(schema_url,
+                                                       register_cache)
+                else:
+                    refresher.refresh_requested.emit(schema_url)
+                return loads(cached_register['value'])
+
+        # Only give up on a slow request if there is a copy to fall back to
+        timeout = None
+        if cached_register is not None:
+            timeout = self.config.get('network', {}).get('timeout_ms')
+
         # Make the API call
         api_call_new = acm()
-        api_call_new.get(schema_url)
+        api_call_new.get(schema_url, timeout=timeout)
         response_data = api_call_new.get_response_data()
 
         if response_data:
             log.info("OK Fetching schemas from Geonorge")
-            json_data = loads(str(response_data, 'utf-8'))
+            json_string = str(response_data, 'utf-8')
+            json_data = loads(json_string)
+            register_cache.put(schema_url, json_string)
             return json_data
 
+        if cached_register is not None:
+            log.warning("Cannot fetch schemas from Geonorge, using the "
+                        "cached copy")
+            return loads(cached_register['value'])
+
         log.debug("Cannot fetch schemas from Geonorge")
         return None
+
+    @staticmethod
+    def get_schema_refresher():
+        """
+        Return the SchemaRefresher of the main thread, or None when there
+        is no Qt application to run the refresh.
+        """
+        application = QtCore.QCoreApplication.instance()
+        if application is None:
+            return None
+        with GeonorgeAPI.schema_refresher_lock:
+            if GeonorgeAPI.schema_refresher is None:
+                refresher = SchemaRefresher()
+                refresher.moveToThread(application.thread())
+                GeonorgeAPI.schema_refresher = refresher
+            return GeonorgeAPI.schema_refresher
+
+    def refresh_schemas_in_background(self, schema_url, register_cache):
+        """
+        Fetch the schema register without blocking and update the cache.
+        """
+        if schema_url in GeonorgeAPI.background_refreshes:
+            return
+
+        def handle_refreshed_schemas(response):
+            GeonorgeAPI.background_refreshes.pop(schema_url, None)
+            if not (response.ok and response.data):
+                log.warning("Background refresh of schemas failed, the "
+                            "cached copy is kept")
+                return
+            json_string = str(response.data, 'utf-8')
+            try:
+                loads(json_string)
+            except ValueError as e:
+                log.error("Invalid schemas from Geonorge: {}".format(e))
+                return
+            register_cache.put(schema_url, json_string)
+            log.info("Schemas refreshed in the background")
+
+        api_call_new = acm()
+        GeonorgeAPI.background_refreshes[schema_url] = api_call_new
+        api_call_new.get_async(schema_url, handle_refreshed_schemas)
+
+
+class SchemaRefresher(QtCore.QObject):
+    """
+    Starts background refreshes of the schema register on the main thread,
+    also when the stale register is read in a task. The request is
+    queued to the main thread, so the task does not wait for it.
+    """
+
+    refresh_requested = QtCore.pyqtSignal(str)
+
+    def __init__(self):
+        super(SchemaRefresher, self).__init__()
+        self.refresh_requested.connect(self.refresh)
+
+    @QtCore.pyqtSlot(str)
+    def refresh(self, schema_url):
+        GeonorgeAPI().refresh_schemas_in_background(
+            schema_url, CacheStore('schema_register'))
@@ -1,202 +1,530 @@
 from .logging_setup import logger as log
 from .schema_utils import SchemaUtils
-from pandas import DataFrame, concat
-from xml.etree.ElementTree import parse
-from .style_utils import LayerStylesUpdater as lsu
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from os import cpu_count
+from .config_loader import ConfigLoader
+from .geonorge_apis import GeonorgeAPI
+from .xml_utils import get_gml_schemalocations
+from .schema_location_cache import SchemaLocationCache
+from .style_decision_cache import StyleDecisionCache
+from .style_utils import LayerStylesUpdater as lsu, StyleNameIndex
 from .layers_utils import LayersUtils as lu
+from .staged_pipeline import StagedPipeline
+
+# Returned by read_gml_schemalocations() when a GML file could not be read,
+# e.g. because it is locked or on a network drive that is not available;
+# unlike a file without schema locations, this is not cached
+READ_FAILED = object()
 
 
 class GMLProcessor:
-    def __init__(self, ui_helpers):
+    def __init__(self, ui_helpers, task=None):
+        """
+        input:
+            ui_helpers: UIHelpers used for messages to the user
+            task: StyleSearchTask when running in the background, used to
+            report progress and partial results and to check for
+            cancellation
+        """
         self.ui_helpers = ui_helpers
+        self.task = task
         self.schema_utils = SchemaUtils()
-
-    def process_gml_files(self, gml_layers_dataFrame_group):
-
-        total_gml_files = len(gml_layers_dataFrame_group)
-        progress_message_bar, progress_bar = self.ui_helpers.show_progress_bar(
-            total_gml_files, "Processing '{}' GML Files"
-            .format(total_gml_files))
-
-        current_step = 0
+        self.schema_location_cache = SchemaLocationCache()
+        self.style_decision_cache = StyleDecisionCache()
+        self.gml_schemas = {}
+
+        # Shared by all GML files with the same schema identifier
+        self.theme_styles = {}
+        self.style_name_indexes = {}
+        self.theme_fingerprints = {}
+        self.style_decisions = {}
+        # Style format of the themes with decisions that are not in the
+        # StyleDecisionCache yet
+        self.new_style_decisions = {}
+        self.theme_locks = {}
+        self.theme_locks_lock = Lock()
+
+        config = ConfigLoader().load_qgis_config()
+        self.pipeline_workers = config.get('workers', {})
+        self.schema_location_workers = (
+            self.pipeline_workers.get('schema_locations') or
+            cpu_count() or 1)
+
+    def process_gml_files(self, gml_layer_groups):
+        """
+        Find the styles for the layers of every GML file.
+
+        input:
+            gml_layer_groups: list of (root filename, list of LayerRecord)
+        output:
+            list of LayerStyle: The layers with styles of all files.
+
+        The files go through a pipeline of four stages: finding the
+        schema identifier, fetching the theme, matching the styles and
+        downloading the style files. Each stage has its own workers
+        ('workers' in the config), so the schema of one file can be read
+        while the theme of the previous file is fetched and the styles of
+        the file before that are downloaded. Messages, reports and
+        results are handled in file order, as in a serial run.
+        """
+        total_gml_files = len(gml_layer_groups)
 
         self.schema_utils.fetch_geonorge_schemas()
-        layer_styles_df = DataFrame()
+        lsu.clear_style_file_strings()
 
         # Check if there are any schemas fetched from Geonorge
         if self.schema_utils.geonorge_schemas is None:
             self.ui_helpers.message_bar_critial(
                 "Kan ikke hente skjemaer fra Geonorge.")
-            return layer_styles_df
+            return []
+
+        gml_file_jobs = [
+            {
+                'step': step,
+                'total_gml_files': total_gml_files,
+                'root_filename': root_filename,
+                'layers': list(layers),
+                'messages': [],
+            }
+            for step, (root_filename, layers) in enumerate(
+                gml_layer_groups, start=1)]
+
+        # Read the schema locations of all selected files up front
+        self.prefetch_gml_schemas(
+            [job['layers'][0].file_path for job in gml_file_jobs])
 
         # Iterate through each group to get the schema and styles
         log.info("=== Extracting schema and styles from GML files ===")
-        for root_filename, group in gml_layers_dataFrame_group:
-            progress_bar.setValue(current_step)
-            current_step += 1
-            progress_message_bar.setText(
-                "Processing GML Files: {}/{}".format(
-                    current_step, total_gml_files))
-            log.info("Processing GML file '{}' ({}/{})"
-                     .format(root_filename, current_step, total_gml_files))
-
-            group_layers_dataFrame = DataFrame(group)
-
-            gml_file_path = group_layers_dataFrame['File_Path'].iloc[0]
-            gml_schema_locations = self.get_gml_schemalocations(gml_file_path)
-
-            # Get schema identifiers from Geonorge based on gml file schema locations
-            if gml_schema_locations is None:
-                self.ui_helpers.log_message_warning(
-                    "Ingen schema funnet i GML-filen '{}'"
-                    .format(root_filename))
-                log.debug("No schemalocations found in the GML file: '{}' "
-                          .format(gml_file_path))
-                continue
-            schema_identifier = (
-                self.schema_utils.find_geonorge_schema_identifier(gml_schema_locations))
-
-            if not schema_identifier:
-                self.ui_helpers.log_message_warning(
-                    "Ingen samsvarende skjema funnet i Geonorge "
-                    "skjemaregisteret for GML-filen '{}'."
-                    .format(root_filename)
-                )
-                continue
-            # Add the schema identifier to the group
-            group_layers_dataFrame['schema_identifier'] = schema_identifier
-
-            # Get the styles for the selected layers
-            theme_styles_dataFrame = lsu.get_styles_for_theme(
-                schema_identifier)
-            if theme_styles_dataFrame is None:
-                log.debug("No styles found for theme '{}'."
-                          .format(schema_identifier))
-                self.ui_helpers.message_bar_warning(
-                    "Kunne ikke finne tegneregel i Geonorge for '{}'."
-                    .format(schema_identifier))
+        pipeline = StagedPipeline(
+            [('schemas', self.find_schema_stage,
+              self.pipeline_workers.get('schemas', 1)),
+             ('themes', self.fetch_theme_stage,
+              self.pipeline_workers.get('themes', 2)),
+             ('styles', self.match_styles_stage,
+              self.pipeline_workers.get('styles', 1)),
+             ('downloads', self.download_styles_stage,
+              self.pipeline_workers.get('downloads', 2))],
+            queue_size=self.pipeline_workers.get('queue_size', 2),
+            is_canceled=self.is_canceled)
+
+        # The layers with styles of every file, in file order
+        layer_styles = []
+        for job, layers_with_styles in pipeline.run(gml_file_jobs):
+            if self.is_canceled():
+                log.info("Processing of GML files was canceled.")
+                break
+            for message_type, message in job['messages']:
+                getattr(self.ui_helpers, message_type)(message)
+            # Reports of files with the same theme share a file name, so
+            # they are saved one at a time in file order
+            if 'report' in job:
+                lu.save_layer_style_report(job.pop('report'))
+            if layers_with_styles is None:
                 continue
 
-            supported_symbology_for_theme = lsu.filter_styles_by_formats(
-                theme_styles_dataFrame)
-
-            # Check if there are any supported formats
-            if supported_symbology_for_theme.empty:
-                log.warning("No supported formats found for theme '{}'."
-                            .format(schema_identifier))
-                self.ui_helpers.log_message_warning(
-                    "Ingen støttede formater funnet for temaet '{}'"
-                    .format(schema_identifier))
-                continue
-
-            group_layers_dataFrame = (
-                lsu.apply_Gml_node_overrides(group_layers_dataFrame,
-                                             schema_identifier))
-            # Map layers to appropriate styles
-            log.info("=== Fetch Styles for layers ===")
-
-            group_layers_dataFrame['style_name'] = (
-                group_layers_dataFrame.apply(lambda row:
-                                             lsu.get_style_name(
-                                                row,
-                                                supported_symbology_for_theme,
-                                                'qml'), axis=1))
-            styled_layers_data = lu.merge_and_rename_styles_with_layers(
-                group_layers_dataFrame, supported_symbology_for_theme
-            )
-
-            lu.save_layer_style_report(styled_layers_data)
-
-            layers_with_styles = lu.filter_layers_with_styles(
-                styled_layers_data)
-
-            if layers_with_styles.empty:
-                self.ui_helpers.log_message_warning(
-                    "Ingen tegneregler funnet for det valgte temaet."
-                )
-                log.warning("No styles found for the selected theme.")
-                continue
-            # Count the number of layers with styles
-            total_layers_with_style = len(layers_with_styles)
-            total_selected_layers = len(group_layers_dataFrame.dropna(
-                subset=['Layer_Name']))
-
-            log.info("Acquired {0} of {1} selected layers"
-                     .format(total_layers_with_style, total_selected_layers))
-            layers_with_styles = layers_with_styles.copy()
-
-            # Get style file string
-            log.info("=== Get Style file string ===")
-            layers_with_styles['Style_file_string'] = layers_with_styles.apply(
-                lambda row: lsu.add_file_string_to_row(row), axis=1
-            )
-
-            # Filter out layers without style file string
-            layers_with_styles = layers_with_styles[
-                layers_with_styles['Style_file_string'].notnull()]
-
-            if layers_with_styles.empty:
-                self.ui_helpers.log_message_warning(
-                    "Ingen tegneregler-fil ble funnet for det valgte temaet."
-                )
-                log.debug("No style file was fetched for the selected theme.")
-                continue
-            layer_styles_df = concat([layer_styles_df, layers_with_styles])
+            root_filename = job['root_filename']
+            layer_styles.extend(layers_with_styles)
             self.ui_helpers.log_message_info(
                 f"Tegneregler er hentet for '{root_filename}.")
+            if self.task is not None:
+                self.task.gml_file_finished.emit(
+                    root_filename, layers_with_styles)
 
-        # Finalize and close the progress dialog
-        self.ui_helpers.close_progress_bar(progress_message_bar,
-                                           delay=12000)
+        self.save_style_decisions()
+        self.schema_location_cache.log_statistics()
+        self.style_decision_cache.log_statistics()
+        return layer_styles
+
+    def is_canceled(self):
+        return self.task is not None and self.task.isCanceled()
+
+    def find_schema_stage(self, job):
+        """
+        Pipeline stage: find the schema identifier of the GML file.
+        """
+        root_filename = job['root_filename']
+        self.report_progress(job['step'], job['total_gml_files'],
+                             root_filename)
+
+        gml_file_path = job['layers'][0].file_path
+        gml_schema_locations, schema_identifier = (
+            self.get_gml_schema(gml_file_path))
+
+        # Get schema identifiers from Geonorge based on gml file schema locations
+        if gml_schema_locations is None:
+            job['messages'].append((
+                'log_message_warning',
+                "Ingen schema funnet i GML-filen '{}'".format(root_filename)))
+            log.debug("No schemalocations found in the GML file: '{}' "
+                      .format(gml_file_path))
+            return None
+
+        if not schema_identifier:
+            job['messages'].append((
+                'log_message_warning',
+                "Ingen samsvarende skjema funnet i Geonorge "
+                "skjemaregisteret for GML-filen '{}'.".format(root_filename)))
+            return None
+        job['schema_identifier'] = schema_identifier
+        return job
+
+    def fetch_theme_stage(self, job):
+        """
+        Pipeline stage: get the styles of the theme.
+        """
+        schema_identifier = job['schema_identifier']
+
+        # Get the styles for the selected layers
+        supported_symbology_for_theme = self.get_theme_styles(
+            schema_identifier)
+        if supported_symbology_for_theme is None:
+            log.debug("No styles found for theme '{}'."
+                      .format(schema_identifier))
+            job['messages'].append((
+                'message_bar_warning',
+                "Kunne ikke finne tegneregel i Geonorge for '{}'."
+                .format(schema_identifier)))
+            return None
+
+        # Check if there are any supported formats
+        if not supported_symbology_for_theme:
+            log.warning("No supported formats found for theme '{}'."
+                        .format(schema_identifier))
+            job['messages'].append((
+                'log_message_warning',
+                "Ingen støttede formater funnet for temaet '{}'"
+                .format(schema_identifier)))
+            return None
+        job['theme_styles'] = supported_symbology_for_theme
+        return job
+
+    def match_styles_stage(self, job):
+        """
+        Pipeline stage: map the layers to the styles of the theme.
+        """
+        supported_symbology_for_theme = job['theme_styles']
+        group_layers = job['layers']
+        # Map layers to appropriate styles
+        log.info("=== Fetch Styles for layers ===")
+
+        style_names = self.get_style_names(
+            group_layers, job['schema_identifier'],
+            supported_symbology_for_theme)
+        styled_layers_data = lu.merge_and_rename_styles_with_layers(
+            group_layers, style_names, supported_symbology_for_theme
+        )
+
+        # The report is saved in file order by process_gml_files()
+        job['report'] = styled_layers_data
+
+        layers_with_styles = lu.filter_layers_with_styles(
+            styled_layers_data)
+
+        if not layers_with_styles:
+            job['messages'].append((
+                'log_message_warning',
+                "Ingen tegneregler funnet for det valgte temaet."))
+            log.warning("No styles found for the selected theme.")
+            return None
+        # Count the number of layers with styles
+        total_layers_with_style = len(layers_with_styles)
+        total_selected_layers = sum(
+            layer.layer_name is not None for layer in group_layers)
+
+        log.info("Acquired {0} of {1} selected layers"
+                 .format(total_layers_with_style, total_selected_layers))
+        job['layers_with_styles'] = layers_with_styles
+        return job
+
+    def get_theme_lock(self, schema_identifier):
+        """Return the lock for the shared state of a theme."""
+        with self.theme_locks_lock:
+            return self.theme_locks.setdefault(schema_identifier, Lock())
+
+    def get_theme_styles(self, schema_identifier):
+        """
+        Get the styles of a theme in the supported formats. The theme is
+        fetched, filtered and classified by the geometry keywords of the
+        style names once per run and shared by all GML files with the
+        same schema identifier.
+
+        :param schema_identifier: Schema identifier of the theme.
+        :type schema_identifier: str
+        :return: The supported styles, None if the theme was not found.
+        :rtype: list of StyleRecord
+        """
+        with self.get_theme_lock(schema_identifier):
+            if schema_identifier not in self.theme_styles:
+                theme_styles = lsu.get_styles_for_theme(
+                    schema_identifier, self.is_canceled)
+                if theme_styles is not None:
+                    theme_styles = lsu.filter_styles_by_formats(theme_styles)
+                    if theme_styles:
+                        lsu.add_geometry_keywords(theme_styles)
+                        self.style_name_indexes[schema_identifier] = (
+                            StyleNameIndex(
+                                style.style_name for style in theme_styles))
+                        self.theme_fingerprints[schema_identifier] = (
+                            StyleDecisionCache.get_theme_fingerprint(
+                                schema_identifier, theme_styles))
+                self.theme_styles[schema_identifier] = theme_styles
+            return self.theme_styles[schema_identifier]
+
+    def get_style_names(self, layers, schema_identifier, styles):
+        """
+        Get the style name of every layer. The style is chosen once per
+        theme for each distinct (gml_node, geometry) pair, with the GML
+        node overrides of the theme applied, and the decision is shared
+        by all layers and files with that pair. The node names are
+        matched with the StyleNameIndex of the theme. The decisions of a
+        theme are read from the StyleDecisionCache the first time the
+        theme is used in a run, so later runs skip the matching until the
+        styles or overrides of the theme change.
+
+        :param layers: The layers of a GML file.
+        :type layers: list of LayerRecord
+        :param schema_identifier: Schema identifier of the theme.
+        :type schema_identifier: str
+        :param styles: The supported styles of the theme.
+        :type styles: list of StyleRecord
+        :return: Style name (or None) for every layer, in order.
+        :rtype: list
+        """
+        style_format = 'qml'
+        node_geometries = [(layer.gml_node, layer.geometry)
+                           for layer in layers]
+        with self.get_theme_lock(schema_identifier):
+            if schema_identifier not in self.style_decisions:
+                fingerprint = self.theme_fingerprints.get(schema_identifier)
+                self.style_decisions[schema_identifier] = (
+                    self.style_decision_cache.get(fingerprint, style_format)
+                    if fingerprint is not None else {})
+            style_decisions = self.style_decisions[schema_identifier]
+            new_node_geometries = [
+                node_geometry
+                for node_geometry in dict.fromkeys(node_geometries)
+                if node_geometry not in style_decisions]
+
+            if new_node_geometries:
+                mapped_style_names = lsu.apply_Gml_node_overrides(
+                    [gml_node for gml_node, _ in new_node_geometries],
+                    schema_identifier)
+                if mapped_style_names is None:
+                    mapped_style_names = [None] * len(new_node_geometries)
+                style_name_index = self.style_name_indexes.get(
+                    schema_identifier)
+                for node_geometry, mapped_style_name in zip(
+                        new_node_geometries, mapped_style_names):
+                    style_name = lsu.get_style_name(
+                        *node_geometry, styles, style_format,
+                        style_name_index, mapped_style_name)
+                    style_decisions[node_geometry] = style_name
+                self.new_style_decisions[schema_identifier] = style_format
+        return [style_decisions[node_geometry]
+                for node_geometry in node_geometries]
+
+    def save_style_decisions(self):
+        """
+        Store the decisions of every theme that got new ones in this run
+        in the StyleDecisionCache, one entry per theme.
+        """
+        for schema_identifier, style_format in (
+                self.new_style_decisions.items()):
+            fingerprint = self.theme_fingerprints.get(schema_identifier)
+            if fingerprint is not None:
+                self.style_decision_cache.put(
+                    fingerprint, style_format,
+                    self.style_decisions[schema_identifier])
+        self.new_style_decisions.clear()
+
+    def download_styles_stage(self, job):
+        """
+        Pipeline stage: download the style files.
+        output:
+            list of LayerStyle: The layers with their style file strings,
+            or None
+        """
+        layers_with_styles = job['layers_with_styles']
+
+        # Get style file string
+        log.info("=== Get Style file string ===")
+        file_strings = lsu.add_file_strings(layers_with_styles,
+                                            self.is_canceled)
+        for layer_style, file_string in zip(layers_with_styles,
+                                            file_strings):
+            layer_style.style_file_string = file_string
+
+        # Filter out layers without style file string
+        layers_with_styles = [
+            layer_style for layer_style in layers_with_styles
+            if layer_style.style_file_string is not None]
+
+        if not layers_with_styles:
+            job['messages'].append((
+                'log_message_warning',
+                "Ingen tegneregler-fil ble funnet for det valgte temaet."))
+            log.debug("No style file was fetched for the selected theme.")
+            return None
+        return layers_with_styles
+
+    def warm_up(self, gml_file_paths):
+        """
+        Prepare the caches used by process_gml_files() for gml_file_paths:
+        fetch the schema register, resolve the schema identifier of every
+        file and fetch the theme listings of those identifiers. Nothing is
+        reported to the user.
+
+        :param gml_file_paths: Paths to the GML files.
+        :type gml_file_paths: list
+        :return: The schema identifiers found.
+        :rtype: set
+        """
+        self.schema_utils.fetch_geonorge_schemas()
+        if self.schema_utils.geonorge_schemas is None:
+            log.warning("Warm-up stopped, no schemas from Geonorge")
+            return set()
+
+        self.prefetch_gml_schemas(gml_file_paths)
+        schema_identifiers = set()
+        for gml_file_path in gml_file_paths:
+            if self.task is not None and self.task.isCanceled():
+                return schema_identifiers
+            _, schema_identifier = self.get_gml_schema(gml_file_path)
+            if schema_identifier:
+                schema_identifiers.add(schema_identifier)
+
+        geonorge_api = GeonorgeAPI()
+        for schema_identifier in schema_identifiers:
+            if self.task is not None and self.task.isCanceled():
+                break
+            geonorge_api.get_styles_for_theme(schema_identifier,
+                                              self.is_canceled)
+
+        log.info("Warm-up finished for {0} GML files and {1} themes"
+                 .format(len(gml_file_paths), len(schema_identifiers)))
+        return schema_identifiers
+
+    def report_progress(self, current_step, total_gml_files, root_filename):
+        """Log progress and pass it on to the background task, if any."""
+        log.info("Processing GML file '{}' ({}/{})"
+                 .format(root_filename, current_step, total_gml_files))
+        if self.task is not None:
+            self.task.setProgress(
+                100 * (current_step - 1) / total_gml_files)
+            self.task.gml_file_started.emit(
+                current_step, total_gml_files, root_filename)
+
+    def prefetch_gml_schemas(self, gml_file_paths):
+        """
+        Read the schema locations of many GML files in parallel.
+
+        Files found in the schema location cache are not read. The others
+        are read on a thread pool; the work is file I/O, decompression and
+        header parsing that does not touch any QGIS objects. The results
+        are kept for get_gml_schema() and returned in the order of
+        gml_file_paths. Files that could not be read are not kept, so
+        get_gml_schema() tries them again.
+
+        :param gml_file_paths: Paths to the GML files.
+        :type gml_file_paths: list
+        :return: Schema locations (or None) for every file.
+        :rtype: list
+        """
+        register_signature = self.schema_utils.register_signature
+        paths_to_read = []
+        for gml_file_path in gml_file_paths:
+            cached = self.schema_location_cache.get(gml_file_path,
+                                                    register_signature)
+            if cached is None:
+                paths_to_read.append(gml_file_path)
+            else:
+                self.gml_schemas[gml_file_path] = (True,) + cached
+
+        if paths_to_read:
+            max_workers = min(self.schema_location_workers,
+                              len(paths_to_read))
+            log.info("Reading schema locations from {0} GML files with {1} "
+                     "workers".format(len(paths_to_read), max_workers))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                schema_locations = executor.map(
+                    read_gml_schemalocations, paths_to_read)
+                for gml_file_path, gml_schema_locations in zip(
+                        paths_to_read, schema_locations):
+                    if gml_schema_locations is not READ_FAILED:
+                        self.gml_schemas[gml_file_path] = (
+                            False, gml_schema_locations, None)
+
+        return [self.gml_schemas.get(gml_file_path, (None, None))[1]
+                for gml_file_path in gml_file_paths]
+
+    def get_gml_schema(self, gml_file_path):
+        """
+        Get the schema locations and the Geonorge schema identifier for a
+        GML file, using the schema location cache when the file is
+        unchanged since it was last read. A file that cannot be read is
+        reported like a file without schema locations, but not cached.
+
+        :param gml_file_path: Path to the GML file.
+        :type gml_file_path: str
+        :return: (schema locations or None, schema identifier)
+        :rtype: tuple
+        """
+        register_signature = self.schema_utils.register_signature
+        if gml_file_path in self.gml_schemas:
+            from_cache, gml_schema_locations, schema_identifier = (
+                self.gml_schemas.pop(gml_file_path))
+        else:
+            cached = self.schema_location_cache.get(gml_file_path,
+                                                    register_signature)
+            from_cache = cached is not None
+            if from_cache:
+                gml_schema_locations, schema_identifier = cached
+            else:
+                gml_schema_locations = read_gml_schemalocations(
+                    gml_file_path)
+                if gml_schema_locations is READ_FAILED:
+                    return None, None
+                schema_identifier = None
+
+        if gml_schema_locations is None:
+            if not from_cache:
+                self.schema_location_cache.put(gml_file_path, None)
+            return None, None
+
+        if not schema_identifier:
+            schema_identifier = (
+                self.schema_utils.find_geonorge_schema_identifier(
+                    gml_schema_locations))
+            self.schema_location_cache.put(
+                gml_file_path, gml_schema_locations, schema_identifier,
+                self.schema_utils.register_signature)
 
-        return layer_styles_df
+        return gml_schema_locations, schema_identifier
 
     def get_gml_schemalocations(self, xml_path):
         """
-        Extracts namespaces and schema locations from an XML file and
-        returns them as a pandas DataFrame.
+        Extracts namespaces and schema locations from an XML file.
 
         :param xml_path: Path to the XML file.
         :type xml_path: str
-        :return: DataFrame containing namespaces and schema locations.
-        :rtype: pd.DataFrame
-        """
-        log.info("=== Extracting namespaces and schema locations ===")
-        log.info(f" GML file path: '{xml_path}'")
-        # Parse the XML file and get the root element
-        tree = parse(xml_path)
-        root = tree.getroot()
-
-        # Extract schemaLocation attribute from the root element
-        schema_location = next(
-            (value for key, value in root.attrib.items()
-                if key.endswith('schemaLocation')), None)
-
-        # If schemaLocation is found, split it into a list
-        if schema_location:
-            schema_location_list = schema_location.split()
-
-            # Convert the list into dictionary with alternating keys and values
-            schema_dict = dict(schema_location_list[i:i + 2] for i in range(
-                0,
-                len(schema_location_list),
-                2))
-
-            # Convert the schema dictionary to a DataFrame
-            schema_df = DataFrame(schema_dict.items(),
-                                  columns=["namespace",
-                                  "schemalocation"])
-
-            # Remove known namespaces from the DataFrame
-            namespace_whitelist = [
-                'www.opengis.net',
-                'www.w3.org',
-                'www.interactive-instruments.de']
-            pattern = '|'.join(namespace_whitelist)
-            filtered_namespace_info = schema_df[
-                ~schema_df["namespace"].str.contains(pattern)]
-            log.info('Schema locations extracted successfully. {}'.format(
-                filtered_namespace_info['schemalocation'].values))
-            return filtered_namespace_info
-
-        return None
+        :return: (namespace, schema location) tuples, or None.
+        :rtype: list
+        """
+        return get_gml_schemalocations(xml_path)
+
+
+def read_gml_schemalocations(gml_file_path):
+    """
+    Worker for GMLProcessor.prefetch_gml_schemas(). Errors are logged
+    instead of raised, so one unreadable file does not stop the others.
+    output:
+        The schema locations (or None if the file has none), READ_FAILED
+        if the file could not be read
+    """
+    try:
+        return get_gml_schemalocations(gml_file_path)
+    except Exception as e:
+        log.error("Could not read schema locations from '{0}': {1}"
+                  .format(gml_file_path, e))
+        return READ_FAILED
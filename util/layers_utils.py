@@ -1,5 +1,5 @@
 from .report_saver import ReportSaver
-from pandas import merge
+from .records import LayerStyle
 from .logging_setup import logger as log
 from tempfile import mkstemp
 from os import fdopen, remove
@@ -8,116 +8,191 @@ from os import fdopen, remove
 class LayersUtils:
 
     @staticmethod
-    def group_layers_by_column_name(gml_layer_dataFrame,
-                                    column_name='Root_Filename'):
+    def none_last(value):
+        """Sort key that puts None after all other values."""
+        return (value is None, '' if value is None else value)
+
+    @staticmethod
+    def group_layers_by_root_filename(layers):
         """
         Group the GML layers by their base file names.
         input:
-            gml_layer_dataFrame: DataFrame containing GML layer details.
-            column_name: str, default='Root_Filename'
+            layers: list of LayerRecord (or LayerStyle)
         output:
-            DataFrameGroupBy
+            list: (root filename, list of layers) sorted by the root
+            filename; layers without a root filename are left out
         """
-        if gml_layer_dataFrame is None:
+        if layers is None:
             return None
 
         # Group the layers by the base file name
-        grouped_layers = gml_layer_dataFrame.groupby(column_name)
+        grouped_layers = {}
+        for layer in layers:
+            if layer.root_filename is not None:
+                grouped_layers.setdefault(layer.root_filename, []).append(
+                    layer)
 
-        return grouped_layers
+        return sorted(grouped_layers.items())
 
     @staticmethod
-    def merge_and_rename_styles_with_layers(theme_layers_dataframe,
-                                            supported_symbology_for_theme):
+    def select_layers(layers, layer_keys):
         """
-        Merge and rename the styles with the layers.
+        Select the layers with the given layer name and geometry.
         input:
-            theme_layers_dataframe: DataFrame containing theme layers.
-            supported_symboly_for_theme: DataFrame containing supported styles.
+            layers: list of LayerRecord
+            layer_keys: list of (layer name, geometry) tuples, other tuples
+            are ignored.
         output:
-            DataFrame
+            list of LayerRecord
         """
-        # Merge layer_styles with group on LayerName
-        merged_group_layer_styles = merge(theme_layers_dataframe,
-                                          supported_symbology_for_theme,
-                                          how='outer', right_on='StyleName',
-                                          left_on='style_name')
+        layer_keys = {key for key in layer_keys if len(key) == 2}
+        return [layer for layer in layers
+                if (layer.layer_name, layer.geometry) in layer_keys]
 
-        # Filter relevant columns
-        relevant_columns = ['Gml_Node', 'Geometry', 'Layer_Name',
-                            'StyleName', 'Format', 'DatasetName',
-                            'Status', 'FileUrl']
-        filtered_dataset = merged_group_layer_styles[relevant_columns]
+    @staticmethod
+    def create_layer_style(layer=None, style=None):
+        """
+        Create the LayerStyle of a layer and its style, either may be None.
+        input:
+            layer: LayerRecord
+            style: StyleRecord
+        output:
+            LayerStyle
+        """
+        layer_style = LayerStyle()
+        if layer is not None:
+            layer_style.gml_node = layer.gml_node
+            layer_style.geometry = layer.geometry
+            layer_style.layer_name = layer.layer_name
+        if style is not None:
+            layer_style.style_name = style.style_name
+            layer_style.format = style.format
+            layer_style.dataset_name = style.dataset_name
+            layer_style.status = style.status
+            layer_style.file_url = style.file_url
+        return layer_style
 
-        # Rename columns
-        new_column_names = ['GmlNode', 'Geometry', 'LayerName',
-                            'StyleName', 'Format', 'DatasetName',
-                            'Status', 'FileUrl']
+    @staticmethod
+    def merge_and_rename_styles_with_layers(layers, style_names, styles):
+        """
+        Merge the styles with the layers they were chosen for.
 
-        filtered_dataset.columns = new_column_names
+        Every layer is paired with every style of its style name, and
+        the styles no layer was matched to and the layers without a style
+        are kept on their own. The rows are ordered by style name, with
+        the layers without a style last.
+        input:
+            layers: list of LayerRecord
+            style_names: Style name (or None) for every layer.
+            styles: list of StyleRecord, the supported styles.
+        output:
+            list of LayerStyle
+        """
+        layers_by_style_name = {}
+        for layer, style_name in zip(layers, style_names):
+            layers_by_style_name.setdefault(style_name, []).append(layer)
+        styles_by_style_name = {}
+        for style in styles:
+            styles_by_style_name.setdefault(style.style_name, []).append(
+                style)
 
-        return filtered_dataset
+        layer_styles = []
+        for style_name in sorted(
+                layers_by_style_name.keys() | styles_by_style_name.keys(),
+                key=LayersUtils.none_last):
+            style_layers = layers_by_style_name.get(style_name, [None])
+            layer_styles.extend(
+                LayersUtils.create_layer_style(layer, style)
+                for layer in style_layers
+                for style in styles_by_style_name.get(style_name, [None]))
+        return layer_styles
 
     @staticmethod
-    def merge_layers_with_styles_and_gml_layers(gml_layers_dataframe_grouped,
-                                                layers_with_styles_dataframe):
+    def merge_layers_with_styles_and_gml_layers(gml_layers,
+                                                layers_with_styles):
         """
-        Merge layers with styles and GML layers.
+        Merge layers with styles and GML layers on the layer name and
+        geometry. The GML layers without a style are kept without one.
         input:
-            gml_layers_dataframe_grouped: DataFrameGroupBy containing
-            GML layers.
-            layers_with_styles_dataframe: DataFrame containing layers
-            with styles.
+            gml_layers: list of LayerRecord
+            layers_with_styles: list of LayerStyle
         output:
-            DataFrame
+            list of LayerStyle, with the layer name and root filename of
+            the GML layer
         """
-        # Merge layers with styles and GML layers
-        merged_layers_with_styles = merge(
-            layers_with_styles_dataframe, gml_layers_dataframe_grouped,
-            how='outer', left_on=['LayerName', 'Geometry'],
-            right_on=['Layer_Name', 'Geometry'])
-
-        relevant_columns = ['Geometry', 'Format', 'Style_file_string',
-                            'Layer_Name', 'StyleName', 'Root_Filename',
-                            'GmlNode']
-        filtered_dataset = merged_layers_with_styles[relevant_columns].copy()
-        filtered_dataset.rename(columns={'Layer_Name': 'LayerName'},
-                                inplace=True)
-        return filtered_dataset
+        def get_key(layer):
+            return (LayersUtils.none_last(layer.layer_name),
+                    LayersUtils.none_last(layer.geometry))
+
+        styles_by_key = {}
+        for layer_style in layers_with_styles:
+            styles_by_key.setdefault(get_key(layer_style), []).append(
+                layer_style)
+        gml_layers_by_key = {}
+        for gml_layer in gml_layers:
+            gml_layers_by_key.setdefault(get_key(gml_layer), []).append(
+                gml_layer)
+
+        merged_layers_with_styles = []
+        for key in sorted(styles_by_key.keys() | gml_layers_by_key.keys()):
+            for layer_style in styles_by_key.get(key, [None]):
+                for gml_layer in gml_layers_by_key.get(key, [None]):
+                    if layer_style is None:
+                        merged_layers_with_styles.append(LayerStyle(
+                            geometry=gml_layer.geometry,
+                            layer_name=gml_layer.layer_name,
+                            root_filename=gml_layer.root_filename))
+                    elif gml_layer is None:
+                        merged_layers_with_styles.append(layer_style.copy(
+                            layer_name=None, root_filename=None))
+                    else:
+                        merged_layers_with_styles.append(layer_style.copy(
+                            layer_name=gml_layer.layer_name,
+                            root_filename=gml_layer.root_filename))
+        return merged_layers_with_styles
 
     @staticmethod
-    def filter_layers_with_styles(theme_layers_dataframe):
+    def filter_layers_with_styles(layer_styles):
         """
         Filter layers with styles.
         input:
-            theme_layers_dataframe: DataFrame containing theme layers.
+            layer_styles: list of LayerStyle
         output:
-            DataFrame
+            list of LayerStyle
         """
         # Filter layers without styles
-        layers_with_styles = theme_layers_dataframe.loc[
-            (theme_layers_dataframe['GmlNode'].notnull()) &
-            (theme_layers_dataframe['StyleName'].notnull())]
-        return layers_with_styles
+        return [layer_style for layer_style in layer_styles
+                if layer_style.gml_node is not None and
+                layer_style.style_name is not None]
 
     @staticmethod
     def save_layer_style_report(layers_with_styles):
         """
         Save a sorted report for layers with their associated styles.
 
-        This function sorts the given DataFrame of layers and their styles
-        by GML
+        This function sorts the given layers and their styles by GML
         node, geometry type, and style name, then saves the sorted data as a
         CSV report.
 
         Args:
-            layers_with_styles (DataFrame): A DataFrame containing layers with
-            styles and all styles for the theme.
+            layers_with_styles (list of LayerStyle): Layers with styles and
+            all styles for the theme.
         """
+        report_saver = ReportSaver()
+        if report_saver.base_path is None:
+            return
+
+        # pandas is only needed for writing the reports
+        from pandas import DataFrame
+
+        report = DataFrame(
+            [[getattr(layer_style, name)
+              for name in LayerStyle.REPORT_COLUMNS]
+             for layer_style in layers_with_styles],
+            columns=list(LayerStyle.REPORT_COLUMNS.values()))
         # Sort layers and styles before saving the report
-        sorted_layers = layers_with_styles.sort_values(
+        sorted_layers = report.sort_values(
                 ['GmlNode', 'Geometry', 'StyleName'], inplace=False)
-        report_saver = ReportSaver()
         report_saver.save_report_as_csv(sorted_layers)
 
 
@@ -126,21 +201,22 @@ class LayerStylesUpdater:
         self.layer_extractor = layer_extractor
         self.ui_helpers = ui_helpers
 
-    def update_styles(self, layer_styles_df):
+    def update_styles(self, layer_styles):
 
         try:
-            layers_count = len(layer_styles_df)
+            layers_count = len(layer_styles)
             progress_message_bar, progress_bar = (
                 self.ui_helpers.show_progress_bar(
                     layers_count, "Updating styles for '{}' layers"
                     .format(layers_count))
             )
             current_step = 0
+            layers_by_names = self.layer_extractor.get_layers_by_names()
 
-            # Iterate through each row in the layer_styles_df
-            for _, style_rule in layer_styles_df.iterrows():
+            # Iterate through each of the layer_styles
+            for style_rule in layer_styles:
                 # Get the layer name
-                layer_name = style_rule['LayerName']
+                layer_name = style_rule.layer_name
 
                 # Update the progress bar and message
                 progress_bar.setValue(current_step)
@@ -150,11 +226,10 @@ class LayerStylesUpdater:
                         .format(layer_name, current_step, layers_count))
                 log.info("Updating styles for layer '{0}' - Geometry: {1} "
                          " - ({2}/{3})"
-                         .format(layer_name, style_rule['GmlNode'],
+                         .format(layer_name, style_rule.gml_node,
                                  current_step, layers_count))
 
-                layers = self.layer_extractor.get_layers_by_name(
-                    layer_name)
+                layers = layers_by_names.get(layer_name, [])
 
                 if layers.__len__() > 0:
                     for layer in layers:
@@ -182,20 +257,20 @@ class LayerStylesUpdater:
 
         layer_geometry_type = layer.geometryType().name
 
-        if (layer_geometry_type and (style_rule['Geometry'].lower()
+        if (layer_geometry_type and (style_rule.geometry.lower()
                                      != layer_geometry_type.lower())):
             return style_updated
 
-        file_string = style_rule['Style_file_string']
-        fd, path = mkstemp(suffix=style_rule['Format'])
-        layer_name = style_rule['LayerName']
-        style_name = style_rule['StyleName']
+        file_string = style_rule.style_file_string
+        fd, path = mkstemp(suffix=style_rule.format)
+        layer_name = style_rule.layer_name
+        style_name = style_rule.style_name
         try:
             with fdopen(fd, 'w') as tmp:
                 tmp.write(file_string)
-            if style_rule['Format'] == 'sld':
+            if style_rule.format == 'sld':
                 updated = layer.loadSldStyle(path)
-            elif style_rule['Format'] == 'qml':
+            elif style_rule.format == 'qml':
                 updated = layer.loadNamedStyle(path)
 
             layer.triggerRepaint()
@@ -1,8 +1,28 @@
 import logging
+from collections import deque
 from .config_loader import ConfigLoader
 from os.path import dirname, exists, join
 from os import makedirs
 
+# Name of the handler that keeps what is logged before init_logging()
+STARTUP_HANDLER_NAME = 'tegneregelassistent.startup'
+
+
+class StartupLogBuffer(logging.Handler):
+    """
+    Keeps the last records logged before logging is set up, so they end
+    up in the log instead of on stderr (logging.lastResort) and are
+    written to the log file once init_logging() has run.
+    """
+
+    def __init__(self, capacity=1000):
+        super().__init__()
+        self.set_name(STARTUP_HANDLER_NAME)
+        self.records = deque(maxlen=capacity)
+
+    def emit(self, record):
+        self.records.append(record)
+
 
 def setup_logging():
     """Set up logging based on configuration."""
@@ -18,6 +38,12 @@ def setup_logging():
     # Set to DEBUG to allow all levels, will filter later
     logger.setLevel(logging.DEBUG)
 
+    # Records logged before logging was set up, see StartupLogBuffer
+    startup_records = [
+        record for handler in logger.handlers
+        if handler.get_name() == STARTUP_HANDLER_NAME
+        for record in handler.records]
+
     # Remove existing handlers
     if logger.hasHandlers():
         for handler in logger.handlers:
@@ -47,6 +73,8 @@ def setup_logging():
         file_handler.setLevel(log_level)
         file_handler.setFormatter(logging.Formatter(log_format))
         logger.addHandler(file_handler)
+        for record in startup_records:
+            logger.handle(record)
 
         logger.info("Logging is enabled.")
         print('Logging is enabled, logfile path: {}'
@@ -62,5 +90,19 @@ def setup_logging():
     return logger
 
 
-# Create a logger instance
-logger = setup_logging()
+# The logger the plugin logs to. It is set up by init_logging() when the
+# plugin is first used, not when QGIS loads the plugin at startup; until
+# then a StartupLogBuffer keeps what is logged (also across plugin reloads)
+logger = logging.getLogger()
+if not any(handler.get_name() == STARTUP_HANDLER_NAME
+           for handler in logger.handlers):
+    logger.addHandler(StartupLogBuffer())
+logging_is_set_up = False
+
+
+def init_logging():
+    """Set up logging, once."""
+    global logging_is_set_up
+    if not logging_is_set_up:
+        setup_logging()
+        logging_is_set_up = True
@@ -0,0 +1,235 @@
+from datetime import datetime
+from json import dumps, loads
+from os import remove
+from os.path import exists, getmtime, join
+from shutil import copyfile
+from zipfile import ZipFile, ZIP_DEFLATED, BadZipFile
+from .api_call_manager import ApiCallManager as acm
+from .cache_store import get_cache_directory
+from .logging_setup import logger as log
+
+BUNDLE_VERSION = 1
+INDEX_ENTRY = 'index.json'
+
+
+class OfflineBundle:
+    """
+    Offline bundle with everything needed to find and apply styles
+    without network access: the schema register, the cartography theme
+    responses and the referenced QML/SLD files.
+
+    A bundle is a zip archive with an 'index.json' entry that maps the
+    schema register URL, the theme request keys and the style file URLs
+    to entries in the archive. Only the index is read when a bundle is
+    opened; the other entries are read when they are needed.
+    """
+
+    # The installed bundle, reloaded when the file changes
+    installed = None
+
+    # Progress of build() in percent when the schema register, the theme
+    # responses and the style files have been fetched
+    REGISTER_PROGRESS = 5
+    THEMES_PROGRESS = 30
+    STYLES_PROGRESS = 95
+
+    def __init__(self, bundle_path):
+        self.bundle_path = bundle_path
+        with ZipFile(bundle_path) as archive:
+            self.index = loads(archive.read(INDEX_ENTRY))
+        if self.index.get('version') != BUNDLE_VERSION:
+            raise ValueError("Unsupported offline bundle version: {}"
+                             .format(self.index.get('version')))
+
+    @staticmethod
+    def get_installed_path():
+        return join(get_cache_directory(), 'offline_bundle.zip')
+
+    @staticmethod
+    def get_installed():
+        """
+        Return the installed bundle, or None if no bundle is installed.
+        """
+        bundle_path = OfflineBundle.get_installed_path()
+        if not exists(bundle_path):
+            OfflineBundle.installed = None
+            return None
+
+        modified = getmtime(bundle_path)
+        installed = OfflineBundle.installed
+        if installed is None or installed[0] != modified:
+            try:
+                OfflineBundle.installed = (modified,
+                                           OfflineBundle(bundle_path))
+            except (OSError, ValueError, KeyError, BadZipFile) as e:
+                log.error("Cannot read the offline bundle: {}".format(e))
+                OfflineBundle.installed = None
+                return None
+            log.info("Offline bundle loaded, created {}".format(
+                OfflineBundle.installed[1].index.get('created')))
+        return OfflineBundle.installed[1]
+
+    @staticmethod
+    def install(bundle_path):
+        """
+        Validate a bundle and install it in the cache directory.
+        input:
+            bundle_path: str
+        output:
+            OfflineBundle
+        """
+        bundle = OfflineBundle(bundle_path)
+        installed_path = OfflineBundle.get_installed_path()
+        copyfile(bundle_path, installed_path)
+        log.info("Offline bundle '{}' installed".format(bundle_path))
+        return bundle
+
+    @staticmethod
+    def uninstall():
+        bundle_path = OfflineBundle.get_installed_path()
+        if exists(bundle_path):
+            remove(bundle_path)
+            log.info("Offline bundle removed")
+        OfflineBundle.installed = None
+
+    def read_entry(self, entry_name):
+        with ZipFile(self.bundle_path) as archive:
+            return archive.read(entry_name)
+
+    def get_schemas(self, schema_url):
+        register = self.index.get('schema_register', {})
+        if register.get('url') != schema_url:
+            return None
+        return loads(self.read_entry(register['entry']))
+
+    def get_theme_response(self, cache_key):
+        entry_name = self.index.get('themes', {}).get(cache_key)
+        if entry_name is None:
+            return None
+        return loads(self.read_entry(entry_name))
+
+    def get_style_files(self, style_urls):
+        """
+        Read the style files found in the bundle.
+        input:
+            style_urls: list of str
+        output:
+            dict: {style_url: bytes} for the URLs found in the bundle
+        """
+        styles = self.index.get('styles', {})
+        entry_names = {style_url: styles[style_url]
+                       for style_url in style_urls if style_url in styles}
+        if not entry_names:
+            return {}
+        with ZipFile(self.bundle_path) as archive:
+            return {style_url: archive.read(entry_name)
+                    for style_url, entry_name in entry_names.items()}
+
+    @staticmethod
+    def build(bundle_path, schema_identifiers, task=None):
+        """
+        Download the schema register, the theme responses for
+        schema_identifiers and all their QML/SLD files, and write them to
+        a bundle. Theme responses and style files are downloaded
+        concurrently.
+        input:
+            bundle_path: str
+            schema_identifiers: list of str, the themes to include
+            task: OfflineBundleTask when running in the background, used
+            to report progress and to check for cancellation
+        output:
+            dict: Number of themes and style files in the bundle, or None
+            if the schema register could not be fetched or the task was
+            canceled.
+        """
+        # Imported here, both modules use the installed bundle
+        from .geonorge_apis import GeonorgeAPI
+        from .style_utils import LayerStylesUpdater as lsu
+
+        is_canceled = task.isCanceled if task is not None else None
+
+        def report_progress(progress):
+            if task is not None:
+                task.setProgress(progress)
+            return task is not None and task.isCanceled()
+
+        geonorge_api = GeonorgeAPI()
+        schema_url = geonorge_api.config['endpoint_url']['schema']
+        json_schemas = geonorge_api.get_schemas()
+        if json_schemas is None:
+            log.error("Cannot build offline bundle without the schemas")
+            return None
+        if report_progress(OfflineBundle.REGISTER_PROGRESS):
+            return None
+
+        index = {
+            'version': BUNDLE_VERSION,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'schema_register': {'url': schema_url,
+                                'entry': 'schema_register.json'},
+            'themes': {},
+            'styles': {},
+        }
+        entries = {'schema_register.json': dumps(json_schemas)}
+
+        # Theme responses
+        theme_requests = [geonorge_api.get_theme_request(schema_identifier)
+                          for schema_identifier in schema_identifiers]
+        theme_urls = [
+            acm.create_request(endpoint_url, request_params)
+            .url().toString()
+            for endpoint_url, request_params in theme_requests]
+        log.info("=== Building offline bundle: {} themes ==="
+                 .format(len(theme_urls)))
+        responses = acm().get_many(theme_urls, is_canceled=is_canceled)
+        if report_progress(OfflineBundle.THEMES_PROGRESS):
+            return None
+
+        style_formats = {}
+        for (endpoint_url, request_params), response in zip(
+                theme_requests, responses):
+            if not (response.ok and response.data):
+                log.warning("Theme '{}' is not included in the bundle"
+                            .format(request_params['text']))
+                continue
+            json_data = loads(str(response.data, 'utf-8'))
+            entry_name = 'themes/{:04d}.json'.format(len(index['themes']))
+            cache_key = geonorge_api.get_request_cache_key(
+                endpoint_url, request_params)
+            index['themes'][cache_key] = entry_name
+            entries[entry_name] = dumps(json_data)
+            for style in json_data.get('Files') or []:
+                if (style.get('Format') in ['sld', 'qml'] and
+                        style.get('FileUrl')):
+                    style_formats[lsu.get_style_file_url(style)] = (
+                        style['Format'])
+
+        # Style files referenced by the themes
+        style_urls = list(style_formats)
+        log.info("=== Building offline bundle: {} style files ==="
+                 .format(len(style_urls)))
+        responses = acm().get_many(style_urls, is_canceled=is_canceled)
+        if report_progress(OfflineBundle.STYLES_PROGRESS):
+            return None
+        for style_url, response in zip(style_urls, responses):
+            if not (response.ok and response.data):
+                log.warning("Style file '{}' is not included in the bundle"
+                            .format(style_url))
+                continue
+            entry_name = 'styles/{0:05d}.{1}'.format(
+                len(index['styles']), style_formats[style_url])
+            index['styles'][style_url] = entry_name
+            entries[entry_name] = bytes(response.data)
+
+        with ZipFile(bundle_path, 'w', ZIP_DEFLATED) as archive:
+            archive.writestr(INDEX_ENTRY, dumps(index, ensure_ascii=False))
+            for entry_name, content in entries.items():
+                archive.writestr(entry_name, content)
+
+        summary = {'themes': len(index['themes']),
+                   'styles': len(index['styles'])}
+        log.info("Offline bundle written to '{0}': {1} themes, {2} style "
+                 "files".format(bundle_path, summary['themes'],
+                                summary['styles']))
+        report_progress(100)
+        return summary
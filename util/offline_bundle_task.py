@@ -0,0 +1,33 @@
+from qgis.core import QgsTask
+from .logging_setup import logger as log
+from .offline_bundle import OfflineBundle
+from .schema_utils import SchemaUtils
+
+
+class OfflineBundleTask(QgsTask):
+    """
+    Background task that builds an offline bundle with the schema
+    register, the styles of all themes in the register and their style
+    files. Progress is reported with setProgress() and the downloads stop
+    when the task is canceled. The result is read from 'summary' when the
+    task has completed; it is None if the register could not be fetched.
+    """
+
+    def __init__(self, bundle_path):
+        super(OfflineBundleTask, self).__init__(
+            "Geonorge tegneregelassistent: lager offline-pakke",
+            QgsTask.CanCancel)
+        self.bundle_path = bundle_path
+        self.summary = None
+
+    def run(self):
+        try:
+            schema_identifiers = SchemaUtils().get_all_schema_identifiers()
+            if self.isCanceled():
+                return False
+            self.summary = OfflineBundle.build(
+                self.bundle_path, schema_identifiers, task=self)
+        except Exception as e:
+            log.error("Building the offline bundle failed: {}".format(e))
+            return False
+        return not self.isCanceled()
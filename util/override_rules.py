@@ -0,0 +1,165 @@
+from collections import deque
+from threading import Lock
+from .config_loader import ConfigLoader
+from .logging_setup import logger as log
+
+
+class SubstringMatcher:
+    """
+    Aho-Corasick automaton that finds which of many patterns occur in a
+    text in one pass over the text, however many patterns there are.
+    """
+
+    def __init__(self, patterns):
+        """
+        input:
+            patterns: dict {pattern: value}, the value is returned when the
+            pattern occurs in a text
+        """
+        self.goto = [{}]
+        self.fail = [0]
+        # Values of the patterns ending at each state, including the ones
+        # reached through fail links
+        self.outputs = [[]]
+
+        for pattern, value in patterns.items():
+            state = 0
+            for character in pattern:
+                next_state = self.goto[state].get(character)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][character] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                state = next_state
+            self.outputs[state].append(value)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for character, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail_state = self.fail[state]
+                while fail_state and character not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                self.fail[next_state] = self.goto[fail_state].get(
+                    character, 0)
+                self.outputs[next_state] = (
+                    self.outputs[next_state] +
+                    self.outputs[self.fail[next_state]])
+
+    def find_all(self, text):
+        """Return the values of all patterns that occur in text."""
+        values = list(self.outputs[0])
+        state = 0
+        for character in text:
+            while state and character not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(character, 0)
+            values.extend(self.outputs[state])
+        return values
+
+
+class OverrideRules:
+    """
+    Compiled override table from resource_config.json, e.g.
+    'schemaOverrides' or one theme of 'schemaNodeOverrides'.
+
+    A rule matches a value that equals its source ('exactMatch') or
+    contains it. Like a scan of the rules in config order, lookup()
+    returns the target of the first matching rule, but exact rules are
+    found with a dict and substring rules with one pass of a
+    SubstringMatcher, so the cost does not grow with the number of rules.
+    """
+
+    def __init__(self, rules, source_key, target_key):
+        """
+        input:
+            rules: list of dict with source_key, target_key and
+            'exactMatch'
+            source_key: str, e.g. 'sourceNode'
+            target_key: str, e.g. 'styleName'
+        """
+        self.targets = []
+        self.exact_rules = {}
+        substring_rules = {}
+        for rule_index, rule in enumerate(rules):
+            self.targets.append(rule[target_key])
+            source = rule[source_key]
+            if rule['exactMatch']:
+                self.exact_rules.setdefault(source, rule_index)
+            else:
+                substring_rules.setdefault(source, rule_index)
+        self.substring_matcher = (SubstringMatcher(substring_rules)
+                                  if substring_rules else None)
+
+    def __len__(self):
+        return len(self.targets)
+
+    def lookup(self, value):
+        """
+        Return the target of the first rule matching value, or None.
+        """
+        rule_indexes = []
+        exact_rule = self.exact_rules.get(value)
+        if exact_rule is not None:
+            rule_indexes.append(exact_rule)
+        if self.substring_matcher is not None and isinstance(value, str):
+            rule_indexes.extend(self.substring_matcher.find_all(value))
+        if not rule_indexes:
+            return None
+        return self.targets[min(rule_indexes)]
+
+    def apply(self, values):
+        """
+        Look up every value of a list, once per distinct value.
+        input:
+            values: list
+        output:
+            list with the target (or None) for every value
+        """
+        targets = {value: self.lookup(value) for value in set(values)}
+        return [targets[value] for value in values]
+
+
+class Overrides:
+    """
+    The compiled schema and GML node overrides, compiled again only when
+    resource_config.json has changed.
+    """
+
+    compiled = None
+    lock = Lock()
+
+    def __init__(self, resources):
+        # A schema override without a target label is never applied
+        self.schema_rules = OverrideRules(
+            [rule for rule in resources.get('schemaOverrides', [])
+             if rule['targetLabel']],
+            'sourceLabel', 'targetLabel')
+        self.node_rules = {
+            theme: OverrideRules(rules, 'sourceNode', 'styleName')
+            for theme, rules in resources.get(
+                'schemaNodeOverrides', {}).items()}
+
+    @staticmethod
+    def get():
+        # ConfigLoader returns the same object until the file changes
+        resources = ConfigLoader().load_resources_config()
+        with Overrides.lock:
+            compiled = Overrides.compiled
+            if compiled is None or compiled[0] is not resources:
+                compiled = (resources, Overrides(resources))
+                Overrides.compiled = compiled
+                log.debug("Overrides compiled from resource_config.json")
+            return compiled[1]
+
+    @staticmethod
+    def get_schema_rules():
+        return Overrides.get().schema_rules
+
+    @staticmethod
+    def get_node_rules(theme):
+        """Return the node overrides of a theme, or None if it has none."""
+        return Overrides.get().node_rules.get(theme)
@@ -0,0 +1,116 @@
+class Record:
+    """
+    Base class of the records passed between the steps of a style search.
+
+    A record has a fixed set of attributes (__slots__), so it is small and
+    cheap to create; attributes that are not given are None.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.pop(name, None))
+        if values:
+            raise TypeError("{0} has no attributes {1}".format(
+                type(self).__name__, ', '.join(values)))
+
+    def __repr__(self):
+        return '{0}({1})'.format(type(self).__name__, ', '.join(
+            '{0}={1!r}'.format(name, getattr(self, name))
+            for name in self.__slots__))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name)
+            for name in self.__slots__)
+
+    def copy(self, **values):
+        """Return a copy of the record with some attributes changed."""
+        record = type(self).__new__(type(self))
+        for name in self.__slots__:
+            setattr(record, name, values.pop(name, getattr(self, name)))
+        if values:
+            raise TypeError("{0} has no attributes {1}".format(
+                type(self).__name__, ', '.join(values)))
+        return record
+
+
+class LayerRecord(Record):
+    """A GML layer in the QGIS project."""
+
+    __slots__ = (
+        'gml_node',       # GML node name
+        'geometry',       # Geometry type of the layer
+        'file_type',      # File extension type
+        'layer_name',     # Original layer name
+        'file_path',      # File path to the layer
+        'root_filename',  # Base file name of the GML file
+    )
+
+
+class SchemaRecord(Record):
+    """A schema in the Geonorge schema register or the whitelist."""
+
+    __slots__ = ('id', 'document_reference', 'status', 'label', 'seo_name',
+                 'dataset_uuid')
+
+    @staticmethod
+    def from_register(item):
+        """Create the record of an item of the register JSON."""
+        return SchemaRecord(
+            id=item.get('id'),
+            document_reference=item.get('documentreference'),
+            status=item.get('status'),
+            label=item.get('label'),
+            seo_name=item.get('seoname'),
+            dataset_uuid=item.get('DatasetUuid'))
+
+
+class StyleRecord(Record):
+    """A style of a theme in Geonorge."""
+
+    __slots__ = (
+        'uuid', 'style_name', 'owner_dataset', 'format', 'dataset_name',
+        'status', 'theme', 'file_url', 'details_url',
+        # Geometry keywords in the style name, see
+        # LayerStylesUpdater.get_geometry_keywords
+        'geometry_keywords',
+    )
+
+    @staticmethod
+    def from_cartography(item):
+        """Create the record of a file of the cartography API JSON."""
+        return StyleRecord(
+            uuid=item.get('Uuid'),
+            style_name=item.get('Name'),
+            owner_dataset=item.get('OwnerDataset'),
+            format=item.get('Format'),
+            dataset_name=item.get('DatasetName'),
+            status=item.get('Status'),
+            theme=item.get('Theme'),
+            file_url=item.get('FileUrl'),
+            details_url=item.get('DetailsUrl'))
+
+
+class LayerStyle(Record):
+    """
+    A layer with the style found for it, or a style of the theme without
+    a layer, as shown in the reports and the dialog.
+    """
+
+    __slots__ = ('gml_node', 'geometry', 'layer_name', 'style_name',
+                 'format', 'dataset_name', 'status', 'file_url',
+                 'style_file_string', 'root_filename')
+
+    # Column names in the CSV reports
+    REPORT_COLUMNS = {
+        'gml_node': 'GmlNode',
+        'geometry': 'Geometry',
+        'layer_name': 'LayerName',
+        'style_name': 'StyleName',
+        'format': 'Format',
+        'dataset_name': 'DatasetName',
+        'status': 'Status',
+        'file_url': 'FileUrl',
+    }
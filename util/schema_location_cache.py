@@ -0,0 +1,109 @@
+from json import dumps, loads
+from os.path import getmtime, join
+from .cache_store import CacheStore
+from .config_loader import ConfigLoader
+from .logging_setup import logger as log
+from .xml_utils import get_file_identity
+
+
+class SchemaLocationCache:
+    """
+    Persistent cache of the schema locations found in GML files.
+
+    Entries are keyed by the GML source path and validated against the
+    file identity (path, size, mtime and inode), so a file that has not
+    changed since the last run is never opened again. The resolved schema
+    identifier is stored next to the schema locations and reused as long
+    as resource_config.json and the schema register are unchanged.
+    """
+
+    def __init__(self):
+        config_loader = ConfigLoader()
+        config = config_loader.load_qgis_config()
+        cache_config = config.get('cache', {}).get('schema_locations', {})
+        self.store = CacheStore(
+            'schema_locations',
+            max_entries=cache_config.get('max_entries', 5000))
+        self.resources_path = join(config_loader.config_directory,
+                                   'resource_config.json')
+        self.hits = 0
+        self.misses = 0
+
+    def get_resources_signature(self):
+        try:
+            return getmtime(self.resources_path)
+        except OSError:
+            return None
+
+    def get(self, gml_file_path, register_signature=None):
+        """
+        Get the cached schema locations for a GML file.
+        input:
+            gml_file_path: str
+            register_signature: str, SchemaUtils.register_signature of
+            the schema register in use
+        output:
+            tuple: (schema_locations, schema_identifier) on a cache hit,
+            where schema_locations is a list of (namespace, schema
+            location) or None and
+            schema_identifier is None if it must be resolved again.
+            None on a cache miss.
+        """
+        key = gml_file_path
+        entry = self.store.get(key)
+        if entry is None:
+            self.misses += 1
+            log.info("Schema location cache miss: '{}'".format(key))
+            return None
+
+        cached = loads(entry['value'])
+        if cached['identity'] != get_file_identity(gml_file_path):
+            self.misses += 1
+            self.store.delete(key)
+            log.info("Schema location cache invalidated, file changed: "
+                     "'{}'".format(key))
+            return None
+
+        self.hits += 1
+        log.info("Schema location cache hit: '{}'".format(key))
+
+        schema_locations = None
+        if cached['schema_locations'] is not None:
+            schema_locations = [tuple(schema_location) for schema_location
+                                in cached['schema_locations']]
+
+        schema_identifier = None
+        if (register_signature is not None and
+                cached.get('register_signature') == register_signature and
+                cached['resources_signature'] ==
+                self.get_resources_signature()):
+            schema_identifier = cached['schema_identifier']
+        return schema_locations, schema_identifier
+
+    def put(self, gml_file_path, schema_locations, schema_identifier=None,
+            register_signature=None):
+        """
+        Store the schema locations and schema identifier for a GML file.
+        input:
+            gml_file_path: str
+            schema_locations: list of (namespace, schema location) or
+            None
+            schema_identifier: str or None
+            register_signature: str, SchemaUtils.register_signature of
+            the schema register the identifier was resolved with
+        """
+        identity = get_file_identity(gml_file_path)
+        if identity is None:
+            return
+
+        self.store.put(gml_file_path, dumps({
+            'identity': identity,
+            'schema_locations': schema_locations,
+            'schema_identifier': schema_identifier,
+            'resources_signature': self.get_resources_signature(),
+            'register_signature': register_signature,
+        }))
+
+    def log_statistics(self):
+        log.info("Schema location cache: {0} hits, {1} misses"
+                 .format(self.hits, self.misses))
@@ -1,7 +1,11 @@
-import pandas as pd
+from bisect import bisect_left
+from hashlib import sha1
+from json import dumps
 from .logging_setup import logger as log
 from .config_loader import ConfigLoader
 from .geonorge_apis import GeonorgeAPI
+from .override_rules import OverrideRules, Overrides
+from .records import SchemaRecord
 from uuid import UUID
 
 
@@ -10,13 +14,15 @@ class SchemaUtils:
         config_loader = ConfigLoader()
         self.config = config_loader.load_resources_config()
         self.geonorge_schemas = None
+        self.schema_register_index = None
+        self.register_signature = None
 
     def get_schema_whitelist(self):
         """
-        Returns a DataFrame of whitelisted schemas.
+        Returns the whitelisted schemas.
 
-        :return: DataFrame containing whitelisted schemas.
-        :rtype: pd.DataFrame
+        :return: SchemaRecord of every whitelisted schema.
+        :rtype: list
         """
         log.info("=== Using whitelist schemas ===")
         # Get the whitelisted schemas from the config
@@ -26,11 +32,12 @@ class SchemaUtils:
             log.debug("No schemas found in the config file.")
             return None
 
-        # Convert the list of schemas to a DataFrame
-        schema_df = pd.DataFrame(schemas)
-        log.info(f"Schema whitelist applied, {len(schema_df)} schemas added.")
+        schema_records = [SchemaRecord.from_register(schema)
+                          for schema in schemas]
+        log.info("Schema whitelist applied, {} schemas added."
+                 .format(len(schema_records)))
 
-        return schema_df
+        return schema_records
 
     def fetch_geonorge_schemas(self):
         """
@@ -38,8 +45,8 @@ class SchemaUtils:
 
         :param use_whitelist: Whether to use whitelist schemas.
         :type use_whitelist: bool
-        :return: DataFrame containing combined schemas.
-        :rtype: pd.DataFrame
+        :return: SchemaRecord of every schema.
+        :rtype: list
         """
         if self.geonorge_schemas is None:
             log.info("=== Fetching schemas from Geonorge ===")
@@ -53,33 +60,43 @@ class SchemaUtils:
 
             # Extract the list of schema items
             schema_items = json_schemas.get('containeditems', [])
-            schema_df = pd.DataFrame(schema_items)
-
-            # Filter the schema DataFrame to keep specific columns
-            columns_to_keep = ['id', 'documentreference', 'status', 'label',
-                               'seoname', 'DatasetUuid']
-            schema_df_filtered = schema_df[columns_to_keep].copy()
+            schema_records = [SchemaRecord.from_register(item)
+                              for item in schema_items]
 
             log.info("Have been acquired: '{}' gml schemas from geonorge"
-                     .format(len(schema_df_filtered)))
+                     .format(len(schema_records)))
 
             whitelist_schemas = self.get_schema_whitelist()
             if whitelist_schemas is not None:
-                if schema_df_filtered is None:
-                    schema_df_filtered = whitelist_schemas
-                else:
-                    schema_df_filtered = pd.concat(
-                        [schema_df_filtered, whitelist_schemas],
-                        ignore_index=True, sort=False)
-
-            if schema_df_filtered is None:
-                log.error("Failed to retrieve or generate any schemas.")
-                return None
+                schema_records.extend(whitelist_schemas)
 
-            self.geonorge_schemas = schema_df_filtered
+            self.geonorge_schemas = schema_records
+            self.schema_register_index = SchemaRegisterIndex(
+                schema_record.document_reference
+                for schema_record in schema_records)
+            self.register_signature = self.get_register_signature(
+                schema_records)
 
         return self.geonorge_schemas
 
+    @staticmethod
+    def get_register_signature(schema_records):
+        """
+        Get a signature of the fields of the schemas that the schema
+        identifiers are resolved from; it changes when a schema is added,
+        moved or renamed in the register.
+
+        :param schema_records: SchemaRecord of every schema.
+        :type schema_records: list
+        :return: The signature.
+        :rtype: str
+        """
+        signature = sha1(dumps([
+            [schema_record.document_reference, schema_record.label,
+             schema_record.dataset_uuid]
+            for schema_record in schema_records]).encode('utf-8'))
+        return signature.hexdigest()
+
     def find_geonorge_schema_identifier(self, schema_locations):
         """
         Find and process the schema identifier from Geonorge
@@ -92,48 +109,44 @@ class SchemaUtils:
         applies schema overrides if they are specified in the configuration.
 
         Args:
-            schema_locations (list): List of schema locations to check.
+            schema_locations (list): (namespace, schema location) pairs
+                to check.
 
         Returns:
             str: The relevant schema identifier if found, otherwise None.
         """
         # Fetch schemas from Geonorge
         geonorge_schemas = self.fetch_geonorge_schemas()
+        schema_register_index = self.schema_register_index
 
         matching_schemas = []
 
         # Iterate through schema locations to find matches
-        for _, schema_location_row in schema_locations.iterrows():
-            schema_location = schema_location_row['schemalocation']
-            matching_schema = geonorge_schemas[
-                geonorge_schemas['documentreference'].str.lower() ==
-                schema_location.lower()
-            ]
-
-            if matching_schema.empty:
+        for _, schema_location in schema_locations:
+            position = schema_register_index.find_exact(schema_location)
+
+            if position is None:
                 schema_location_with_https_trimmed = schema_location.split(
                     '://', 1)[-1]
-                matching_schema = geonorge_schemas[
-                    geonorge_schemas['documentreference'].str.lower().str.endswith(
-                        schema_location_with_https_trimmed.lower())
-                ]
-                if not matching_schema.empty:
+                position = schema_register_index.find_suffix(
+                    schema_location_with_https_trimmed)
+                if position is not None:
                     log.warning(
                         "The http:// or https:// prefixes " +
                         "were ignored during the matching process " +
                         "with the Geonorge schema:{0}.".format(schema_location)
                         )
 
-            if matching_schema.empty:
+            if position is None:
                 log.warning(
                     f'Schema not found in Geonorge register: {schema_location}'
                     )
             else:
+                matching_schema = geonorge_schemas[position]
                 log.info(
                     'Schema found in Geonorge register: {0} - Label: {1}'
-                    .format(matching_schema['documentreference'].values[0],
-                            matching_schema['label']
-                            .values[0]))
+                    .format(matching_schema.document_reference,
+                            matching_schema.label))
                 matching_schemas.append(matching_schema)
 
         # Check if any schemas were found
@@ -147,40 +160,77 @@ class SchemaUtils:
             return
 
         matching_schema = matching_schemas[0]
-        schema_identifier = matching_schema['DatasetUuid'].values[0]
+        schema_identifier = self.get_schema_identifier(
+            matching_schema.dataset_uuid, matching_schema.label)
+
+        if not schema_identifier:
+            log.error("No schema identifier found for GML file {}"
+                      .format(schema_location))
+        return schema_identifier
+
+    def get_schema_identifier(self, dataset_uuid, label):
+        """
+        Get the identifier used to look up the styles of a schema: the
+        DatasetUuid if it is a valid GUID, otherwise the label, with the
+        schema overrides from the configuration applied.
+
+        Args:
+            dataset_uuid (str): DatasetUuid of the schema, may be None.
+            label (str): Label of the schema.
+
+        Returns:
+            str: The schema identifier.
+        """
+        schema_identifier = dataset_uuid
 
         if schema_identifier and self.is_guid(schema_identifier):
             log.info(f"DatasetUuid for Schema: {schema_identifier}")
         else:
-            schema_identifier = matching_schema['label'].values[0]
+            schema_identifier = label
             log.info("No DatasetUuid for Schema, label is used instead: {}"
                      .format(schema_identifier))
 
         # Apply schema overrides if any
-        schema_overrides = self.config.get('schemaOverrides', [])
-        if schema_overrides:
-            schema_identifier = self.override_schema_identifier(
-                schema_identifier, schema_overrides)
-        if not schema_identifier:
-            log.error("No schema identifier found for GML file {}"
-                      .format(schema_location))
+        schema_rules = Overrides.get_schema_rules()
+        if schema_rules:
+            schema_identifier = self.apply_schema_rules(
+                schema_identifier, schema_rules)
         return schema_identifier
 
+    def get_all_schema_identifiers(self):
+        """
+        Get the unique schema identifiers of all schemas in the Geonorge
+        register and the whitelist, in register order.
+
+        Returns:
+            list: Schema identifiers, empty if the register is unavailable.
+        """
+        geonorge_schemas = self.fetch_geonorge_schemas()
+        if geonorge_schemas is None:
+            return []
+
+        schema_identifiers = [
+            self.get_schema_identifier(schema_record.dataset_uuid,
+                                       schema_record.label)
+            for schema_record in geonorge_schemas]
+        return list(dict.fromkeys(
+            schema_identifier for schema_identifier in schema_identifiers
+            if schema_identifier and isinstance(schema_identifier, str)))
+
     def override_schema_identifier(self, schema_label, schema_overrides):
-        log.info("=== Applying schema overrides ===")
-        for override in schema_overrides:
-            new_schema_label = None
-            if override['exactMatch']:
-                if schema_label == override['sourceLabel']:
-                    new_schema_label = override['targetLabel']
-            else:
-                if override['sourceLabel'] in schema_label:
-                    new_schema_label = override['targetLabel']
+        return self.apply_schema_rules(
+            schema_label,
+            OverrideRules([override for override in schema_overrides
+                           if override['targetLabel']],
+                          'sourceLabel', 'targetLabel'))
 
-            if new_schema_label:
-                log.warning("Schema override applied: {0} -> {1}"
-                            .format(schema_label, new_schema_label))
-                return new_schema_label
+    def apply_schema_rules(self, schema_label, schema_rules):
+        log.info("=== Applying schema overrides ===")
+        new_schema_label = schema_rules.lookup(schema_label)
+        if new_schema_label:
+            log.warning("Schema override applied: {0} -> {1}"
+                        .format(schema_label, new_schema_label))
+            return new_schema_label
         log.info("No schema override applied")
         return schema_label
 
@@ -190,3 +240,55 @@ class SchemaUtils:
             return True
         except ValueError:
             return False
+
+
+class SchemaRegisterIndex:
+    """
+    Lookup of schema locations in the document references of the schema
+    register, built once per register load.
+
+    Matching is case insensitive. find_exact() is a dict lookup.
+    find_suffix() finds the references that end with a location, the
+    fallback used when only the scheme differs, with a binary search in
+    the sorted reversed references. Both return the position of the first
+    matching row in register order, like a scan of the register would.
+    """
+
+    def __init__(self, document_references):
+        self.exact_positions = {}
+        reversed_references = []
+        for position, document_reference in enumerate(document_references):
+            if not isinstance(document_reference, str):
+                continue
+            document_reference = document_reference.lower()
+            self.exact_positions.setdefault(document_reference, position)
+            reversed_references.append((document_reference[::-1], position))
+        reversed_references.sort()
+        self.reversed_references = [reference for reference, _
+                                    in reversed_references]
+        self.reversed_positions = [position for _, position
+                                   in reversed_references]
+
+    def find_exact(self, schema_location):
+        """
+        :return: Position of the first reference equal to schema_location.
+        :rtype: int or None
+        """
+        return self.exact_positions.get(schema_location.lower())
+
+    def find_suffix(self, schema_location):
+        """
+        :return: Position of the first reference ending with
+            schema_location.
+        :rtype: int or None
+        """
+        reversed_location = schema_location.lower()[::-1]
+        start = bisect_left(self.reversed_references, reversed_location)
+        position = None
+        for index in range(start, len(self.reversed_references)):
+            if not self.reversed_references[index].startswith(
+                    reversed_location):
+                break
+            if position is None or self.reversed_positions[index] < position:
+                position = self.reversed_positions[index]
+        return position
@@ -0,0 +1,119 @@
+from queue import Queue
+from threading import Lock, Thread
+from .logging_setup import logger as log
+
+# Marks the end of the input on a stage queue
+END = object()
+
+
+class StagedPipeline:
+    """
+    Runs items through a sequence of stages, each stage on its own worker
+    threads, with bounded queues between the stages. While one item is in
+    a late stage the next items can be in the earlier ones.
+
+    A stage function takes an item and returns it (or a new item) for the
+    next stage, or None to stop processing the item. Results are returned
+    in input order, so the output is the same as running the stages one
+    item at a time. An exception in a stage is raised again when the item
+    it belongs to is returned.
+    """
+
+    def __init__(self, stages, queue_size=2, is_canceled=None):
+        """
+        input:
+            stages: list of (name, function, number of workers)
+            queue_size: int, items waiting in front of each stage
+            is_canceled: callable, items are dropped once it returns True
+        """
+        self.stages = stages
+        self.queue_size = max(queue_size, 1)
+        self.is_canceled = is_canceled or (lambda: False)
+
+    def run(self, items):
+        """
+        Generator of (item, result) pairs in the order of items. The result
+        is None for items a stage stopped. Stopping the generator early
+        stops the pipeline.
+        """
+        items = list(items)
+        queues = [Queue(self.queue_size) for _ in self.stages]
+        # Finished or stopped items go straight to the collector, which
+        # never blocks the workers
+        results = Queue()
+        self.stopped = False
+
+        # The first stage needs one end marker per worker
+        self.first_stage_workers = max(self.stages[0][2] or 1, 1)
+        threads = [Thread(target=self.feed, args=(items, queues[0]),
+                          daemon=True)]
+        for stage_index, (name, function, workers) in enumerate(
+                self.stages):
+            workers = max(workers or 1, 1)
+            next_queue = (queues[stage_index + 1]
+                          if stage_index + 1 < len(self.stages) else None)
+            next_workers = (max(self.stages[stage_index + 1][2] or 1, 1)
+                            if next_queue is not None else 0)
+            remaining = [workers]
+            remaining_lock = Lock()
+            for _ in range(workers):
+                threads.append(Thread(
+                    target=self.work,
+                    args=(name, function, queues[stage_index], next_queue,
+                          next_workers, results, remaining, remaining_lock),
+                    daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        finished = {}
+        try:
+            for index, item in enumerate(items):
+                while index not in finished:
+                    result_index, result, error = results.get()
+                    finished[result_index] = (result, error)
+                result, error = finished.pop(index)
+                if error is not None:
+                    raise error
+                yield item, result
+        finally:
+            self.stopped = True
+            for thread in threads:
+                thread.join()
+
+    def feed(self, items, first_queue):
+        for index, item in enumerate(items):
+            first_queue.put((index, item))
+        for _ in range(self.first_stage_workers):
+            first_queue.put(END)
+
+    def work(self, name, function, in_queue, next_queue, next_workers,
+             results, remaining, remaining_lock):
+        try:
+            while True:
+                entry = in_queue.get()
+                if entry is END:
+                    break
+                index, item = entry
+                if self.stopped or self.is_canceled():
+                    results.put((index, None, None))
+                    continue
+                try:
+                    result = function(item)
+                except Exception as e:
+                    log.error("Pipeline stage '{0}' failed: {1}"
+                              .format(name, e))
+                    results.put((index, None, e))
+                    continue
+                if result is None or next_queue is None:
+                    results.put((index, result, None))
+                else:
+                    next_queue.put((index, result))
+        finally:
+            # The last worker of a stage ends the next stage
+            with remaining_lock:
+                remaining[0] -= 1
+                last_worker = remaining[0] == 0
+            if last_worker and next_queue is not None:
+                for _ in range(next_workers):
+                    next_queue.put(END)
@@ -0,0 +1,90 @@
+from hashlib import sha1
+from json import dumps, loads
+from .cache_store import CacheStore
+from .config_loader import ConfigLoader
+from .logging_setup import logger as log
+
+# Part of every fingerprint; increase when the way get_style_name chooses
+# a style changes, so decisions made by an older version are not reused
+MATCHING_VERSION = 1
+
+
+class StyleDecisionCache:
+    """
+    Persistent cache of the styles chosen for the GML nodes and geometries
+    of a theme.
+
+    All decisions of a theme are stored as one entry, keyed by a
+    fingerprint of the theme and the preferred format. The fingerprint
+    covers the style names and formats of the theme in order and the GML
+    node overrides of the theme, so decisions are only reused while
+    everything they were made from is unchanged; when the theme's style
+    list changes, its old entry is simply no longer found and is evicted
+    in time. An entry is read once per run and written once at the end of
+    a run that added decisions.
+    """
+
+    def __init__(self):
+        config = ConfigLoader().load_qgis_config()
+        cache_config = config.get('cache', {}).get('style_decisions', {})
+        self.store = CacheStore(
+            'style_decisions',
+            max_entries=cache_config.get('max_entries', 1000))
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_theme_fingerprint(schema_identifier, styles):
+        """
+        Get the fingerprint of the styles and GML node overrides of a
+        theme.
+        input:
+            schema_identifier: str
+            styles: list of StyleRecord
+        output:
+            str
+        """
+        node_overrides = ConfigLoader().load_resources_config().get(
+            'schemaNodeOverrides', {}).get(schema_identifier)
+        fingerprint = sha1(dumps([
+            MATCHING_VERSION,
+            [[style.style_name, style.format] for style in styles],
+            node_overrides,
+        ]).encode('utf-8'))
+        return fingerprint.hexdigest()
+
+    @staticmethod
+    def get_key(fingerprint, style_format):
+        return dumps([fingerprint, style_format])
+
+    def get(self, fingerprint, style_format):
+        """
+        Get the cached style decisions of a theme.
+        output:
+            dict: {(gml_node, geometry): style_name}, where style_name is
+            None if no style was found. Empty on a cache miss.
+        """
+        entry = self.store.get(self.get_key(fingerprint, style_format))
+        if entry is None:
+            self.misses += 1
+            return {}
+        self.hits += 1
+        return {(gml_node, geometry): style_name
+                for gml_node, geometry, style_name
+                in loads(entry['value'])}
+
+    def put(self, fingerprint, style_format, style_decisions):
+        """
+        Store the style decisions of a theme, replacing the cached ones.
+        input:
+            style_decisions: dict {(gml_node, geometry): style_name}
+        """
+        self.store.put(
+            self.get_key(fingerprint, style_format),
+            dumps([[gml_node, geometry, style_name]
+                   for (gml_node, geometry), style_name
+                   in style_decisions.items()]))
+
+    def log_statistics(self):
+        log.info("Style decision cache: {0} hits, {1} misses"
+                 .format(self.hits, self.misses))
@@ -0,0 +1,97 @@
+from time import time
+from .api_call_manager import ApiCallManager as acm
+from .cache_store import CacheStore
+from .config_loader import ConfigLoader
+from .logging_setup import logger as log
+
+
+class StyleFileCache:
+    """
+    Persistent HTTP cache for QML/SLD style files, keyed by file URL.
+
+    Entries younger than 'max_age_hours' are served without any network
+    traffic. Older entries are revalidated with a conditional GET using
+    the stored ETag/Last-Modified, so an unchanged file costs a 304
+    response without a body. If revalidation fails, the stale copy is
+    used.
+    """
+
+    def __init__(self):
+        config = ConfigLoader().load_qgis_config()
+        cache_config = config.get('cache', {}).get('style_files', {})
+        self.max_age = cache_config.get('max_age_hours', 24) * 3600
+        self.store = CacheStore(
+            'style_files',
+            max_bytes=cache_config.get('max_bytes', 100 * 1024 * 1024))
+
+    def is_fresh(self, entry):
+        return time() - entry['stored_at'] < self.max_age
+
+    @staticmethod
+    def get_conditional_headers(entry):
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def fetch(self, urls, is_canceled=None):
+        """
+        Get the bodies of the style files at urls.
+
+        Fresh cache entries are returned directly, the rest are fetched
+        (or revalidated) concurrently in one batch.
+        input:
+            urls: list of str
+            is_canceled: callable, the downloads are aborted once it
+            returns True
+        output:
+            list of bytes (None for files that could not be retrieved),
+            in the same order as urls
+        """
+        bodies = [None] * len(urls)
+        entries = {}
+        positions_to_fetch = []
+        headers = []
+        for position, url in enumerate(urls):
+            entry = self.store.get(url)
+            if entry is not None and self.is_fresh(entry):
+                bodies[position] = entry['value']
+                continue
+            if entry is not None:
+                entries[position] = entry
+            positions_to_fetch.append(position)
+            headers.append(
+                self.get_conditional_headers(entry) if entry else None)
+
+        log.info("Style file cache: {0} fresh, {1} to fetch or revalidate"
+                 .format(len(urls) - len(positions_to_fetch),
+                         len(positions_to_fetch)))
+        if not positions_to_fetch:
+            return bodies
+
+        api_call_new = acm()
+        responses = api_call_new.get_many(
+            [urls[position] for position in positions_to_fetch], headers,
+            is_canceled)
+
+        for position, response in zip(positions_to_fetch, responses):
+            url = urls[position]
+            entry = entries.get(position)
+            if entry is not None and response.status_code == 304:
+                log.debug("Style file not modified: '{}'".format(url))
+                self.store.touch(url)
+                bodies[position] = entry['value']
+            elif response.ok and response.data:
+                body = bytes(response.data)
+                self.store.put(url, body,
+                               etag=response.headers.get('etag'),
+                               last_modified=response.headers.get(
+                                   'last-modified'))
+                bodies[position] = body
+            elif entry is not None:
+                log.warning("Could not revalidate style file, using cached "
+                            "copy: '{}'".format(url))
+                bodies[position] = entry['value']
+        return bodies
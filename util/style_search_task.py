@@ -0,0 +1,66 @@
+from qgis.core import QgsTask
+from qgis.PyQt.QtCore import pyqtSignal
+from ..ui.ui_helpers import UIHelpers
+from .gml_processor import GMLProcessor
+from .logging_setup import logger as log
+
+
+class TaskUIHelpers(UIHelpers):
+    """
+    UIHelpers for code running in a background task.
+
+    The message bar belongs to the main thread, so message bar calls are
+    sent to the main thread through the task's 'message' signal. The
+    message log is thread safe and is written to directly.
+    """
+
+    def __init__(self, task):
+        super(TaskUIHelpers, self).__init__(iface=None)
+        self.task = task
+
+    def message_bar_critial(self, message):
+        self.task.message.emit('critical', message)
+
+    def message_bar_info(self, message):
+        self.task.message.emit('info', message)
+
+    def message_bar_warning(self, message):
+        self.task.message.emit('warning', message)
+
+    def message_bar_success(self, message):
+        self.task.message.emit('success', message)
+
+
+class StyleSearchTask(QgsTask):
+    """
+    Background task that finds the styles for the selected GML layers:
+    schema lookup, theme search, style matching and style file download.
+
+    Progress and the files finished so far are reported through signals,
+    and the task can be canceled between GML files. The result is read
+    from 'layer_styles' when the task has completed.
+    """
+
+    # current step, total steps, root filename
+    gml_file_started = pyqtSignal(int, int, str)
+    # root filename, list of LayerStyle of the layers with styles
+    gml_file_finished = pyqtSignal(str, object)
+    # message bar level, message
+    message = pyqtSignal(str, str)
+
+    def __init__(self, gml_layer_groups):
+        super(StyleSearchTask, self).__init__(
+            "Geonorge tegneregelassistent: søker etter tegneregler",
+            QgsTask.CanCancel)
+        self.gml_layer_groups = gml_layer_groups
+        self.layer_styles = None
+
+    def run(self):
+        try:
+            gml_processor = GMLProcessor(TaskUIHelpers(self), task=self)
+            self.layer_styles = gml_processor.process_gml_files(
+                self.gml_layer_groups)
+        except Exception as e:
+            log.error("Style search failed: {}".format(e))
+            return False
+        return not self.isCanceled()
@@ -1,84 +1,205 @@
 import re
-from .api_call_manager import ApiCallManager as acm
+from threading import Event, Lock
 from .logging_setup import logger as log
-from pandas import DataFrame
 from .config_loader import ConfigLoader
 from .geonorge_apis import GeonorgeAPI
+from .style_file_cache import StyleFileCache
+from .offline_bundle import OfflineBundle
+from .override_rules import Overrides
+from .records import StyleRecord
+
+WORD = re.compile(r'\w+')
+
+# Geometry keywords in style names, as bits of the 'geometry_keywords' of
+# the theme styles
+POINT_KEYWORDS = 1
+LINE_KEYWORDS = 2
+POLYGON_KEYWORDS = 4
+GEOMETRY_KEYWORDS = {'punkt': POINT_KEYWORDS,
+                     'linje': LINE_KEYWORDS,
+                     'område': POLYGON_KEYWORDS,
+                     'sone': POLYGON_KEYWORDS}
+
+# GML geometry type -> (keywords of appropriate styles, keywords of
+# styles that are not appropriate)
+GEOMETRY_KEYWORD_RULES = {
+    'point': (POINT_KEYWORDS, POLYGON_KEYWORDS | LINE_KEYWORDS),
+    'polygon': (POLYGON_KEYWORDS, POINT_KEYWORDS | LINE_KEYWORDS),
+    'line': (LINE_KEYWORDS, POINT_KEYWORDS)}
+
+
+class StyleNameIndex:
+    """
+    Word index over the style names of a theme.
+
+    A GML node name matches a style name when it occurs in it as a whole
+    word, ignoring case, i.e. re.search(rf'(?i)\b{name}\b', style_name).
+    For a name that is a single word this is the same as the name being
+    one of the words of the style name, so the matching style names are
+    found with one dict lookup instead of a regex per style.
+    """
+
+    def __init__(self, style_names):
+        """
+        input:
+            style_names: iterable of str, the style names of the theme
+            styles
+        """
+        self.style_names = list(style_names)
+        self.positions = {}
+        for position, style_name in enumerate(self.style_names):
+            for word in dict.fromkeys(
+                    word.lower() for word in WORD.findall(style_name)):
+                self.positions.setdefault(word, []).append(position)
+
+    def find(self, name):
+        """
+        Return the style names containing name as a whole word, in the
+        order of the styles.
+        """
+        return [self.style_names[position]
+                for position in self.find_positions(name)]
+
+    def find_positions(self, name):
+        """
+        Return the positions of the style names containing name as a
+        whole word, in ascending order.
+        """
+        if WORD.fullmatch(name):
+            return self.positions.get(name.lower(), [])
+
+        # Names with other characters are used as a pattern, as before
+        pattern = re.compile(rf'(?i)(\b{name}\b)')
+        return [position
+                for position, style_name in enumerate(self.style_names)
+                if pattern.search(style_name)]
 
 
 class LayerStylesUpdater:
 
+    # Decoded style files of the current run, keyed by file URL
+    style_file_strings = {}
+
+    # Style files fetched or being fetched in the current run, keyed by
+    # file URL; the event is set when the fetch has finished
+    style_file_fetches = {}
+    style_file_fetches_lock = Lock()
+
     @staticmethod
-    def get_styles_for_theme(theme):
-        """Fetch and return styles for the specified theme."""
+    def get_styles_for_theme(theme, is_canceled=None):
+        """
+        Fetch and return styles for the specified theme.
+        input:
+            is_canceled: callable, e.g. QgsTask.isCanceled of the task
+            the styles are fetched for
+        output:
+            list: StyleRecord, empty if the theme has no styles
+        """
         log.info("=== Get styles for theme ===")
         geonorge_api = GeonorgeAPI()
-        json_styles = geonorge_api.get_styles_for_theme(theme)
+        json_styles = geonorge_api.get_styles_for_theme(
+            theme, is_canceled)
 
         if not json_styles:
             log.debug("No styles data retrieved from Geonorge for theme "
                       f"'{theme}'.")
-            return DataFrame()
+            return []
         stiles_file = json_styles.get('Files')
         if not stiles_file:
             log.error(f"Empty style data for theme '{theme}'. "
                       "Theme exists but has no styles.")
-            return DataFrame()
-        styles_df = DataFrame(stiles_file)
+            return []
+        styles = [StyleRecord.from_cartography(item) for item in stiles_file]
 
-        columns = ['Uuid', 'Name', 'OwnerDataset', 'Format', 'DatasetName',
-                   'Status', 'Theme', 'FileUrl', 'DetailsUrl']
-        styles_df = styles_df[columns]
-        styles_df.rename(columns={'Name': 'StyleName'}, inplace=True)
         log.info("Successfully retrieved styles for theme '{}'. ({}) "
-                 "styles where found".format(theme, len(styles_df)))
-        return styles_df
+                 "styles where found".format(theme, len(styles)))
+        return styles
 
     @staticmethod
-    def filter_styles_by_formats(theme_styles_df):
+    def filter_styles_by_formats(theme_styles):
         """Filter styles by supported formats."""
         log.info("=== Filter styles by supported formats ===")
         supported_formats = ['sld', 'qml']
-        styles_formats = theme_styles_df.get('Format')
 
-        if styles_formats is None:
+        if not theme_styles:
             log.error("No formats found for the theme.")
-            return DataFrame()
+            return []
 
-        supported_formats_df = theme_styles_df[
-            theme_styles_df['Format'].isin(supported_formats)]
+        supported_styles = [style for style in theme_styles
+                            if style.format in supported_formats]
 
-        if supported_formats_df.empty:
+        if not supported_styles:
             log.warning("No supported formats found for the theme.")
-            return DataFrame()
+            return []
         else:
             log.info("Found {} supported formats for the theme."
-                     .format(len(supported_formats_df)))
-        return supported_formats_df
+                     .format(len(supported_styles)))
+        return supported_styles
 
     @staticmethod
-    def apply_Gml_node_overrides(layers_df, theme):
-        """Apply GML node overrides based on theme."""
-        config_loader = ConfigLoader()
-        resources = config_loader.load_resources_config()
-        node_overrides = resources.get(
-            'schemaNodeOverrides', {}).get(theme, [])
+    def add_geometry_keywords(styles):
+        """
+        Classify the styles by the geometry keywords in their names.
+        input:
+            styles: list of StyleRecord
+        output:
+            The styles, with 'geometry_keywords' set, see
+            get_geometry_keywords
+        """
+        for style in styles:
+            style.geometry_keywords = (
+                LayerStylesUpdater.get_geometry_keywords(style.style_name))
+        return styles
 
-        if node_overrides:
-            log.info("=== Applying GML node overrides ===")
-            layers_df['mapped_style_name'] = layers_df['Gml_Node'].apply(
-                lambda x:
-                LayerStylesUpdater.override_gml_node_name(x, node_overrides))
-        return layers_df
+    @staticmethod
+    def get_geometry_keywords(style_name):
+        """
+        Return the geometry keywords in a style name as bits, e.g.
+        POINT_KEYWORDS | LINE_KEYWORDS for 'Grense punkt og linje'.
+        """
+        style_name = style_name.lower()
+        geometry_keywords = 0
+        for keyword, bit in GEOMETRY_KEYWORDS.items():
+            if keyword in style_name:
+                geometry_keywords |= bit
+        return geometry_keywords
 
     @staticmethod
-    def get_style_name(row, styles_df, style_format):
+    def apply_Gml_node_overrides(gml_node_names, theme):
+        """
+        Apply GML node overrides based on theme.
+        input:
+            gml_node_names: list of str
+            theme: str
+        output:
+            list: The style name the node is mapped to (or None) for every
+            node, None if the theme has no overrides
+        """
+        node_rules = Overrides.get_node_rules(theme)
+
+        if not node_rules:
+            return None
+        log.info("=== Applying GML node overrides ===")
+        mapped_style_names = node_rules.apply(gml_node_names)
+        applied_overrides = dict(zip(gml_node_names, mapped_style_names))
+        for gml_node_name, style_name in applied_overrides.items():
+            if style_name is not None:
+                log.warning("GML node override applied: {0} -> {1}"
+                            .format(gml_node_name, style_name))
+        return mapped_style_names
+
+    @staticmethod
+    def get_style_name(gml_node_name, gml_geometry_type, styles,
+                       style_format, style_name_index=None,
+                       mapped_style_name=None):
 
         """Determine the appropriate style name
-           based on GML node and geometry."""
-        gml_geometry_type = row['Geometry'].lower()
-        gml_node_name = row['Gml_Node']
-        mapped_style_name = row.get('mapped_style_name')
+           based on GML node and geometry.
+
+           style_name_index is the StyleNameIndex of styles; pass it
+           when matching many nodes against the same styles.
+           mapped_style_name is the GML node override of the node."""
+        gml_geometry_type = gml_geometry_type.lower()
         name_to_find = None
         if mapped_style_name:
             name_to_find = mapped_style_name
@@ -87,10 +208,12 @@ class LayerStylesUpdater:
 
         name_to_find = name_to_find.lower()
 
-        style_names = [
-            style['StyleName'] for _, style in styles_df.iterrows()
-            if re.search(rf'(?i)(\b{name_to_find}\b)', style['StyleName'])
-        ]
+        if style_name_index is None:
+            style_name_index = StyleNameIndex(
+                style.style_name for style in styles)
+        positions = style_name_index.find_positions(name_to_find)
+        style_names = [style_name_index.style_names[position]
+                       for position in positions]
 
         style_count = len(style_names)
 
@@ -98,15 +221,19 @@ class LayerStylesUpdater:
         if style_count == 1:
             style_name = style_names[0]
         elif style_count > 1:
+            geometry_keywords = [styles[position].geometry_keywords
+                                 for position in positions]
+            if None in geometry_keywords:
+                geometry_keywords = None
             style_names_fileter_by_geometry = (
                 LayerStylesUpdater.filter_styles_by_geometry(
-                    style_names, gml_geometry_type))
+                    style_names, gml_geometry_type, geometry_keywords))
 
             if len(style_names_fileter_by_geometry) == 1:
                 style_name = style_names_fileter_by_geometry[0]
             elif style_names_fileter_by_geometry:
                 style_name = LayerStylesUpdater.filter_style_by_format(
-                    style_names_fileter_by_geometry, styles_df, style_format)
+                    style_names_fileter_by_geometry, styles, style_format)
 
         if style_name:
             log.info(
@@ -119,114 +246,212 @@ class LayerStylesUpdater:
         return style_name
 
     @staticmethod
-    def filter_styles_by_geometry(style_names, gml_geometry_type):
-        """Filter styles based on geometry type and format."""
-        appropriate_styles = []
-        temp_styles = []
-        for style_name in style_names:
-            is_valid_style_for_geometry = (
-                LayerStylesUpdater.is_appropriate_style_for_geometry(
-                    style_name, gml_geometry_type))
-
-            if is_valid_style_for_geometry:
-                appropriate_styles.append(style_name)
-                break
-
-            if is_valid_style_for_geometry is None:
-                temp_styles.append(style_name)
+    def filter_styles_by_geometry(style_names, gml_geometry_type,
+                                  geometry_keywords=None):
+        """
+        Filter styles based on geometry type.
+
+        Returns the first style that is appropriate for the geometry (see
+        is_appropriate_style_for_geometry) or, if there is none, all
+        styles that are neither appropriate nor inappropriate.
+        input:
+            style_names: list of str
+            gml_geometry_type: str, e.g. 'Point'
+            geometry_keywords: 'geometry_keywords' of the styles, computed
+            from the names if not given
+        output:
+            list of str
+        """
+        rule = GEOMETRY_KEYWORD_RULES.get(gml_geometry_type.lower())
+        if rule is None:
+            return list(style_names)
+        if geometry_keywords is None:
+            geometry_keywords = [
+                LayerStylesUpdater.get_geometry_keywords(style_name)
+                for style_name in style_names]
+
+        include_keywords, exclude_keywords = rule
+        undecided_styles = []
+        for style_name, keywords in zip(style_names, geometry_keywords):
+            if keywords & exclude_keywords:
                 continue
-
-        if not appropriate_styles:
-            appropriate_styles = temp_styles
-
-        return appropriate_styles
+            if keywords & include_keywords:
+                return [style_name]
+            undecided_styles.append(style_name)
+        return undecided_styles
 
     @staticmethod
     def add_file_string_to_row(row):
         """Fetch and return the file string from the file URL."""
-        if row['Format'] in ['sld', 'qml']:
-            api_call_new = acm()
-            style_url = row['FileUrl']
-
-            # Avoid 301 responses for https resources referenced with http
-            style_url_with_https = style_url.replace('http://', 'https://')
-            if style_url_with_https != style_url:
-                log.warning(
-                    'http:// was replaced with https:// for ' + style_url)
-
-            api_call_new.get(style_url_with_https)
-            xml_response = api_call_new.get_response_data()
-            if xml_response:
-                log.info(
-                    "Successfully retrieved '{}' style for layer '{}'"
-                    .format(row['Format'], row['LayerName']))
-                xml_string = str(xml_response, 'utf-8')
-                return xml_string
-            else:
-                log.error(
-                    "Failed to retrieve the style for layer '{}'"
-                    .format(row['LayerName']))
+        if row.format in ['sld', 'qml']:
+            style_url = LayerStylesUpdater.get_https_url(row.file_url)
+            LayerStylesUpdater.fetch_style_file_strings([style_url])
+            return LayerStylesUpdater.log_style_file_string(
+                row, LayerStylesUpdater.style_file_strings.get(style_url))
         return None
 
     @staticmethod
-    def filter_style_by_format(style_names, styles_df, style_format):
-        """Filter and return style names by the specified format."""
-        df = (styles_df[styles_df['StyleName'].isin(style_names) &
-                        (styles_df['Format'] == style_format)])
-        return df['StyleName'].values[0] if not df.empty else None
-
-    @staticmethod
-    def override_gml_node_name(gml_node_name, node_overrides):
-        """Override GML node name based on configuration."""
-        for override in node_overrides:
-            if (override['exactMatch'] and
-                gml_node_name == override['sourceNode']) or (
-                    not override['exactMatch'] and
-                    override['sourceNode'] in gml_node_name):
-
-                log.warning(
-                    "GML node override applied: {0} -> {1}"
-                    .format(gml_node_name, override['styleName']))
-                return override['styleName']
-        return None
+    def add_file_strings(layer_styles, is_canceled=None):
+        """
+        Fetch the style file strings for all rows at once.
+
+        Every unique style file is fetched once per run, from the style
+        file cache or concurrently on a single ApiCallManager, and its
+        decoded string is shared by all rows that use it.
+        input:
+            layer_styles: list of LayerStyle
+            is_canceled: callable, the downloads are aborted once it
+            returns True
+        output:
+            list: File string (or None) for every layer, in order.
+        """
+        style_urls = {
+            layer_style.file_url: None for layer_style in layer_styles
+            if layer_style.format in ['sld', 'qml']}
+        for file_url in style_urls:
+            style_urls[file_url] = LayerStylesUpdater.get_https_url(file_url)
+
+        LayerStylesUpdater.fetch_style_file_strings(
+            list(style_urls.values()), is_canceled)
+
+        style_file_strings = LayerStylesUpdater.style_file_strings
+        file_strings = []
+        for layer_style in layer_styles:
+            style_url = (style_urls[layer_style.file_url]
+                         if layer_style.format in ['sld', 'qml'] else None)
+            file_strings.append(
+                LayerStylesUpdater.log_style_file_string(
+                    layer_style, style_file_strings.get(style_url))
+                if style_url else None)
+        return file_strings
 
     @staticmethod
-    def is_appropriate_style_for_geometry(style_name, gml_geometry_type):
-        """Check if a style is appropriate for a given geometry type."""
-        gml_geometry_type = gml_geometry_type.lower()
-        style_name = style_name.lower()
+    def fetch_style_file_strings(style_urls, is_canceled=None):
+        """
+        Fetch and decode the style files not yet fetched in this run.
+
+        Safe to call from several threads: a file that another thread is
+        fetching is waited for instead of fetched again.
+        input:
+            style_urls: list of str
+            is_canceled: callable, see add_file_strings()
+        """
+        fetches = LayerStylesUpdater.style_file_fetches
+        urls_to_fetch = []
+        fetches_to_wait_for = []
+        with LayerStylesUpdater.style_file_fetches_lock:
+            for style_url in dict.fromkeys(style_urls):
+                if style_url in fetches:
+                    fetches_to_wait_for.append(fetches[style_url])
+                else:
+                    fetches[style_url] = Event()
+                    urls_to_fetch.append(style_url)
+
+        try:
+            LayerStylesUpdater.fetch_and_decode_style_files(
+                urls_to_fetch, is_canceled)
+        finally:
+            for style_url in urls_to_fetch:
+                fetches[style_url].set()
+        for fetch in fetches_to_wait_for:
+            fetch.wait()
+
+    @staticmethod
+    def fetch_and_decode_style_files(urls_to_fetch, is_canceled=None):
+        """
+        Fetch and decode style files from the offline bundle or the style
+        file cache.
+        input:
+            urls_to_fetch: list of str
+            is_canceled: callable, see add_file_strings()
+        """
+        style_file_strings = LayerStylesUpdater.style_file_strings
+        if not urls_to_fetch:
+            return
+
+        # Style files from the installed offline bundle
+        offline_bundle = OfflineBundle.get_installed()
+        if offline_bundle is not None:
+            bundled_files = offline_bundle.get_style_files(urls_to_fetch)
+            for style_url, xml_response in bundled_files.items():
+                style_file_strings[style_url] = str(xml_response, 'utf-8')
+            urls_to_fetch = [style_url for style_url in urls_to_fetch
+                             if style_url not in bundled_files]
+            log.info("{} style files from offline bundle"
+                     .format(len(bundled_files)))
+            if not urls_to_fetch:
+                return
+
+        xml_responses = StyleFileCache().fetch(urls_to_fetch, is_canceled)
+        for style_url, xml_response in zip(urls_to_fetch, xml_responses):
+            if xml_response:
+                style_file_strings[style_url] = str(xml_response, 'utf-8')
 
-        # Define keyword lists for each geometry type
-        polygon_list = ['område', 'sone']
-        point_list = ['punkt']
-        line_list = ['linje']
+    @staticmethod
+    def clear_style_file_strings():
+        """Forget the style files fetched in the previous run."""
+        LayerStylesUpdater.style_file_strings = {}
+        LayerStylesUpdater.style_file_fetches = {}
 
-        if gml_geometry_type == 'point':
-            exclude_list = polygon_list + line_list
-            return LayerStylesUpdater.check_style_appropriateness(
-                style_name, point_list, exclude_list)
+    @staticmethod
+    def get_style_file_url(row):
+        """
+        Return the style file URL of a file of the cartography API JSON,
+        using https.
+        """
+        return LayerStylesUpdater.get_https_url(row['FileUrl'])
 
-        elif gml_geometry_type == 'polygon':
-            exclude_list = point_list + line_list
-            return LayerStylesUpdater.check_style_appropriateness(
-                style_name, polygon_list, exclude_list)
+    @staticmethod
+    def get_https_url(style_url):
+        """
+        Return the style file URL using https, unless
+        'network.upgrade_to_https' is turned off in the config.
+        """
+        network_config = ConfigLoader().load_qgis_config().get('network', {})
+        if not network_config.get('upgrade_to_https', True):
+            return style_url
+
+        # Avoid 301 responses for https resources referenced with http
+        style_url_with_https = style_url.replace('http://', 'https://')
+        if style_url_with_https != style_url:
+            log.warning(
+                'http:// was replaced with https:// for ' + style_url)
+        return style_url_with_https
 
-        elif gml_geometry_type == 'line':
-            exclude_list = point_list
-            return LayerStylesUpdater.check_style_appropriateness(
-                style_name, line_list, exclude_list)
+    @staticmethod
+    def log_style_file_string(layer_style, xml_string):
+        """Log the outcome of fetching the style file of a layer."""
+        if xml_string:
+            log.info(
+                "Successfully retrieved '{}' style for layer '{}'"
+                .format(layer_style.format, layer_style.layer_name))
+            return xml_string
 
+        log.error(
+            "Failed to retrieve the style for layer '{}'"
+            .format(layer_style.layer_name))
         return None
 
     @staticmethod
-    def check_style_appropriateness(style_name, include_list, exclude_list):
-        """Check if a style name is appropriate based on
-        include and exclude lists."""
-        is_included = any(keyword in style_name for keyword in include_list)
-        is_excluded = any(keyword in style_name for keyword in exclude_list)
+    def filter_style_by_format(style_names, styles, style_format):
+        """Filter and return style names by the specified format."""
+        return next(
+            (style.style_name for style in styles
+             if style.style_name in style_names and
+             style.format == style_format), None)
 
-        if is_included and not is_excluded:
-            return True
-        elif is_excluded:
+    @staticmethod
+    def is_appropriate_style_for_geometry(style_name, gml_geometry_type):
+        """Check if a style is appropriate for a given geometry type."""
+        rule = GEOMETRY_KEYWORD_RULES.get(gml_geometry_type.lower())
+        if rule is None:
+            return None
+
+        include_keywords, exclude_keywords = rule
+        geometry_keywords = LayerStylesUpdater.get_geometry_keywords(
+            style_name)
+        if geometry_keywords & exclude_keywords:
             return False
+        if geometry_keywords & include_keywords:
+            return True
         return None
@@ -0,0 +1,27 @@
+from qgis.core import QgsTask
+from .gml_processor import GMLProcessor
+from .logging_setup import logger as log
+
+
+class WarmUpTask(QgsTask):
+    """
+    Background task that fills the caches for the GML files in the
+    project before the user starts a search: the schema register, the
+    schema identifiers of the files and their theme listings. Failures
+    are only logged; the search fetches whatever is missing.
+    """
+
+    def __init__(self, gml_file_paths):
+        super(WarmUpTask, self).__init__(
+            "Geonorge tegneregelassistent: forbereder tegneregler",
+            QgsTask.CanCancel | QgsTask.Silent)
+        self.gml_file_paths = gml_file_paths
+
+    def run(self):
+        try:
+            gml_processor = GMLProcessor(ui_helpers=None, task=self)
+            gml_processor.warm_up(self.gml_file_paths)
+        except Exception as e:
+            log.error("Warm-up failed: {}".format(e))
+            return False
+        return not self.isCanceled()
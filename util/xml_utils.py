@@ -1,28 +1,228 @@
-import pandas as pd
-from xml.etree.ElementTree import parse
+from contextlib import contextmanager
+from gzip import open as gzip_open
+from os import stat
+from os.path import abspath, basename, splitext
+from re import match, search, IGNORECASE
+from xml.etree.ElementTree import XMLPullParser, ParseError
+from zipfile import ZipFile
 from .logging_setup import logger as log
 
+# Bytes fed to the parser per read while looking for the root start tag
+HEADER_CHUNK_SIZE = 64 * 1024
+
+# GDAL virtual file system prefixes used by QGIS for compressed sources
+VSIZIP_PREFIX = '/vsizip/'
+VSIGZIP_PREFIX = '/vsigzip/'
+
+
+def split_gml_source(source_path):
+    """
+    Split a (possibly compressed) GML source path into its parts.
+
+    Handles plain paths, '.gml.gz' files, '.zip' archives and the GDAL
+    '/vsizip/' and '/vsigzip/' prefixes, including the
+    '/vsizip/{archive.zip}/member.gml' form.
+    input:
+        source_path: str
+    output:
+        tuple: (kind, physical_path, member) where kind is one of
+        'plain', 'gzip' or 'zip', physical_path is the file on disk and
+        member is the archive member (None if not given).
+    """
+    path = source_path
+    if path.lower().startswith(VSIGZIP_PREFIX):
+        return 'gzip', path[len(VSIGZIP_PREFIX):], None
+
+    if path.lower().startswith(VSIZIP_PREFIX):
+        path = path[len(VSIZIP_PREFIX):]
+        braced = match(r'^\{(.+)\}(?:/(.*))?$', path)
+        if braced:
+            return 'zip', braced.group(1), braced.group(2) or None
+        zipped = match(r'^(.*?\.zip)(?:/(.*))?$', path, IGNORECASE)
+        if zipped:
+            return 'zip', zipped.group(1), zipped.group(2) or None
+        return 'zip', path, None
+
+    if path.lower().endswith('.gz'):
+        return 'gzip', path, None
+    if path.lower().endswith('.zip'):
+        return 'zip', path, None
+    return 'plain', path, None
+
+
+def find_gml_member(archive):
+    """
+    Return the name of the first GML member in a zip archive.
+    input:
+        archive: ZipFile
+    output:
+        str or None
+    """
+    return next((name for name in archive.namelist()
+                 if name.lower().endswith('.gml')), None)
+
+
+def get_gml_source_name(source_path, zip_members=None):
+    """
+    Get the base name and file type of the GML file behind a source path.
+
+    Compression suffixes and archive paths are stripped, so
+    '/vsizip//data/plan.zip/plan.gml' and 'plan.gml.gz' both give
+    ('plan', '.gml').
+    input:
+        source_path: str
+        zip_members: dict {archive path: GML member}, shared by the calls
+        of one run so each archive is opened at most once
+    output:
+        tuple: (root_filename, file_type)
+    """
+    kind, physical_path, member = split_gml_source(source_path)
+    name = basename(physical_path)
+    if kind == 'gzip' and name.lower().endswith('.gz'):
+        name = name[:-len('.gz')]
+    elif kind == 'zip':
+        if member is None:
+            member = get_zip_gml_member(physical_path, zip_members)
+        name = basename(member) if member else name[:-len('.zip')]
+    return splitext(name)
+
+
+def get_zip_gml_member(zip_path, zip_members=None):
+    """
+    Return the first GML member of the zip file at zip_path, or None.
+    input:
+        zip_path: str
+        zip_members: dict {archive path: GML member}, looked up before
+        the archive is opened and updated after
+    """
+    if zip_members is not None and zip_path in zip_members:
+        return zip_members[zip_path]
+    try:
+        with ZipFile(zip_path) as archive:
+            member = find_gml_member(archive)
+    except (OSError, ValueError) as e:
+        log.error("Could not read zip archive '{}': {}".format(zip_path, e))
+        member = None
+    if zip_members is not None:
+        zip_members[zip_path] = member
+    return member
+
+
+def get_file_identity(source_path):
+    """
+    Get the identity of the file behind a GML source.
+
+    The identity changes whenever the file on disk is replaced or
+    modified, so it can be used to validate cached results.
+    input:
+        source_path: str
+    output:
+        list: [physical_path, size, mtime_ns, inode] or None if the file
+        cannot be read.
+    """
+    _, physical_path, _ = split_gml_source(source_path)
+    try:
+        file_stat = stat(physical_path)
+    except OSError:
+        return None
+    return [abspath(physical_path), file_stat.st_size,
+            file_stat.st_mtime_ns, file_stat.st_ino]
+
+
+@contextmanager
+def open_gml_stream(source_path):
+    """
+    Open a GML source as a binary stream without extracting it to disk.
+
+    Gzip and zip sources are decompressed on the fly, so reading the
+    header only inflates the first blocks of the stream.
+    input:
+        source_path: str
+    output:
+        binary file-like object
+    """
+    kind, physical_path, member = split_gml_source(source_path)
+    if kind == 'gzip':
+        with gzip_open(physical_path, 'rb') as stream:
+            yield stream
+    elif kind == 'zip':
+        with ZipFile(physical_path) as archive:
+            member = member or find_gml_member(archive)
+            if member is None:
+                raise FileNotFoundError(
+                    "No GML file found in '{}'".format(physical_path))
+            with archive.open(member) as stream:
+                yield stream
+    else:
+        with open(physical_path, 'rb') as stream:
+            yield stream
+
+
+def read_root_attributes(stream, chunk_size=HEADER_CHUNK_SIZE):
+    """
+    Read the attributes of the root element from an XML stream.
+
+    The stream is fed to a pull parser in chunks and reading stops as soon
+    as the start tag of the root element has been parsed, so only the
+    header of the document is read no matter how large the file is.
+
+    :param stream: Binary file-like object positioned at the document start.
+    :type stream: io.BufferedIOBase
+    :param chunk_size: Number of bytes to read per step.
+    :type chunk_size: int
+    :return: Attributes of the root element, or None if no root was found.
+    :rtype: dict
+    """
+    parser = XMLPullParser(events=('start',))
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            # Parse errors are raised when the events are read
+            for _, element in parser.read_events():
+                return dict(element.attrib)
+    except ParseError as e:
+        log.error("Could not parse the XML header: {}".format(e))
+    return None
+
+
+def read_schema_location(xml_path):
+    """
+    Read the schemaLocation attribute from the root element of an XML file.
+
+    :param xml_path: Path to the XML file, optionally gzipped, zipped or
+        given as a GDAL '/vsizip/' or '/vsigzip/' path.
+    :type xml_path: str
+    :return: The raw schemaLocation value, or None if it is missing.
+    :rtype: str
+    """
+    with open_gml_stream(xml_path) as stream:
+        root_attributes = read_root_attributes(stream)
+
+    if not root_attributes:
+        return None
+
+    return next(
+        (value for key, value in root_attributes.items()
+            if key.endswith('schemaLocation')), None)
+
 
 def get_gml_schemalocations(xml_path):
     """
-    Extracts namespaces and schema locations from an XML file and
-    returns them as a pandas DataFrame.
+    Extracts namespaces and schema locations from an XML file.
 
     :param xml_path: Path to the XML file.
     :type xml_path: str
-    :return: DataFrame containing namespaces and schema locations.
-    :rtype: pd.DataFrame
+    :return: (namespace, schema location) pairs, without the known
+        namespaces, or None if the file has no schemaLocation.
+    :rtype: list
     """
     log.info("=== Extracting namespaces and schema locations ===")
     log.info(f" GML file path: '{xml_path}'")
-    # Parse the XML file and get the root element
-    tree = parse(xml_path)
-    root = tree.getroot()
-
-    # Extract schemaLocation attribute from the root element
-    schema_location = next(
-        (value for key, value in root.attrib.items()
-            if key.endswith('schemaLocation')), None)
+    # Only the root start tag is read, not the whole document
+    schema_location = read_schema_location(xml_path)
 
     # If schemaLocation is found, split it into a list
     if schema_location:
@@ -34,21 +234,18 @@ def get_gml_schemalocations(xml_path):
             len(schema_location_list),
             2))
 
-        # Convert the schema dictionary to a DataFrame
-        schema_df = pd.DataFrame(schema_dict.items(),
-                                 columns=["namespace",
-                                 "schemalocation"])
-
-        # Remove known namespaces from the DataFrame
+        # Remove known namespaces
         namespace_whitelist = [
             'www.opengis.net',
             'www.w3.org',
             'www.interactive-instruments.de']
         pattern = '|'.join(namespace_whitelist)
-        filtered_namespace_info = schema_df[
-            ~schema_df["namespace"].str.contains(pattern)]
+        filtered_namespace_info = [
+            (namespace, location)
+            for namespace, location in schema_dict.items()
+            if not search(pattern, namespace)]
         log.info('Schema locations extracted successfully. {}'.format(
-            filtered_namespace_info['schemalocation'].values))
+            [location for _, location in filtered_namespace_info]))
         return filtered_namespace_info
 
     return None